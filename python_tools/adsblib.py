@@ -25,6 +25,10 @@
 # along with this program.  If not, see {http://www.gnu.org/licenses/}.
 
 
+from collections import OrderedDict
+from types import MappingProxyType
+
+import cpr
 import gillham
 
 
@@ -78,6 +82,8 @@ IDENT_CHARSET = ( '','A','B','C','D','E','F','G','H','I','J','K','L','M','N','O'
                  ' ', '', '', '', '', '', '', '', '', '', '', '', '', '', '', '',
                  '0','1','2','3','4','5','6','7','8','9', '', '', '', '', '', ''
                 )
+# Reverse lookup of the character set for encoding
+IDENT_CODES = {char: code for code, char in enumerate(IDENT_CHARSET) if char}
 
 # Emitter category (4 sets are defined)
 CATEGORY_TABLE = {
@@ -93,6 +99,10 @@ CATEGORY_TABLE = {
     'D' : (None, None, None, None, None, None, None, None)
 }
 
+# Message types which repeat unchanged and so are worth caching (identification, aircraft status and aircraft
+# operational status). Position and velocity messages rarely repeat exactly.
+CACHEABLE_TYPES = frozenset((1, 2, 3, 4, 28, 31))
+
 # Emergency state table
 EMERG_STATES = ('',
                 'General emergency',
@@ -433,6 +443,73 @@ def parse_aostatus(msg_type, message):
     return ret
 
 
+def encode_altitude(alt):
+    """Encode a barometric altitude in feet as the 12 bit (Q = 1, 25 ft increment) altitude code of a position message."""
+    n = min(max(int(round((alt + 1000.0) / 25.0)), 0), 0x7ff)
+    return ((n & 0x7f0) << 1) | 0x10 | (n & 0x0f)
+
+
+def encode_ident(ident, category=0, msg_type=4):
+    """Encode an identification message. The inverse of parse_ident().
+
+    ident is the identification string (up to 8 characters from IDENT_CHARSET) and category the emitter
+    category index within the category set implied by msg_type.
+    """
+    
+    if TYPE_TABLE[msg_type][1] != 'IDENT':
+        raise ValueError('Message type {0} is not an IDENT type.'.format(msg_type))
+    
+    message = (msg_type << (ME_LENGTH_BITS - TYPE_LENGTH_BITS)) | ((category & 0x07) << 48)
+    for i, char in enumerate(ident.upper().ljust(8)[:8]):
+        if char not in IDENT_CODES:
+            raise ValueError('Character {0!r} cannot be sent in an identification message.'.format(char))
+        message |= IDENT_CODES[char] << (7 - i) * 6
+    return message
+
+
+def encode_apos(lat, lon, alt, odd, msg_type=11, s_status=0, nic_b=0, time_sync=False):
+    """Encode an airborne position message with barometric altitude. The inverse of parse_apos()."""
+    
+    if msg_type < 9 or msg_type > 18:
+        raise ValueError('Message type {0} is not a barometric airborne position type.'.format(msg_type))
+    
+    cpr_lat, cpr_lon = cpr.encode(lat, lon, odd)
+    return ((msg_type << (ME_LENGTH_BITS - TYPE_LENGTH_BITS)) | (s_status & 0x03) << 49 | (nic_b & 0x01) << 48 |
+            encode_altitude(alt) << 36 | (1 if time_sync else 0) << 35 | (1 if odd else 0) << 34 |
+            cpr_lat << 17 | cpr_lon)
+
+
+def encode_avel(vel_east, vel_north, vert_rate=None, baro_vert_rate=True, nac_v=0, intent_change=False):
+    """Encode a ground speed (subtype 1 or 2) airborne velocity message. The inverse of parse_avel().
+
+    Velocities are in knots and the vertical rate in ft/min. The supersonic subtype is used automatically
+    when either velocity component is too large for the subsonic encoding.
+    """
+    
+    def magnitude(value, scale, limit):
+        return min(int(round(abs(value) / scale)) + 1, limit)
+    
+    subtype = 2 if max(abs(vel_east), abs(vel_north)) > 1021 else 1
+    mult = 4.0 if subtype == 2 else 1.0
+    
+    message = (19 << (ME_LENGTH_BITS - TYPE_LENGTH_BITS)) | subtype << 48 | (1 if intent_change else 0) << 47
+    message |= (nac_v & 0x07) << 43
+    message |= (1 if vel_east < 0 else 0) << 42 | magnitude(vel_east, mult, 1022) << 32
+    message |= (1 if vel_north < 0 else 0) << 31 | magnitude(vel_north, mult, 1022) << 21
+    message |= (1 if baro_vert_rate else 0) << 20
+    if vert_rate is not None:
+        message |= (1 if vert_rate < 0 else 0) << 19 | magnitude(vert_rate, 64.0, 510) << 10
+    return message
+
+
+def encode_astatus(mode_a, emergency=0):
+    """Encode an emergency/priority status (subtype 1) aircraft status message. The inverse of parse_astatus().
+
+    mode_a is the 13 bit Mode A code field and emergency an index into EMERG_STATES.
+    """
+    return (28 << (ME_LENGTH_BITS - TYPE_LENGTH_BITS)) | 1 << 48 | (emergency & 0x07) << 45 | (mode_a & 0x1fff) << 32
+
+
 class Message:
     """A class to hold the data conveyed by an ADS-B message
     
@@ -473,6 +550,70 @@ class Message:
         return self.params
 
 
+class MessageCache:
+    """A bounded LRU cache of decoded messages keyed by the ME field.
+    
+    Only messages of the types in CACHEABLE_TYPES are cached. Cached messages are shared between all the
+    replies that carry the same ME field so their params are made read only.
+    """
+    
+    def __init__(self, size=4096):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._messages = OrderedDict()
+    
+    def get(self, ME):
+        """Return the decoded Message for the ME field, decoding it only if it isn't cached."""
+        ME = int(ME)
+        if (ME >> (ME_LENGTH_BITS - TYPE_LENGTH_BITS)) not in CACHEABLE_TYPES:
+            return Message(ME)
+        
+        try:
+            message = self._messages[ME]
+        except KeyError:
+            self.misses += 1
+            message = Message(ME)
+            message.params = MappingProxyType(message.params)
+            self._messages[ME] = message
+            if len(self._messages) > self.size:
+                self._messages.popitem(last=False)
+            return message
+        
+        self.hits += 1
+        self._messages.move_to_end(ME)
+        return message
+    
+    def clear(self):
+        self._messages.clear()
+    
+    def __len__(self):
+        return len(self._messages)
+
+
+# The cache used by decode(), None when caching is disabled
+message_cache = None
+
+
+def enable_cache(size=4096):
+    """Cache the messages decoded by decode(). Returns the MessageCache, which holds the hit and miss counts."""
+    global message_cache
+    message_cache = MessageCache(size)
+    return message_cache
+
+
+def disable_cache():
+    global message_cache
+    message_cache = None
+
+
+def decode(ME):
+    """Decode the ME field of an extended squitter, using the message cache if it is enabled."""
+    if message_cache is None:
+        return Message(ME)
+    return message_cache.get(ME)
+
+
 if __name__ == '__main__':
     es = int(input('Enter an extended squitter message block in hex (omit the CRC): '), 16)
     m = Message(es & 0xffffffffffffff)
@@ -1,18 +1,39 @@
 #!/usr/bin/env python
 
+import collections
 import time
 
+import cpr
+from modes import SAMPLE_RATE
+from modes.sources import SbsRecord
+
+
+def icao_number(icao):
+    """Return an ICAO address as an int. Replies carry it as a bitstring."""
+    return icao.uint if hasattr(icao, 'uint') else int(icao)
+
+
 class Aircraft:
     """A class to hold data about a single aircraft including a log of past position/velocity/altitude data."""
 
+    TRACK_LENGTH = 100  # Number of past positions kept
+
     _icao = None
     _parameters = None
     _lastupdate = None
+    _replytime = None
+    _sample_timed = False
+    _cpr = None
+    _track = None
+    _message = None
+    _position_time = None
 
     def __init__(self, icao):
-        self._icao = icao
+        self._icao = icao_number(icao)
         self._parameters = {}
         self._lastupdate = 0
+        self._cpr = [None, None]  # Most recent (even, odd) CPR positions as ((lat, lon), time)
+        self._track = collections.deque(maxlen=self.TRACK_LENGTH)
 
     @classmethod
     def from_reply(cls, reply):
@@ -20,13 +41,84 @@ class Aircraft:
         inst.push_modes_reply(reply)
         return inst
 
+    def _check_icao(self, icao):
+        if icao_number(icao) != self._icao:
+            raise ValueError('Message with ICAO No. 0x{0:06x} is not from this aircraft (0x{1:06x}).'.format(
+                icao_number(icao), self._icao))
+
+    def _append_track(self):
+        self._track.append((self._replytime, self._parameters['Latitude'], self._parameters['Longitude'],
+                            self._parameters.get('Altitude (ft)')))
+
     def push_modes_reply(self, modes_reply):
-        if modes_reply.icao != self._icao:
-            raise ValueError('Message with ICAO No. 0x{0:x} is not from this aircraft (0x{1:x}).'.format(modes_reply.icao, self._icao))
+        """Update the aircraft from a Mode S reply. Returns a list of the parameter names which changed."""
+        self._check_icao(modes_reply.icao)
+        self._sample_timed = modes_reply.timestamp is not None
+        self._replytime = modes_reply.timestamp / SAMPLE_RATE if self._sample_timed else time.time()
+        changed = []
+        self._message = modes_reply.message
         if modes_reply.message:
             for key in modes_reply.message.params:
-                self._parameters[key] = modes_reply.message.params[key]    
+                value = modes_reply.message.params[key]
+                if self._parameters.get(key) != value:
+                    self._parameters[key] = value
+                    changed.append(key)
+            if 'CPR Latitude' in modes_reply.message.params and 'Alt. Type' in modes_reply.message.params:
+                changed.extend(self._push_cpr(modes_reply))
+                if 'Latitude' in changed or 'Longitude' in changed:
+                    self._append_track()
         self._lastupdate = time.time()
+        return changed
+
+    def push_sbs_record(self, record):
+        """Update the aircraft from a BaseStation record (a modes.sources.SbsRecord), which is already decoded.
+
+        The record's time (s since the epoch) becomes the reply time. Returns a list of the parameter names which
+        changed.
+        """
+        self._check_icao(record.icao)
+        self._replytime = record.time
+        self._sample_timed = False
+        self._message = None
+        changed = []
+        for key, value in record.parameters.items():
+            if self._parameters.get(key) != value:
+                self._parameters[key] = value
+                changed.append(key)
+        if 'Latitude' in record.parameters and 'Longitude' in record.parameters:
+            self._position_time = record.time
+            if 'Latitude' in changed or 'Longitude' in changed:
+                self._append_track()
+        self._lastupdate = time.time()
+        return changed
+
+    def _push_cpr(self, modes_reply):
+        """Decode the airborne position from the latest CPR report. Returns the position parameters which changed."""
+        params = modes_reply.message.params
+        odd = params['CPR Format'] == 'Odd'
+        t = self._replytime
+        frame = (params['CPR Latitude'], params['CPR Longitude'])
+        self._cpr[odd] = (frame, t)
+
+        position = None
+        other = self._cpr[not odd]
+        if other is not None and abs(t - other[1]) <= cpr.MAX_PAIR_AGE:
+            if odd:
+                position = cpr.decode_global(other[0], frame, True)
+            else:
+                position = cpr.decode_global(frame, other[0], False)
+        elif 'Latitude' in self._parameters:
+            # No recent pair so decode relative to the last known position.
+            position = cpr.decode_local(frame, odd, self._parameters['Latitude'], self._parameters['Longitude'])
+
+        changed = []
+        if position is not None:
+            self._position_time = t
+            for key, value in zip(('Latitude', 'Longitude'), position):
+                if self._parameters.get(key) != value:
+                    self._parameters[key] = value
+                    changed.append(key)
+        return changed
 
     @property
     def icao(self):
@@ -36,9 +128,125 @@ class Aircraft:
     def parameters(self):
         return self._parameters
 
+    @property
+    def position(self):
+        """The last decoded (latitude, longitude) or None."""
+        if 'Latitude' in self._parameters:
+            return self._parameters['Latitude'], self._parameters['Longitude']
+        return None
+
+    @property
+    def message(self):
+        """The ADS-B message of the last reply, or None."""
+        return self._message
+
+    @property
+    def position_time(self):
+        """The time (s) of the last reply a position was decoded from, whether or not the position changed."""
+        return self._position_time
+
+    @property
+    def track(self):
+        """The most recent positions as (time, latitude, longitude, altitude) tuples, oldest first."""
+        return self._track
+
+    @property
+    def lastupdate(self):
+        return self._lastupdate
+
+    @property
+    def replytime(self):
+        """The time (s) of the last reply, from its sample timestamp if it has one."""
+        return self._replytime
+
+    @property
+    def sample_timed(self):
+        """Whether replytime is from the receiver's sample timestamp (rather than a clock time)."""
+        return self._sample_timed
+
     def dump_print(self, print_if_no_params=False):
         if print_if_no_params or len(self._parameters):
             print('ICAO: 0x{0:06X}'.format(self._icao))
             for key in self._parameters:
                 print('\t{0}: {1}'.format(key, self._parameters[key]))
             print('')
+
+
+class AircraftRegistry:
+    """A collection of all the aircraft heard from, keyed by ICAO number.
+
+    Listeners can be attached to follow changes to the registry. A listener is any object
+    with the methods aircraft_updated(aircraft, changed) and aircraft_removed(aircraft).
+    changed is the list of parameter names which changed in the update.
+    """
+
+    def __init__(self):
+        self._aircraft = {}
+        self._listeners = []
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self._listeners.remove(listener)
+
+    def _aircraft_for(self, icao):
+        icao = icao_number(icao)
+        inst = self._aircraft.get(icao)
+        if inst is None:
+            inst = self._aircraft[icao] = Aircraft(icao)
+        return inst
+
+    def _updated(self, inst, changed):
+        for listener in self._listeners:
+            listener.aircraft_updated(inst, changed)
+        return inst
+
+    def push_modes_reply(self, reply):
+        """Update (or create) the aircraft that sent reply and notify the listeners."""
+        inst = self._aircraft_for(reply.icao)
+        return self._updated(inst, inst.push_modes_reply(reply))
+
+    def push_sbs_record(self, record):
+        """Update (or create) the aircraft of a BaseStation record (a modes.sources.SbsRecord) and notify listeners."""
+        inst = self._aircraft_for(record.icao)
+        return self._updated(inst, inst.push_sbs_record(record))
+
+    def push(self, record):
+        """Push a Mode S reply or a BaseStation record, whichever record is."""
+        if isinstance(record, SbsRecord):
+            return self.push_sbs_record(record)
+        return self.push_modes_reply(record)
+
+    def remove(self, icao):
+        inst = self._aircraft.pop(icao_number(icao))
+        for listener in self._listeners:
+            listener.aircraft_removed(inst)
+        return inst
+
+    def expire(self, max_age, now=None):
+        """Remove aircraft that haven't been heard from for max_age seconds. Returns the removed aircraft."""
+        if now is None:
+            now = time.time()
+        stale = [icao for icao, inst in self._aircraft.items() if now - inst.lastupdate > max_age]
+        return [self.remove(icao) for icao in stale]
+
+    def write_known_aircraft(self, f):
+        """Write the ICAO numbers to file object f in the format read by receiver -l (least recently heard first)."""
+        for inst in sorted(self._aircraft.values(), key=lambda inst: inst.lastupdate):
+            f.write('{0:06x}\n'.format(inst.icao))
+
+    def get(self, icao, default=None):
+        return self._aircraft.get(icao_number(icao), default)
+
+    def __getitem__(self, icao):
+        return self._aircraft[icao_number(icao)]
+
+    def __contains__(self, icao):
+        return icao_number(icao) in self._aircraft
+
+    def __iter__(self):
+        return iter(list(self._aircraft.values()))
+
+    def __len__(self):
+        return len(self._aircraft)
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+# Compact long-term storage of aircraft tracks.
+#
+# A TrackArchiver follows the positions decoded by an aircraft.AircraftRegistry (as a listener) and writes each
+# aircraft's track to a TrackArchive when its track is finished: when the aircraft is removed from the registry
+# (e.g. by expire()) or when flush() finds no position has been heard from it for a while. A long track is written
+# in segments of at most max_points points, so the memory held per aircraft is bounded. Tracks are compacted in two
+# steps:
+#
+#   1. Line simplification. Only the points needed to reconstruct the track by linear interpolation in time to
+#      within tolerance metres horizontally and altitude_tolerance feet vertically are kept. This is done as the
+#      points arrive (an opening window algorithm), so only the points since the last one kept are held in memory.
+#   2. Delta encoding. Times (in units of 10 ms), latitudes and longitudes (1e-5 degrees, about a metre) and
+#      altitudes (ft) are stored as the zigzag varint encoded differences from the previous point.
+#
+# The archive is a directory with a file of tracks for each (UTC) day and an index of the tracks in it:
+#
+#   2013-10-08.trk   the encoded tracks, appended one after another
+#   2013-10-08.idx   a header line and a line for each track: offset, length, ICAO No., first and last time, points
+#
+# A track which runs past midnight is split into one for each day. Range scans only read the indexes of the days
+# in the range and then seek to the matching tracks. E.g. to print the tracks of 4840d6 on a day as CSV:
+# >>$ python_tools/archive.py -s 2013-10-08 -e 2013-10-09 -i 4840d6 archive/
+
+import argparse
+import calendar
+import datetime
+import math
+import os
+import sys
+import time
+
+
+ARCHIVE_VERSION = 1
+EARTH_RADIUS_M = 6371000.0
+
+# Units of the stored values
+TIME_UNIT = 0.01  # s
+ANGLE_UNIT = 1e-5  # Degrees
+# Stored for points without an altitude
+ALTITUDE_UNKNOWN = -(1 << 20)
+
+DEFAULT_TOLERANCE = 50.0  # m
+DEFAULT_ALTITUDE_TOLERANCE = 100.0  # ft
+# Longest run of points between kept points (bounds the work and memory per point)
+MAX_WINDOW = 256
+DEFAULT_IDLE = 300.0  # s without a position before a track is finished
+MAX_SEGMENT_POINTS = 1000  # Kept points written at a time
+
+
+def zigzag(n):
+    """Map a signed int to an unsigned one with small magnitudes staying small: 0, -1, 1, -2 -> 0, 1, 2, 3."""
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+
+def unzigzag(n):
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+
+
+def encode_varint(n, out):
+    """Append an unsigned int to bytearray out, 7 bits per byte, least significant first."""
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def decode_varint(data, pos):
+    """Decode an unsigned int at data[pos:]. Returns (value, next position)."""
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_track(icao, points):
+    """Encode a track: points is a list of (time, latitude, longitude, altitude) tuples in time order."""
+    out = bytearray()
+    encode_varint(icao, out)
+    encode_varint(len(points), out)
+    previous = (0, 0, 0, 0)
+    for t, lat, lon, alt in points:
+        current = (int(round(t / TIME_UNIT)), int(round(lat / ANGLE_UNIT)), int(round(lon / ANGLE_UNIT)),
+                   int(round(alt)) if alt is not None else ALTITUDE_UNKNOWN)
+        for value, last in zip(current, previous):
+            encode_varint(zigzag(value - last), out)
+        previous = current
+    return bytes(out)
+
+
+def decode_track(data):
+    """Decode a track encoded by encode_track(). Returns (icao, points)."""
+    icao, pos = decode_varint(data, 0)
+    n_points, pos = decode_varint(data, pos)
+    points = []
+    values = [0, 0, 0, 0]
+    for _ in range(n_points):
+        for i in range(4):
+            delta, pos = decode_varint(data, pos)
+            values[i] += unzigzag(delta)
+        alt = values[3] if values[3] != ALTITUDE_UNKNOWN else None
+        points.append((values[0] * TIME_UNIT, values[1] * ANGLE_UNIT, values[2] * ANGLE_UNIT, alt))
+    return icao, points
+
+
+class TrackSimplifier:
+    """Simplify a track as its points arrive, keeping the error of the simplified track within bounds.
+
+    Points are (time, latitude, longitude, altitude) tuples. The simplified track, interpolated linearly in
+    time, passes within tolerance metres (horizontally) and altitude_tolerance feet of every point added.
+    """
+
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, altitude_tolerance=DEFAULT_ALTITUDE_TOLERANCE):
+        self.tolerance = tolerance
+        self.altitude_tolerance = altitude_tolerance
+        self.points = []  # The points kept
+        self._window = []  # The points since the last one kept
+        self.n_points = 0
+        self.last = None  # The last point added
+
+    def add(self, point):
+        self.n_points += 1
+        self.last = point
+        if not self.points:
+            self.points.append(point)
+        elif self._window and (len(self._window) >= MAX_WINDOW or not self._fits(self.points[-1], point)):
+            # The segment to the new point would stray too far from a point in between, so the last point of
+            # the window has to be kept. The new point starts the next window.
+            self.points.append(self._window[-1])
+            self._window = [point]
+        else:
+            self._window.append(point)
+
+    def take(self):
+        """Return the points kept so far. The last of them stays as the start of the rest of the track."""
+        points, self.points = self.points, self.points[-1:]
+        return points
+
+    def finish(self):
+        """Keep the last point and return the simplified track."""
+        if self._window:
+            self.points.append(self._window[-1])
+            self._window = []
+        return self.points
+
+    def _fits(self, start, end):
+        """Test whether all the points in the window are within tolerance of the segment from start to end."""
+        t0, lat0, lon0, alt0 = start
+        t1, lat1, lon1, alt1 = end
+        span = t1 - t0
+        # A local flat approximation is plenty over the length of a segment.
+        metres_per_degree = math.pi / 180.0 * EARTH_RADIUS_M
+        metres_per_degree_lon = metres_per_degree * math.cos(math.radians(lat0))
+        for t, lat, lon, alt in self._window:
+            f = (t - t0) / span if span > 0 else 0.0
+            dy = (lat - (lat0 + f * (lat1 - lat0))) * metres_per_degree
+            dx = (lon - (lon0 + f * (lon1 - lon0))) * metres_per_degree_lon
+            if dx * dx + dy * dy > self.tolerance * self.tolerance:
+                return False
+            if alt is not None and alt0 is not None and alt1 is not None:
+                if abs(alt - (alt0 + f * (alt1 - alt0))) > self.altitude_tolerance:
+                    return False
+            elif (alt is None) != (alt0 is None):
+                return False  # Keep the points where the altitude becomes known (or unknown).
+        return True
+
+
+def day_of(t):
+    """The UTC date (a datetime.date) of time t (s since the epoch)."""
+    return datetime.datetime.fromtimestamp(t, datetime.timezone.utc).date()
+
+
+class TrackEntry:
+    """An index entry: where a track is in its day's file and what it covers."""
+
+    def __init__(self, day, offset, length, icao, start, end, n_points):
+        self.day = day
+        self.offset = offset
+        self.length = length
+        self.icao = icao
+        self.start = start
+        self.end = end
+        self.n_points = n_points
+
+    def format(self):
+        return '{0} {1} {2:06x} {3!r} {4!r} {5}\n'.format(self.offset, self.length, self.icao, self.start, self.end,
+                                                          self.n_points)
+
+    @classmethod
+    def parse(cls, day, line):
+        offset, length, icao, start, end, n_points = line.split()
+        return cls(day, int(offset), int(length), int(icao, 16), float(start), float(end), int(n_points))
+
+
+class TrackArchive:
+    """A directory of compacted tracks, a data file and an index per day."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.tracks_written = 0
+        self.points_written = 0
+        self.bytes_written = 0
+
+    def header(self):
+        return '# track archive v{0}\n'.format(ARCHIVE_VERSION)
+
+    def _path(self, day, extension):
+        return os.path.join(self.directory, day.isoformat() + extension)
+
+    def write(self, icao, points):
+        """Append a track (a list of (time, latitude, longitude, altitude) in time order) to the archive.
+
+        The points must all fall on the same UTC day.
+        """
+        if not points:
+            return
+        day = day_of(points[0][0])
+        data = encode_track(icao, points)
+        data_path = self._path(day, '.trk')
+        index_path = self._path(day, '.idx')
+        with open(data_path, 'ab') as f:
+            offset = f.tell()
+            f.write(data)
+        entry = TrackEntry(day, offset, len(data), icao, points[0][0], points[-1][0], len(points))
+        new_index = not os.path.exists(index_path)
+        with open(index_path, 'a') as f:
+            if new_index:
+                f.write(self.header())
+            f.write(entry.format())
+        self.tracks_written += 1
+        self.points_written += len(points)
+        self.bytes_written += len(data)
+
+    def days(self):
+        """The days in the archive, in order."""
+        days = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.idx'):
+                try:
+                    days.append(datetime.date(*time.strptime(name[:-4], '%Y-%m-%d')[:3]))
+                except ValueError:
+                    pass
+        return sorted(days)
+
+    def entries(self, day):
+        """The index entries of the tracks on day (a datetime.date)."""
+        path = self._path(day, '.idx')
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            if f.readline() != self.header():
+                return []
+            return [TrackEntry.parse(day, line) for line in f if line.endswith('\n')]
+
+    def scan(self, start=None, end=None, icao=None):
+        """Yield (icao, points) for each track with points between times start and end (s), in order of day and
+        then of archiving. icao restricts the scan to one aircraft. The tracks are returned whole.
+        """
+        days = self.days()
+        if start is not None:
+            days = [day for day in days if day >= day_of(start)]
+        if end is not None:
+            days = [day for day in days if day <= day_of(end)]
+        for day in days:
+            entries = [entry for entry in self.entries(day)
+                       if (icao is None or entry.icao == icao) and
+                       (start is None or entry.end >= start) and (end is None or entry.start <= end)]
+            if not entries:
+                continue
+            with open(self._path(day, '.trk'), 'rb') as f:
+                for entry in entries:
+                    f.seek(entry.offset)
+                    yield decode_track(f.read(entry.length))
+
+
+class TrackArchiver:
+    """Registry listener which simplifies the positions of each aircraft and archives its track when it's removed.
+
+    Points are timed by the aircraft's lastupdate (the time the reply was processed) or, if epoch is given, by
+    their replytime (from the receiver's sample timestamps) after epoch, the time (s) the receiver was started.
+    The latter is needed when archiving from a log faster than real time. Replies without a sample timestamp are
+    timed by lastupdate either way.
+
+    flush() finishes the tracks with no point for idle seconds. Once a track has max_points kept points they're
+    written as a segment, and the track carries on from the last of them.
+    """
+
+    def __init__(self, archive, tolerance=DEFAULT_TOLERANCE, altitude_tolerance=DEFAULT_ALTITUDE_TOLERANCE, epoch=None,
+                 idle=DEFAULT_IDLE, max_points=MAX_SEGMENT_POINTS):
+        self.archive = archive
+        self.epoch = epoch
+        self.tolerance = tolerance
+        self.altitude_tolerance = altitude_tolerance
+        self.idle = idle
+        self.max_points = max_points
+        self.points_received = 0
+        self._latest = None  # Time of the latest point
+        self._tracks = {}  # ICAO No. -> (day, TrackSimplifier)
+
+    def add(self, icao, point):
+        """Add a (time, latitude, longitude, altitude) point to the track of icao."""
+        self.points_received += 1
+        day = day_of(point[0])
+        track = self._tracks.get(icao)
+        if track is not None and track[0] != day:
+            self.finish(icao)  # Each day's file only holds points from that day.
+            track = None
+        if track is None:
+            track = self._tracks[icao] = (day, TrackSimplifier(self.tolerance, self.altitude_tolerance))
+        track[1].add(point)
+        if len(track[1].points) >= self.max_points:
+            self.archive.write(icao, track[1].take())
+        if self._latest is None or point[0] > self._latest:
+            self._latest = point[0]
+
+    def finish(self, icao):
+        """Archive the track of icao so far (if it has one)."""
+        track = self._tracks.pop(icao, None)
+        if track is not None:
+            self.archive.write(icao, track[1].finish())
+
+    def flush(self, now=None):
+        """Archive the tracks with no point for idle seconds before now. now defaults to the current time or, with
+        an epoch, to the time of the latest point. Returns the ICAO Nos. of the tracks archived.
+        """
+        if now is None:
+            now = time.time() if self.epoch is None else self._latest
+        if now is None:
+            return []
+        idle = [icao for icao, (_, simplifier) in self._tracks.items() if now - simplifier.last[0] > self.idle]
+        for icao in idle:
+            self.finish(icao)
+        return idle
+
+    def close(self):
+        """Archive all the tracks in progress."""
+        for icao in list(self._tracks):
+            self.finish(icao)
+
+    # Listener interface for aircraft.AircraftRegistry
+    def aircraft_updated(self, aircraft, changed):
+        if 'Latitude' in changed or 'Longitude' in changed:
+            params = aircraft.parameters
+            if self.epoch is not None and aircraft.sample_timed:
+                t = self.epoch + aircraft.replytime
+            else:
+                t = aircraft.lastupdate
+            self.add(aircraft.icao, (t, params['Latitude'], params['Longitude'],
+                                     params.get('Altitude (ft)')))
+
+    def aircraft_removed(self, aircraft):
+        self.finish(aircraft.icao)
+
+
+def parse_time(text):
+    """A time (s since the epoch) from an ISO 8601 UTC date or date and time."""
+    for fmt in ('%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S'):
+        try:
+            return calendar.timegm(time.strptime(text, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('{0!r} is not a date or date and time'.format(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print archived tracks as CSV: ICAO No., time, lat, lon, alt.')
+    parser.add_argument('-s', '--start', type=parse_time, help='start date/time (UTC)')
+    parser.add_argument('-e', '--end', type=parse_time, help='end date/time (UTC)')
+    parser.add_argument('-i', '--icao', type=lambda text: int(text, 16), help='only print this aircraft')
+    parser.add_argument('directory')
+    args = parser.parse_args()
+
+    archive = TrackArchive(args.directory)
+    for icao, points in archive.scan(args.start, args.end, args.icao):
+        for t, lat, lon, alt in points:
+            sys.stdout.write('{0:06x},{1:.2f},{2:.5f},{3:.5f},{4}\n'.format(icao, t, lat, lon,
+                                                                           alt if alt is not None else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+# Compact Position Reporting (CPR) encoding and decoding for airborne position messages.
+#
+# ADS-B position messages carry latitude and longitude as 17 bit CPR encoded
+# values. A single message is ambiguous: either an even/odd pair of messages
+# received close together in time (global decoding) or a nearby reference
+# position (local decoding) is needed to recover the position. The algorithms
+# are described in ICAO document 9871, Appendix C, section C.2.6.
+
+import math
+
+
+# The number of bits in an airborne CPR encoded coordinate
+CPR_BITS = 17
+CPR_SCALE = float(1 << CPR_BITS)
+# The number of latitude zones between the equator and a pole
+NZ = 15
+# Even and odd messages must be received within this many seconds of each other for global decoding
+MAX_PAIR_AGE = 10.0
+
+
+def nl(lat):
+    """Return the number of longitude zones at latitude lat (degrees)."""
+
+    lat = abs(lat)
+    if lat == 0.0:
+        return 59
+    elif lat == 87.0:
+        return 2
+    elif lat > 87.0:
+        return 1
+
+    a = 1.0 - math.cos(math.pi / (2.0 * NZ))
+    b = math.cos(math.pi / 180.0 * lat) ** 2
+    return int(math.floor(2.0 * math.pi / math.acos(1.0 - a / b)))
+
+
+def decode_global(even, odd, odd_latest):
+    """Decode an even/odd pair of CPR positions into latitude and longitude.
+
+    even and odd are (latitude, longitude) tuples of the 17 bit encoded values. The position is
+    given at the time of the most recent message which is indicated by odd_latest. None is
+    returned if the two messages straddle a longitude zone boundary and so cannot be combined.
+    """
+
+    lat_even, lon_even = even[0] / CPR_SCALE, even[1] / CPR_SCALE
+    lat_odd, lon_odd = odd[0] / CPR_SCALE, odd[1] / CPR_SCALE
+    dlat_even = 360.0 / (4 * NZ)
+    dlat_odd = 360.0 / (4 * NZ - 1)
+
+    # Latitude zone index
+    j = math.floor(59 * lat_even - 60 * lat_odd + 0.5)
+    rlat_even = dlat_even * (j % 60 + lat_even)
+    rlat_odd = dlat_odd * (j % 59 + lat_odd)
+    if rlat_even >= 270.0:
+        rlat_even -= 360.0
+    if rlat_odd >= 270.0:
+        rlat_odd -= 360.0
+
+    if nl(rlat_even) != nl(rlat_odd):
+        return None
+
+    if odd_latest:
+        lat = rlat_odd
+        zones = nl(rlat_odd)
+        ni = max(zones - 1, 1)
+        m = math.floor(lon_even * (zones - 1) - lon_odd * zones + 0.5)
+        lon = (360.0 / ni) * (m % ni + lon_odd)
+    else:
+        lat = rlat_even
+        zones = nl(rlat_even)
+        ni = max(zones, 1)
+        m = math.floor(lon_even * (zones - 1) - lon_odd * zones + 0.5)
+        lon = (360.0 / ni) * (m % ni + lon_even)
+
+    if lon >= 180.0:
+        lon -= 360.0
+
+    return lat, lon
+
+
+def decode_local(cpr, odd, ref_lat, ref_lon):
+    """Decode a single CPR position using a reference position within 180NM of the aircraft.
+
+    cpr is a (latitude, longitude) tuple of the 17 bit encoded values and odd is the CPR format flag.
+    """
+
+    i = 1 if odd else 0
+    yz, xz = cpr[0] / CPR_SCALE, cpr[1] / CPR_SCALE
+
+    dlat = 360.0 / (4 * NZ - i)
+    j = math.floor(ref_lat / dlat) + math.floor(0.5 + (ref_lat % dlat) / dlat - yz)
+    lat = dlat * (j + yz)
+
+    dlon = 360.0 / max(nl(lat) - i, 1)
+    m = math.floor(ref_lon / dlon) + math.floor(0.5 + (ref_lon % dlon) / dlon - xz)
+    lon = dlon * (m + xz)
+
+    # The nearest solution to a reference near the antimeridian may be on the other side of it.
+    if lon >= 180.0:
+        lon -= 360.0
+    elif lon < -180.0:
+        lon += 360.0
+
+    return lat, lon
+
+
+def encode(lat, lon, odd):
+    """CPR encode an airborne position. Returns the 17 bit encoded (latitude, longitude) for the given format."""
+
+    i = 1 if odd else 0
+
+    dlat = 360.0 / (4 * NZ - i)
+    yz = int(math.floor(CPR_SCALE * (lat % dlat) / dlat + 0.5))
+    rlat = dlat * (yz / CPR_SCALE + math.floor(lat / dlat))
+
+    dlon = 360.0 / max(nl(rlat) - i, 1)
+    xz = int(math.floor(CPR_SCALE * (lon % dlon) / dlon + 0.5))
+
+    return yz & 0x1ffff, xz & 0x1ffff
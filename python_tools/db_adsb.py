@@ -5,23 +5,163 @@
 # The script expects to read a file in the format produced by receiver.c. You can pipe the output of receiver.c
 # straight into this script if you give it - as the filename. E.g.
 # >>$ receiver/receiver | python_tools/db_adsb.py -
+#
+# For use on a live stream, -i makes the script print JSON delta snapshots of the aircraft state every
+# INTERVAL seconds instead (see snapshot.py), with a full keyframe every KEYFRAME seconds. E.g.
+# >>$ receiver/receiver | python_tools/db_adsb.py -i 1 -k 30 -
+# -e forgets aircraft which haven't been heard for a while. Snapshots and expiry run on a timer, so they carry on
+# while the input is quiet.
+# -K writes the addresses of the aircraft heard to a file which the receiver can preload with its -l option.
+# --db writes every reply and the latest state of each aircraft to a SQLite database (see sqlite_sink.py).
+# -c caches decoded identification and status messages, which repeat unchanged, and reports the hit rate at EOF.
+# --http serves the aircraft state as JSON over HTTP while the input is read (see json_api.py), on localhost unless
+# --http-host says otherwise.
+# --archive writes the simplified track of each aircraft to a track archive as it expires or once no position has
+# been heard from it for --archive-idle seconds, and the rest at EOF (see archive.py). For a recording, --epoch (the
+# time the receiver was started) times the points by the receiver's timestamps rather than by when they're read.
+# -f reads the output of other receivers instead: Beast binary, AVR or SBS/BaseStation CSV (see modes/sources.py),
+# from the files or from a TCP connection with --connect. E.g. to follow dump1090's Beast output:
+# >>$ python_tools/db_adsb.py -f beast --connect localhost:30005 -i 1
+# SBS records are already decoded, so with --db only the aircraft state is written, not the replies, and they're
+# already timed in UTC, so --epoch doesn't apply.
 
+import argparse
+import archive
 import fileinput
+import sys
+import threading
+import adsblib
 import modes
 import aircraft
+import json_api
+import snapshot
+import modes.sources
+import sqlite_sink
+
+aircraft_db = aircraft.AircraftRegistry()
+
+
+def read_replies(args):
+    """Yield the replies (or for SBS the records) from the input in the format given by -f."""
+    if args.format == 'receiver':
+        for line in fileinput.input(args.files):
+            yield modes.ModeSReply.from_message(line)
+        return
+    # AP replies are only accepted from aircraft already heard, as the receiver does.
+    parser = modes.sources.parser(args.format, known=aircraft_db)
+    if args.connect:
+        host, _, port = args.connect.rpartition(':')
+        source = modes.sources.TcpSource(host, int(port), parser)
+        try:
+            for reply in source:
+                yield reply
+        finally:
+            source.close()
+        return
+    for path in args.files or ['-']:
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        for reply in modes.sources.read_stream(stream, parser):
+            yield reply
+        if stream is not sys.stdin.buffer:
+            stream.close()
 
-aircraft_db = {}
 
 def main():
-    for line in fileinput.input():
-        reply = modes.ModeSReply.from_message(line)
-        if reply.icao not in aircraft_db:
-            aircraft_db[reply.icao] = aircraft.Aircraft.from_reply(reply)
-        else:
-            aircraft_db[reply.icao].push_modes_reply(reply)
-
-    for icao in aircraft_db:
-        aircraft_db[icao].dump_print(True)
+    parser = argparse.ArgumentParser(description='Collect the state of each aircraft heard.')
+    parser.add_argument('-i', '--interval', type=float, help='print delta snapshots every INTERVAL seconds')
+    parser.add_argument('-k', '--keyframe', type=float, default=60.0, help='seconds between full keyframes')
+    parser.add_argument('-e', '--expire', type=float, help='forget aircraft not heard for EXPIRE seconds')
+    parser.add_argument('-K', '--known-aircraft', metavar='FILE',
+                        help='write the aircraft heard to FILE at EOF for preloading the receiver (receiver -l)')
+    parser.add_argument('-c', '--cache', type=int, metavar='SIZE', help='cache up to SIZE decoded messages')
+    parser.add_argument('--db', metavar='FILE', help='write the replies and aircraft state to SQLite database FILE')
+    parser.add_argument('--http', type=int, metavar='PORT', help='serve the aircraft state as JSON on PORT')
+    parser.add_argument('--http-host', default='127.0.0.1', metavar='HOST',
+                        help='address to serve --http on (default 127.0.0.1, 0.0.0.0 for every interface)')
+    parser.add_argument('--archive', metavar='DIR', help='archive the tracks of the aircraft in directory DIR')
+    parser.add_argument('--tolerance', type=float, default=archive.DEFAULT_TOLERANCE,
+                        help='metres the archived tracks may stray from the positions heard')
+    parser.add_argument('--archive-idle', type=float, default=archive.DEFAULT_IDLE, metavar='SECONDS',
+                        help='archive a track once no position has been heard for SECONDS')
+    parser.add_argument('--epoch', type=archive.parse_time, help='time (UTC) the input was recorded from')
+    parser.add_argument('-f', '--format', choices=('receiver', 'beast', 'avr', 'sbs'), default='receiver',
+                        help='input format (default the output of receiver.c)')
+    parser.add_argument('--connect', metavar='HOST:PORT', help='read the input (not receiver) from a TCP server')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+    if args.connect and args.format == 'receiver':
+        parser.error('--connect needs the format of the server given with -f')
+    if args.epoch is not None and args.format == 'sbs':
+        parser.error('--epoch is for receiver timestamps; SBS records are already timed in UTC')
+
+    cache = adsblib.enable_cache(args.cache) if args.cache else None
+
+    emitter = None
+    if args.interval:
+        def write(text):
+            print(text)
+            sys.stdout.flush()
+        emitter = snapshot.SnapshotEmitter(aircraft_db, write, args.interval, args.keyframe)
+
+    sink = None
+    if args.db:
+        sink = sqlite_sink.SqliteSink(args.db)
+        aircraft_db.add_listener(sink)
+
+    archiver = None
+    if args.archive:
+        archiver = archive.TrackArchiver(archive.TrackArchive(args.archive), args.tolerance, epoch=args.epoch,
+                                         idle=args.archive_idle)
+        aircraft_db.add_listener(archiver)
+
+    api = json_api.ApiServer(aircraft_db, args.http_host, args.http) if args.http else None
+
+    def housekeeping():
+        if args.expire:
+            aircraft_db.expire(args.expire)  # Removals are reported in the next snapshot.
+        if emitter:
+            emitter.poll()
+        if api:
+            api.poll()
+        if archiver:
+            archiver.flush()
+
+    lock = threading.Lock()
+    ticker = snapshot.Ticker(housekeeping, lock)
+    for reply in read_replies(args):
+        with lock:
+            aircraft_db.push(reply)
+        if sink and args.format != 'sbs':
+            sink.write_reply(reply)
+    ticker.close()
+
+    if args.known_aircraft:
+        with open(args.known_aircraft, 'w') as f:
+            aircraft_db.write_known_aircraft(f)
+
+    if sink:
+        sink.close()
+        print('Database: {0} rows written, {1} dropped'.format(sink.written, sink.dropped), file=sys.stderr)
+        if sink.error:
+            print('Database error: {0}'.format(sink.error), file=sys.stderr)
+
+    if api:
+        api.close()
+
+    if archiver:
+        archiver.close()
+        print('Archive: {0} points kept of {1}, {2} tracks, {3} bytes'.format(
+            archiver.archive.points_written, archiver.points_received, archiver.archive.tracks_written,
+            archiver.archive.bytes_written), file=sys.stderr)
+
+    if cache:
+        print('Message cache: {0} hits, {1} misses'.format(cache.hits, cache.misses), file=sys.stderr)
+
+    if emitter:
+        emitter.tick()
+    else:
+        for inst in aircraft_db:
+            inst.dump_print(True)
 
 
 if __name__ == "__main__":
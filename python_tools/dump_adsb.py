@@ -6,16 +6,30 @@
 
 import fileinput
 import modes
+from modes.commb import CommBDecoder
+
+
+def format_reply(reply, commb_decoder):
+    """Return the text dumped for a reply as a list of lines."""
+    lines = ["Timestamp (samples): {0}; ICAO No: {1}; Data: {2}; Type: {3}".format(reply.timestamp, reply.icao, reply.data, reply.decode())]
+    if reply.message:
+        lines.append('\t {0}'.format(reply.message.describe()))
+        for key in reply.message.params:
+            lines.append('\t\t{0}: {1}'.format(key, reply.message.params[key]))
+    commb = commb_decoder.decode_reply(reply)
+    if commb:
+        bds, params = commb
+        lines.append('\t Comm-B register {0}'.format(bds))
+        for key in params:
+            lines.append('\t\t{0}: {1}'.format(key, params[key]))
+    return lines
 
 
 def main():
+    commb_decoder = CommBDecoder()
     for line in fileinput.input():
         reply = modes.ModeSReply.from_message(line)
-        print("Timestamp (samples): {0}; ICAO No: {1}; Data: {2}; Type: {3}".format(reply.timestamp, reply.icao, reply.data, reply.decode()))
-        if reply.message:
-            print('\t', reply.message.describe())
-            for key in reply.message.params:
-                print('\t\t{0}: {1}'.format(key, reply.message.params[key]))
+        print('\n'.join(format_reply(reply, commb_decoder)))
             
 
 if __name__ == "__main__":
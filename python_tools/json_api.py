@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# An HTTP/JSON query API over the aircraft registry, served by asyncio alongside the decode pipeline.
+#
+#   GET /aircraft               all aircraft: {"seq": 12, "time": ..., "aircraft": [{"icao": "4840d6", ...}, ...]}
+#   GET /aircraft/<icao>        one aircraft with its parameters and track history (time, latitude, longitude, altitude)
+#   GET /updates?since=SEQ      long poll for the snapshots (see snapshot.py) after SEQ, as a JSON array. It returns as
+#                               soon as there are any (or after timeout=SECONDS, default 30, with an empty array).
+#                               Without since, or if SEQ is too old or newer than the server's (it was restarted),
+#                               it returns the latest keyframe and the deltas after it.
+#
+# The registry is only touched by the thread that updates it, which calls poll() (or tick()) as it goes. Each tick
+# serializes the aircraft heard since the previous one and hands the resulting bytes to the server's event loop, where
+# every client is served from them. However many clients there are, each aircraft is serialized at most once per tick.
+# /aircraft and /aircraft/<icao> responses carry an ETag so that clients can poll with If-None-Match and get a 304 Not
+# Modified while nothing has changed.
+
+import asyncio
+import json
+import threading
+import time
+import urllib.parse
+
+from snapshot import SnapshotEmitter
+
+
+REASONS = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed'}
+LONG_POLL_TIMEOUT = 30.0  # Seconds
+MAX_LONG_POLL_TIMEOUT = 300.0
+
+
+def _dumps(obj):
+    return json.dumps(obj, separators=(',', ':'), default=str).encode()
+
+
+class ApiState:
+    """The serialized state published by one tick. It's never modified, so it can be shared by all the clients.
+
+    aircraft maps ICAO No. -> (detail body, ETag). updates is a list of (seq, serialized snapshot) starting at
+    the most recent keyframe.
+    """
+
+    def __init__(self, seq, list_body, list_etag, aircraft, updates):
+        self.seq = seq
+        self.list_body = list_body
+        self.list_etag = list_etag
+        self.aircraft = aircraft
+        self.updates = updates
+        self._since = {}  # Responses to /updates, by the index of their first snapshot
+
+    def updates_since(self, since):
+        """The /updates body for a client which has seen snapshot since (None for none), or None if it's up to date."""
+        first = 0
+        if since is not None and self.updates[0][0] - 1 <= since <= self.seq:
+            first = since - self.updates[0][0] + 1
+            if first == len(self.updates):
+                return None
+        body = self._since.get(first)
+        if body is None:
+            body = self._since[first] = b'[' + b','.join(update for _, update in self.updates[first:]) + b']'
+        return body
+
+
+class ApiServer:
+    """Serve the aircraft in registry over HTTP on host:port from a background thread.
+
+    poll() must be called from the thread that updates the registry. It ticks every interval seconds, with a
+    keyframe for /updates every keyframe_interval seconds.
+    """
+
+    def __init__(self, registry, host='127.0.0.1', port=8080, interval=1.0, keyframe_interval=60.0):
+        self.registry = registry
+        self.interval = interval
+        self.requests = 0
+        self.not_modified = 0
+        self.serializations = 0
+        self._dirty = set()
+        self._removed = set()
+        registry.add_listener(self)
+        self._snapshot = None
+        self._emitter = SnapshotEmitter(registry, self._emitted, interval, keyframe_interval)
+        self._summaries = {}  # ICAO No. -> serialized entry in the aircraft list
+        self._details = {}  # ICAO No. -> (serialized detail, ETag)
+        self._list = (b'', '')
+        self._updates = []
+        self._last_tick = None
+
+        self._loop = asyncio.new_event_loop()
+        self._state = None
+        self._ticked = asyncio.Event()
+        self._server = self._loop.run_until_complete(asyncio.start_server(self._handle, host, port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        for inst in registry:
+            self._dirty.add(inst.icao)
+        self.tick()  # Publishes the initial state as soon as the loop starts, before any requests are handled.
+        self._thread = threading.Thread(target=self._loop.run_forever, name='json_api')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self.registry.remove_listener(self)
+        self._emitter.close()
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def poll(self, now=None):
+        """Tick if interval has elapsed since the last tick."""
+        if now is None:
+            now = time.time()
+        if self._last_tick is None or now - self._last_tick >= self.interval:
+            self.tick(now)
+
+    def tick(self, now=None):
+        """Serialize the changes since the last tick and publish them to the server."""
+        if now is None:
+            now = time.time()
+        self._last_tick = now
+        dirty, removed = self._dirty, self._removed
+        self._dirty, self._removed = set(), set()
+        snapshot = self._emitter.tick(now)
+        seq = snapshot['seq']
+
+        for icao in removed:
+            self._summaries.pop(icao, None)
+            self._details.pop(icao, None)
+        for icao in dirty:
+            inst = self.registry.get(icao)
+            if inst is None:
+                continue
+            summary = dict(inst.parameters, icao='{0:06x}'.format(icao), seen=inst.lastupdate)
+            self._summaries[icao] = _dumps(summary)
+            detail = {'icao': summary['icao'], 'seen': inst.lastupdate, 'parameters': inst.parameters,
+                      'track': list(inst.track)}
+            self._details[icao] = (_dumps(detail), '"{0:06x}-{1}"'.format(icao, seq))
+            self.serializations += 1
+        if dirty or removed or not self._list[0]:
+            self._list = (b'{"seq":' + str(seq).encode() + b',"time":' + repr(now).encode() + b',"aircraft":[' +
+                          b','.join(self._summaries.values()) + b']}', '"list-{0}"'.format(seq))
+
+        if snapshot['keyframe']:
+            self._updates = []
+        self._updates.append((seq, self._snapshot))
+        state = ApiState(seq, self._list[0], self._list[1], dict(self._details), list(self._updates))
+        self._loop.call_soon_threadsafe(self._publish, state)
+
+    # Listener interface for aircraft.AircraftRegistry
+    def aircraft_updated(self, aircraft, changed):
+        self._dirty.add(aircraft.icao)  # Even if only the time it was last seen changed
+
+    def aircraft_removed(self, aircraft):
+        self._dirty.discard(aircraft.icao)
+        self._removed.add(aircraft.icao)
+
+    async def _shutdown(self):
+        """Stop listening and drop the connections still open, e.g. clients waiting in a long poll."""
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _emitted(self, text):
+        self._snapshot = text.encode()
+
+    def _publish(self, state):
+        self._state = state
+        ticked, self._ticked = self._ticked, asyncio.Event()
+        ticked.set()
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request = await reader.readline()
+                if not request:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request.decode('latin-1').split()
+                except ValueError:
+                    self._write(writer, 400, b'', close=True)
+                    break
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                if method != 'GET' or 'content-length' in headers or 'transfer-encoding' in headers:
+                    self._write(writer, 405, b'', close=True)
+                    break
+                status, body, etag = await self._respond(target, headers)
+                self._write(writer, status, body, etag, not keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, target, headers):
+        """Returns (status, body, ETag) for a GET of target."""
+        self.requests += 1
+        url = urllib.parse.urlsplit(target)
+        query = urllib.parse.parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        state = self._state
+        try:
+            if parts == ['aircraft']:
+                body, etag = state.list_body, state.list_etag
+            elif len(parts) == 2 and parts[0] == 'aircraft':
+                body, etag = state.aircraft[int(parts[1], 16)]
+            elif parts == ['updates']:
+                since = int(query['since'][0]) if 'since' in query else None
+                timeout = min(float(query['timeout'][0]), MAX_LONG_POLL_TIMEOUT) if 'timeout' in query else \
+                    LONG_POLL_TIMEOUT
+                return 200, await self._long_poll(since, timeout), None
+            else:
+                return 404, b'', None
+        except (KeyError, ValueError):
+            return 404, b'', None
+        if headers.get('if-none-match') == etag:
+            self.not_modified += 1
+            return 304, b'', etag
+        return 200, body, etag
+
+    async def _long_poll(self, since, timeout):
+        deadline = self._loop.time() + timeout
+        while True:
+            body = self._state.updates_since(since)
+            if body is not None:
+                return body
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                return b'[]'
+            try:
+                await asyncio.wait_for(self._ticked.wait(), remaining)
+            except asyncio.TimeoutError:
+                return b'[]'
+
+    @staticmethod
+    def _write(writer, status, body, etag=None, close=False):
+        lines = ['HTTP/1.1 {0} {1}'.format(status, REASONS[status]),
+                 'Content-Length: {0}'.format(len(body)),
+                 'Cache-Control: no-cache']
+        if status != 304:
+            lines.append('Content-Type: application/json')
+        if etag:
+            lines.append('ETag: ' + etag)
+        if close:
+            lines.append('Connection: close')
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
@@ -1 +1,2 @@
-from .modes import ModeSReply, DownlinkFormat
+from .modes import ModeSReply, DownlinkFormat, SAMPLE_RATE
+from .logindex import LogIndex
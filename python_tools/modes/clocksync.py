@@ -0,0 +1,254 @@
+"""
+Receiver clock synchronisation.
+
+Reply timestamps are counts of samples since the receiver started, so each
+receiver has its own epoch and its own oscillator error. Each receiver's clock
+is modelled relative to a reference receiver as
+
+    common = local + offset + drift * (local - centre)
+
+where local is the receiver's timestamp in seconds and the common time base is
+the reference receiver's clock.
+
+The model is fitted from position reports heard by several receivers. The
+aircraft's reported position gives the propagation delay to each receiver.
+If receiver A is already synchronised, the time at which B heard the report
+in the common time base is
+
+    T_B = T_A - d_A / c + d_B / c
+
+This gives one measurement of B's offset at B's local time.
+
+Measurements are folded into an exponentially forgotten least squares fit kept
+in information form. This is recursive least squares applied a block of
+measurements at a time: old measurements fade with a time constant and the fit
+is never recomputed from scratch. The centre of the model is moved forward as
+time passes to keep the normal equations well conditioned.
+
+Receivers become references for others once they are synchronised. Each one
+records how many hops it is from the reference receiver, so two receivers
+never correct each other.
+"""
+
+import math
+
+import numpy
+
+from .modes import SAMPLE_RATE
+
+
+# Speed of light in m/s
+C = 299792458.0
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_E2 = 6.69437999014e-3
+METRES_PER_FOOT = 0.3048
+
+
+def ecef(lat, lon, alt):
+    """Convert geodetic latitude and longitude (degrees) and altitude (m) to ECEF coordinates (m).
+
+    Accepts scalars or arrays; the result has a trailing axis of length 3.
+    """
+    lat = numpy.radians(lat)
+    lon = numpy.radians(lon)
+    sin_lat = numpy.sin(lat)
+    n = WGS84_A / numpy.sqrt(1.0 - WGS84_E2 * sin_lat ** 2)
+    return numpy.stack([(n + alt) * numpy.cos(lat) * numpy.cos(lon),
+                        (n + alt) * numpy.cos(lat) * numpy.sin(lon),
+                        (n * (1.0 - WGS84_E2) + alt) * sin_lat], axis=-1)
+
+
+class ReceiverClock(object):
+    """The offset and drift model of one receiver's clock.
+
+    time_constant is the time (s) over which old measurements are forgotten
+    and noise the standard deviation (s) of a measurement.
+    Once the clock is synchronised, measurements more than gate seconds from
+    the model are rejected. After max_rejects consecutive rejections the clock
+    is assumed to have jumped and is reset. A receiver restart is detected by
+    its timestamps going back more than restart_step seconds. Smaller steps
+    back are normal: measurements are fitted in blocks and the propagation
+    delays reorder them across the blocks' boundaries.
+    """
+
+    def __init__(self, time_constant=120.0, noise=0.3e-6, gate=10e-6, min_measurements=20, min_span=2.0,
+                 max_rejects=50, drift_prior=1e-4, recentre_interval=30.0, restart_step=1.0):
+        self.time_constant = time_constant
+        self.weight = 1.0 / noise ** 2
+        self.gate = gate
+        self.min_measurements = min_measurements
+        self.min_span = min_span
+        self.max_rejects = max_rejects
+        # Weak prior on the drift (the dongles' oscillators are good to within about 100 ppm) which keeps the fit
+        # solvable before measurements span enough time to separate drift from offset.
+        self.drift_prior = 1.0 / drift_prior ** 2
+        self.recentre_interval = recentre_interval * SAMPLE_RATE
+        self.restart_step = restart_step * SAMPLE_RATE
+        self.reset()
+
+    def reset(self):
+        self.centre = None  # In samples
+        self.info = numpy.zeros((2, 2))
+        self.vector = numpy.zeros(2)
+        self.offset = 0.0
+        self.drift = 0.0
+        self.measurements = 0
+        self.rejected = 0
+        self.rejects_in_row = 0
+        self.first = None
+        self.last = None
+        self.synced = False
+        self.level = None
+
+    def to_common(self, samples):
+        """Convert local sample timestamps (scalar or array) to seconds in the common time base."""
+        if not self.synced:
+            raise ValueError('Receiver clock is not synchronised.')
+        samples = numpy.asarray(samples, dtype=float)
+        return samples / SAMPLE_RATE + self.offset + self.drift * (samples - self.centre) / SAMPLE_RATE
+
+    def _recentre(self, centre):
+        # Move the model's centre, keeping the same fitted line:
+        # offset' = offset + drift * delta, with the information transformed to match.
+        delta = (centre - self.centre) / SAMPLE_RATE
+        inverse = numpy.array([[1.0, -delta], [0.0, 1.0]])
+        self.info = inverse.T.dot(self.info).dot(inverse)
+        self.vector = inverse.T.dot(self.vector)
+        self.offset += self.drift * delta
+        self.centre = centre
+
+    def update(self, samples, targets):
+        """Fold in a block of measurements in time order.
+
+        samples are local timestamps and targets the corresponding common times (s). The block may start a
+        little before the previous one ended.
+        Returns the number of measurements accepted.
+        """
+        samples = numpy.asarray(samples, dtype=float)
+        if not len(samples):
+            return 0
+        if self.last is not None and samples[0] < self.last - self.restart_step:
+            self.reset()
+        if self.centre is None:
+            self.centre = samples[0]
+            self.first = samples[0]
+        if samples[-1] - self.centre > self.recentre_interval:
+            self._recentre(samples[-1])
+
+        z = numpy.asarray(targets, dtype=float) - samples / SAMPLE_RATE
+        dt = (samples - self.centre) / SAMPLE_RATE
+
+        if self.synced:
+            good = numpy.abs(z - self.offset - self.drift * dt) <= self.gate
+            n_good = int(numpy.count_nonzero(good))
+            self.rejected += len(z) - n_good
+            if n_good == 0:
+                self.rejects_in_row += len(z)
+                if self.rejects_in_row >= self.max_rejects:
+                    self.reset()
+                return 0
+            self.rejects_in_row = 0
+            samples, z, dt = samples[good], z[good], dt[good]
+
+        # Forget the existing information up to the end of this block and weight the block's own measurements
+        # by their age at its end.
+        end = samples[-1] if self.last is None else max(samples[-1], self.last)
+        if self.last is not None:
+            decay = math.exp(-(end - self.last) / SAMPLE_RATE / self.time_constant)
+            self.info *= decay
+            self.vector *= decay
+        w = self.weight * numpy.exp(-(end - samples) / SAMPLE_RATE / self.time_constant)
+        wdt = w * dt
+        self.info += numpy.array([[w.sum(), wdt.sum()], [wdt.sum(), wdt.dot(dt)]])
+        self.vector += numpy.array([w.dot(z), wdt.dot(z)])
+        self.last = end
+        self.measurements += len(z)
+
+        self.offset, self.drift = numpy.linalg.solve(self.info + numpy.diag([0.0, self.drift_prior]), self.vector)
+        if not self.synced:
+            self.synced = (self.measurements >= self.min_measurements and
+                           (self.last - self.first) / SAMPLE_RATE >= self.min_span)
+        return len(z)
+
+
+class ClockSync(object):
+    """Synchronise the clocks of a network of receivers to a reference receiver.
+
+    receivers maps receiver names to (latitude, longitude, altitude in metres).
+    Measurements are buffered per receiver and fitted batch_size at a time;
+    call flush() to fit any that are outstanding.
+    """
+
+    def __init__(self, receivers, reference, batch_size=32, **clock_args):
+        if reference not in receivers:
+            raise ValueError('Reference receiver {0!r} is not one of the receivers.'.format(reference))
+        self.names = list(receivers)
+        self.positions = dict((name, ecef(*receivers[name])) for name in self.names)
+        self.batch_size = batch_size
+        self.clocks = dict((name, ReceiverClock(**clock_args)) for name in self.names)
+        self.reference = reference
+        self._pending = dict((name, ([], [])) for name in self.names)
+        # The lowest level of the anchors of each receiver's pending measurements
+        self._anchor_levels = {}
+
+        # The reference receiver's clock defines the common time base. Being level 0 it is never updated.
+        clock = self.clocks[reference]
+        clock.centre = 0.0
+        clock.synced = True
+        clock.level = 0
+
+    def synced(self, receiver):
+        return self.clocks[receiver].synced
+
+    def observe(self, lat, lon, alt, heard):
+        """Add a position report at lat, lon (degrees) and alt (ft) heard at the timestamps heard.
+
+        heard maps receiver names to the report's timestamp (in samples) at that receiver.
+        """
+        if len(heard) < 2:
+            return
+        anchor = None
+        for name in heard:
+            clock = self.clocks[name]
+            if clock.synced and (anchor is None or clock.level < self.clocks[anchor].level):
+                anchor = name
+        if anchor is None:
+            return
+
+        aircraft = ecef(lat, lon, alt * METRES_PER_FOOT)
+        anchor_clock = self.clocks[anchor]
+        transmitted = (float(anchor_clock.to_common(heard[anchor])) -
+                       numpy.linalg.norm(aircraft - self.positions[anchor]) / C)
+        for name, samples in heard.items():
+            clock = self.clocks[name]
+            if name == anchor or (clock.synced and clock.level <= anchor_clock.level):
+                continue
+            pending_samples, pending_targets = self._pending[name]
+            pending_samples.append(samples)
+            pending_targets.append(transmitted + numpy.linalg.norm(aircraft - self.positions[name]) / C)
+            self._anchor_levels[name] = min(self._anchor_levels.get(name, anchor_clock.level), anchor_clock.level)
+            if len(pending_samples) >= self.batch_size:
+                self._fit(name)
+
+    def _fit(self, name):
+        clock = self.clocks[name]
+        pending_samples, pending_targets = self._pending[name]
+        order = numpy.argsort(pending_samples, kind='stable')
+        clock.update(numpy.asarray(pending_samples, dtype=float)[order],
+                     numpy.asarray(pending_targets)[order])
+        level = self._anchor_levels.pop(name)
+        if clock.synced and clock.level is None:
+            clock.level = level + 1
+        del pending_samples[:]
+        del pending_targets[:]
+
+    def flush(self):
+        """Fit all buffered measurements."""
+        for name in self.names:
+            if self._pending[name][0]:
+                self._fit(name)
+
+    def to_common(self, receiver, samples):
+        """Convert timestamps (samples, scalar or array) from receiver to seconds in the common time base."""
+        return self.clocks[receiver].to_common(samples)
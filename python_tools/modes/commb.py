@@ -0,0 +1,355 @@
+"""
+Comm-B (DF20/21 MB field) register decoding.
+
+The 56 bit MB field of a Comm-B reply holds the content of one of the
+transponder's BDS registers, but the reply does not say which one. Some
+registers start with their own BDS number; the rest must be inferred by
+checking which interpretations of the bits are self-consistent and
+plausible. Each decode_bds* function returns a dict of parameters or None if
+the MB cannot be an instance of that register.
+
+Bits are numbered 1 to 56 from the most significant bit of the MB as in
+ICAO document 9871.
+"""
+
+import collections
+import time
+
+import adsblib
+from .modes import SAMPLE_RATE
+
+
+MB_LENGTH_BITS = 56
+
+
+def field(mb, start, length):
+    """Extract length bits of mb starting at (1-based) bit start."""
+    return (mb >> (MB_LENGTH_BITS - start - length + 1)) & ((1 << length) - 1)
+
+
+def status_field(mb, status_bit, start, length, signed=False):
+    """Extract a value guarded by a status bit.
+
+    Returns (valid, value). When the status bit is clear the value bits must be
+    zero; if they aren't the MB is not an instance of the register and valid is
+    False. value is None when the status bit is clear.
+    """
+    sign_len = 1 if signed else 0
+    raw = field(mb, start, length + sign_len)
+    if not field(mb, status_bit, 1):
+        return raw == 0, None
+    value = raw & ((1 << length) - 1)
+    if signed and raw >> length:
+        value -= 1 << length
+    return True, value
+
+
+def decode_bds10(mb):
+    """BDS 1,0: Data link capability report."""
+    if field(mb, 1, 8) != 0x10 or field(mb, 10, 5) != 0:
+        return None
+    return {
+        'Continuation Flag': bool(field(mb, 9, 1)),
+        'Overlay Command Capability': bool(field(mb, 15, 1)),
+        'ACAS Operational': bool(field(mb, 16, 1)),
+        'Mode S Subnetwork Version': field(mb, 17, 7),
+        'Transponder Enhanced Protocol': bool(field(mb, 24, 1)),
+        'Mode S Specific Services Capability': bool(field(mb, 25, 1)),
+        'Squitter Capability': bool(field(mb, 34, 1)),
+        'Surveillance Identifier Capability': bool(field(mb, 35, 1)),
+        'Common Usage GICB Capability Report': bool(field(mb, 36, 1)),
+    }
+
+
+# Registers announced in the capability bits of BDS 1,7 (in bit order)
+GICB_REGISTERS = ('0,5', '0,6', '0,7', '0,8', '0,9', '0,A', '2,0', '2,1', '4,0', '4,1', '4,2', '4,3',
+                  '4,4', '4,5', '4,8', '5,0', '5,1', '5,2', '5,3', '5,4', '5,5', '5,6', '5,F', '6,0')
+
+
+def decode_bds17(mb):
+    """BDS 1,7: Common usage GICB capability report."""
+    # Bits 25 to 56 are reserved. Every Mode S transponder that reports 1,7 supports 2,0.
+    if field(mb, 25, 32) != 0 or not field(mb, 7, 1):
+        return None
+    caps = field(mb, 1, 24)
+    return {'Supported Registers': [reg for i, reg in enumerate(GICB_REGISTERS) if (caps >> (23 - i)) & 1]}
+
+
+def decode_bds20(mb):
+    """BDS 2,0: Aircraft identification."""
+    if field(mb, 1, 8) != 0x20:
+        return None
+    chars = [adsblib.IDENT_CHARSET[field(mb, 9 + 6 * i, 6)] for i in range(8)]
+    if '' in chars:
+        return None
+    return {'Identification': ''.join(chars)}
+
+
+def decode_bds30(mb):
+    """BDS 3,0: ACAS active resolution advisory."""
+    if field(mb, 1, 8) != 0x30:
+        return None
+    tti = field(mb, 29, 2)
+    if tti == 3:
+        return None
+    ret = {
+        'Active Resolution Advisories': field(mb, 9, 14),
+        'RA Complement Record': field(mb, 23, 4),
+        'RA Terminated': bool(field(mb, 27, 1)),
+        'Multiple Threat Encounter': bool(field(mb, 28, 1)),
+    }
+    if tti == 1:
+        ret['Threat ICAO No.'] = field(mb, 31, 24)
+    elif tti == 2:
+        ret['Threat Altitude Code'] = field(mb, 31, 13)
+    return ret
+
+
+MCP_MODES = ('VNAV', 'Alt. Hold', 'Approach')
+TARGET_ALT_SOURCES = ('Unknown', 'Aircraft altitude', 'FCU/MCP selected altitude', 'FMS selected altitude')
+
+
+def decode_bds40(mb):
+    """BDS 4,0: Selected vertical intention."""
+    if field(mb, 40, 8) != 0 or field(mb, 52, 2) != 0:
+        return None
+    ok_mcp, mcp_alt = status_field(mb, 1, 2, 12)
+    ok_fms, fms_alt = status_field(mb, 14, 15, 12)
+    ok_baro, baro = status_field(mb, 27, 28, 12)
+    ok_mode, modes = status_field(mb, 48, 49, 3)
+    ok_source, source = status_field(mb, 54, 55, 2)
+    if not (ok_mcp and ok_fms and ok_baro and ok_mode and ok_source):
+        return None
+    if mcp_alt is None and fms_alt is None and baro is None:
+        return None
+
+    ret = {}
+    if mcp_alt is not None:
+        ret['MCP/FCU Selected Altitude (ft)'] = mcp_alt * 16
+    if fms_alt is not None:
+        ret['FMS Selected Altitude (ft)'] = fms_alt * 16
+    if baro is not None:
+        ret['Barometric Pressure Setting (mb)'] = baro * 0.1 + 800.0
+    if modes is not None:
+        ret['MCP/FCU Modes'] = [mode for i, mode in enumerate(MCP_MODES) if (modes >> (2 - i)) & 1]
+    if source is not None:
+        ret['Target Altitude Source'] = TARGET_ALT_SOURCES[source]
+
+    for key in ('MCP/FCU Selected Altitude (ft)', 'FMS Selected Altitude (ft)'):
+        if key in ret and ret[key] > 50000:
+            return None
+    if baro is not None and not 900.0 <= ret['Barometric Pressure Setting (mb)'] <= 1100.0:
+        return None
+    return ret
+
+
+def decode_bds50(mb):
+    """BDS 5,0: Track and turn report."""
+    ok_roll, roll = status_field(mb, 1, 2, 9, signed=True)
+    ok_track, track = status_field(mb, 12, 13, 10, signed=True)
+    ok_gs, gs = status_field(mb, 24, 25, 10)
+    ok_rate, rate = status_field(mb, 35, 36, 9, signed=True)
+    ok_tas, tas = status_field(mb, 46, 47, 10)
+    if not (ok_roll and ok_track and ok_gs and ok_rate and ok_tas):
+        return None
+    if roll is None and track is None and gs is None and rate is None and tas is None:
+        return None
+
+    ret = {}
+    if roll is not None:
+        ret['Roll Angle'] = roll * 45.0 / 256.0
+        if abs(ret['Roll Angle']) > 50.0:
+            return None
+    if track is not None:
+        ret['True Track'] = (track * 90.0 / 512.0) % 360.0
+    if gs is not None:
+        ret['Ground Speed (kt)'] = gs * 2
+        if ret['Ground Speed (kt)'] > 600:
+            return None
+    if rate is not None:
+        ret['Track Angle Rate'] = rate * 8.0 / 256.0
+    if tas is not None:
+        ret['True Airspeed (kt)'] = tas * 2
+        if ret['True Airspeed (kt)'] > 500:
+            return None
+    if gs is not None and tas is not None and abs(ret['Ground Speed (kt)'] - ret['True Airspeed (kt)']) > 200:
+        return None
+    return ret
+
+
+def decode_bds60(mb):
+    """BDS 6,0: Heading and speed report."""
+    ok_hdg, hdg = status_field(mb, 1, 2, 10, signed=True)
+    ok_ias, ias = status_field(mb, 13, 14, 10)
+    ok_mach, mach = status_field(mb, 24, 25, 10)
+    ok_baro, baro_vr = status_field(mb, 35, 36, 9, signed=True)
+    ok_inertial, inertial_vr = status_field(mb, 46, 47, 9, signed=True)
+    if not (ok_hdg and ok_ias and ok_mach and ok_baro and ok_inertial):
+        return None
+    if hdg is None and ias is None and mach is None and baro_vr is None and inertial_vr is None:
+        return None
+
+    ret = {}
+    if hdg is not None:
+        ret['Magnetic Heading'] = (hdg * 90.0 / 512.0) % 360.0
+    if ias is not None:
+        ret['Indicated Airspeed (kt)'] = ias
+        if ias > 500:
+            return None
+    if mach is not None:
+        ret['Mach'] = mach * 2.048 / 512.0
+        if ret['Mach'] > 1.0:
+            return None
+    if baro_vr is not None:
+        ret['Baro. Vertical Rate (ft/min)'] = baro_vr * 32
+        if abs(ret['Baro. Vertical Rate (ft/min)']) > 6000:
+            return None
+    if inertial_vr is not None:
+        ret['Inertial Vertical Rate (ft/min)'] = inertial_vr * 32
+        if abs(ret['Inertial Vertical Rate (ft/min)']) > 6000:
+            return None
+    if ias is not None and mach is not None:
+        # Mach 1 is at most about 660kt so IAS can't be much more than 660 * Mach.
+        if ias > 700.0 * ret['Mach'] + 50.0:
+            return None
+    return ret
+
+
+# Register decoders in the order they are tried. Registers that identify themselves come first.
+DECODERS = collections.OrderedDict([
+    ('1,0', decode_bds10),
+    ('2,0', decode_bds20),
+    ('3,0', decode_bds30),
+    ('1,7', decode_bds17),
+    ('4,0', decode_bds40),
+    ('5,0', decode_bds50),
+    ('6,0', decode_bds60),
+])
+
+# Registers whose MB starts with their own register number
+SELF_IDENTIFYING = ('1,0', '2,0', '3,0')
+
+# Parameters compared with the aircraft's recent values (and the tolerance) when picking between candidates
+CONSISTENCY_CHECKS = {
+    'Identification': 0,
+    'True Track': 20.0,
+    'Magnetic Heading': 30.0,
+    'Ground Speed (kt)': 40.0,
+    'True Airspeed (kt)': 40.0,
+    'Indicated Airspeed (kt)': 40.0,
+    'Mach': 0.05,
+    'Baro. Vertical Rate (ft/min)': 2000.0,
+    'Inertial Vertical Rate (ft/min)': 2000.0,
+    'MCP/FCU Selected Altitude (ft)': 0,
+    'FMS Selected Altitude (ft)': 0,
+}
+ANGLES = ('True Track', 'Magnetic Heading')
+
+
+def consistent(params, reference):
+    """Return the number of parameters agreeing with reference, or -1 if any disagree."""
+    matches = 0
+    for key, tolerance in CONSISTENCY_CHECKS.items():
+        if key in params and key in reference:
+            diff = abs(params[key] - reference[key]) if tolerance else params[key] != reference[key]
+            if key in ANGLES:
+                diff = min(diff, 360.0 - diff)
+            if diff > tolerance:
+                return -1
+            matches += 1
+    return matches
+
+
+def infer(mb):
+    """Decode an MB without any history. Returns a list of (register, params) for every valid interpretation."""
+    candidates = []
+    for bds, decoder in DECODERS.items():
+        params = decoder(mb)
+        if params is not None:
+            candidates.append((bds, params))
+    return candidates
+
+
+class AircraftRegisters(object):
+    """The Comm-B registers recently confirmed for one aircraft and their latest values."""
+
+    def __init__(self):
+        self.registers = collections.OrderedDict()  # Register -> (params, time), most recently confirmed last
+        self.reference = {}  # Latest value of each parameter across all registers
+
+    def confirm(self, bds, params, now):
+        self.registers.pop(bds, None)
+        self.registers[bds] = (params, now)
+        self.reference.update(params)
+
+    def recent(self, now, max_age):
+        return [bds for bds, (_, t) in reversed(self.registers.items()) if now - t <= max_age]
+
+
+class CommBDecoder(object):
+    """Decode Comm-B replies using a per-aircraft cache of confirmed registers.
+
+    Full inference runs every register decoder over the MB. When an aircraft has
+    recently confirmed registers, those are tried first and an interpretation
+    consistent with the aircraft's recent values is accepted straight away.
+    Ambiguous MBs with no history to resolve them are left undecoded.
+    """
+
+    def __init__(self, max_age=30.0, max_aircraft=10000):
+        self.max_age = max_age
+        self.max_aircraft = max_aircraft
+        self.aircraft = collections.OrderedDict()  # ICAO No. -> AircraftRegisters, least recently used first
+        self.cache_hits = 0
+        self.inferences = 0
+
+    def registers_for(self, icao):
+        regs = self.aircraft.pop(icao, None)
+        if regs is None:
+            regs = AircraftRegisters()
+            if len(self.aircraft) >= self.max_aircraft:
+                self.aircraft.popitem(last=False)
+        self.aircraft[icao] = regs
+        return regs
+
+    def decode(self, icao, mb, now=None):
+        """Decode an MB from aircraft icao. Returns (register, params) or None if it can't be identified."""
+        if now is None:
+            now = time.time()
+        regs = self.registers_for(icao)
+
+        # Short cut: try the registers this aircraft has recently been replying with.
+        for bds in regs.recent(now, self.max_age):
+            params = DECODERS[bds](mb)
+            if params is None:
+                continue
+            score = consistent(params, regs.reference)
+            if score > 0 or (score == 0 and bds in SELF_IDENTIFYING):
+                self.cache_hits += 1
+                regs.confirm(bds, params, now)
+                return bds, params
+
+        self.inferences += 1
+        candidates = infer(mb)
+        if len(candidates) > 1:
+            scored = [(consistent(params, regs.reference), bds, params) for bds, params in candidates]
+            best = max(score for score, _, _ in scored)
+            candidates = [(bds, params) for score, bds, params in scored if score == best and score >= 0]
+            if len(candidates) > 1 and best == 0:
+                return None  # Nothing to tell the interpretations apart.
+        if len(candidates) != 1:
+            return None
+        bds, params = candidates[0]
+        regs.confirm(bds, params, now)
+        return bds, params
+
+    def decode_reply(self, reply, now=None):
+        """Decode the MB field of a DF20 or DF21 ModeSReply. Returns None for other formats.
+
+        now defaults to the time of the reply from its sample timestamp, so that the cache ages correctly when
+        a log is replayed faster than real time.
+        """
+        if reply.format not in (20, 21):
+            return None
+        if now is None and reply.timestamp is not None:
+            now = reply.timestamp / float(SAMPLE_RATE)
+        return self.decode(reply.icao.uint, reply.data[32:88].uint, now)
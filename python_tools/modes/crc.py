@@ -0,0 +1,164 @@
+"""
+Mode S CRC-24.
+
+Every Mode S reply ends with 24 parity bits generated by the polynomial
+0x1fff409 over the rest of the reply. In DF11/17/18 the parity is sent as is
+(possibly overlaid with an interrogator code in DF11); in the other formats
+it is XORed with the aircraft address (address/parity, AP).
+
+The CRC is computed a byte at a time from a 256 entry table, for single replies
+as ints or bytes, and for batches of replies as NumPy arrays of bytes or bits.
+On top of that, check() and check_batch() tell whether replies are intact and
+which aircraft sent them: DF11/17/18 replies must have the right parity (DF11
+may have an interrogator code in its last 7 bits) and AP replies must come from
+one of a set of known aircraft, such as an aircraft.AircraftRegistry.
+"""
+
+import numpy
+
+
+GENERATOR = 0x1fff409
+PARITY_BITS = 24
+PARITY_MASK = (1 << PARITY_BITS) - 1
+
+# Downlink formats with plain parity (the address is in the message)
+PLAIN_FORMATS = (11, 17, 18)
+# Downlink formats with address/parity
+AP_FORMATS = (0, 4, 5, 16, 20, 21)
+# The bits of the DF11 parity field which may be overlaid with the interrogator code
+DF11_IC_MASK = 0x7f
+
+
+def _bitwise_parity(data, n_bits):
+    value = data << PARITY_BITS
+    for i in range(n_bits + PARITY_BITS - 1, PARITY_BITS - 1, -1):
+        if (value >> i) & 1:
+            value ^= GENERATOR << (i - PARITY_BITS)
+    return value
+
+
+def _crc_table():
+    """The parity of each byte value as the only data."""
+    return [_bitwise_parity(byte, 8) for byte in range(256)]
+
+
+CRC_TABLE = _crc_table()
+
+
+def crc_bytes(data):
+    """The 24 parity bits for the bytes of data (bytes, a bytearray or a list of ints)."""
+    table = CRC_TABLE
+    value = 0
+    for byte in data:
+        value = ((value << 8) & PARITY_MASK) ^ table[(value >> 16) ^ byte]
+    return value
+
+
+def parity(data, n_bits):
+    """The 24 parity bits for the n_bits of data (an int) which precede them in a reply."""
+    if n_bits % 8:
+        return _bitwise_parity(data, n_bits)
+    return crc_bytes(data.to_bytes(n_bits // 8, 'big'))
+
+
+def append_parity(data, n_bits, address=0):
+    """Append the parity field to data, overlaid with address for AP formats. Returns the full reply as an int."""
+    return (data << PARITY_BITS) | (parity(data, n_bits) ^ address)
+
+
+def syndrome(frame, n_bits):
+    """The parity of a full n_bits reply XORed with its parity field.
+
+    This is zero for an undamaged DF17/18 reply and the aircraft address for an
+    undamaged AP reply.
+    """
+    data_bits = n_bits - PARITY_BITS
+    return parity(frame >> PARITY_BITS, data_bits) ^ (frame & PARITY_MASK)
+
+
+def syndrome_bytes(frame):
+    """The syndrome of a full reply given as 7 or 14 bytes."""
+    return crc_bytes(frame[:-3]) ^ (frame[-3] << 16 | frame[-2] << 8 | frame[-1])
+
+
+def _bit_syndromes(n_bits=112):
+    """The syndrome of an n_bits reply with only bit i (counting from the first bit sent) set, for each i."""
+    return [parity(1 << (n_bits - PARITY_BITS - 1 - i), n_bits - PARITY_BITS) if i < n_bits - PARITY_BITS
+            else 1 << (n_bits - 1 - i) for i in range(n_bits)]
+
+
+# The CRC is linear so the syndrome of a reply is the XOR of the syndromes of its set bits. A short (56 bit)
+# reply uses the last 56 entries (leading zero bits don't change the CRC).
+BIT_SYNDROMES = numpy.array(_bit_syndromes(), dtype=numpy.uint32)
+
+
+# Bit j of each entry, for counting the set bits of a reply that contribute to bit j of its syndrome
+_BIT_PLANES = ((BIT_SYNDROMES[:, None] >> numpy.arange(PARITY_BITS - 1, -1, -1)) & 1).astype(numpy.float32)
+_BIT_VALUES = 1 << numpy.arange(PARITY_BITS - 1, -1, -1)
+
+
+def syndromes(bits):
+    """The syndromes of a batch of replies given as an (n_replies, n_bits) array of 0s and 1s."""
+    bits = numpy.asarray(bits, dtype=numpy.float32)
+    planes = _BIT_PLANES[len(_BIT_PLANES) - bits.shape[1]:]
+    # Each bit of the syndrome is the parity of a count, which a floating point matrix product gives exactly (and fast).
+    odd = numpy.dot(bits, planes).astype(numpy.int64) & 1
+    return numpy.dot(odd, _BIT_VALUES).astype(numpy.uint32)
+
+
+# The syndrome of each value of each byte of a 14 byte reply (the XOR of the syndromes of its set bits), shape
+# (14, 256). A 7 byte reply uses the last 7 rows.
+_BYTE_SYNDROMES = numpy.bitwise_xor.reduce(
+    BIT_SYNDROMES.reshape(14, 1, 8) * ((numpy.arange(256)[None, :, None] >> numpy.arange(7, -1, -1)) & 1), axis=2)
+
+
+def _byte_array(frames):
+    """An (n_replies, n_bytes) uint8 array of frames, which may also be a list of bytes objects of the same length."""
+    if len(frames) and isinstance(frames[0], (bytes, bytearray)):
+        return numpy.frombuffer(b''.join(frames), dtype=numpy.uint8).reshape(len(frames), -1)
+    return numpy.asarray(frames, dtype=numpy.uint8)
+
+
+def syndromes_bytes(frames):
+    """The syndromes of a batch of replies given as an (n_replies, 7 or 14) array of bytes."""
+    frames = _byte_array(frames)
+    table = _BYTE_SYNDROMES[len(_BYTE_SYNDROMES) - frames.shape[1]:]
+    return numpy.bitwise_xor.reduce(table[numpy.arange(frames.shape[1]), frames], axis=1).astype(numpy.uint32)
+
+
+def check(frame, known=()):
+    """The address of the aircraft which sent a full reply given as 7 or 14 bytes, or None if it fails its parity check.
+
+    The address of an AP reply is only trusted if it's in known (any container of ints, e.g. an
+    aircraft.AircraftRegistry). Replies in other formats (e.g. DF19 and DF24) can't be checked.
+    """
+    df = frame[0] >> 3
+    if len(frame) * 8 != (112 if df >= 16 else 56):
+        return None
+    value = syndrome_bytes(frame)
+    if df in AP_FORMATS:
+        return value if value in known else None
+    if df in (17, 18) and value == 0 or df == 11 and not value & ~DF11_IC_MASK:
+        return frame[1] << 16 | frame[2] << 8 | frame[3]
+    return None
+
+
+def check_batch(frames, known=()):
+    """check() for a batch of replies of the same length given as an (n_replies, 7 or 14) array of bytes.
+
+    Returns an array of the addresses, with -1 for the replies which fail.
+    """
+    frames = _byte_array(frames)
+    values = syndromes_bytes(frames).astype(numpy.int64)
+    df = frames[:, 0] >> 3
+    long_formats = frames.shape[1] == 14
+    aa = frames[:, 1].astype(numpy.int64) << 16 | frames[:, 2].astype(numpy.int64) << 8 | frames[:, 3]
+    addresses = numpy.full(len(frames), -1, dtype=numpy.int64)
+    plain = ((df == 17) | (df == 18)) & (values == 0) if long_formats else (df == 11) & (values & ~DF11_IC_MASK == 0)
+    addresses[plain] = aa[plain]
+    ap = numpy.isin(df, AP_FORMATS) & ((df >= 16) == long_formats)
+    # Few distinct addresses come up, so look each one up once.
+    candidates, inverse = numpy.unique(values[ap], return_inverse=True)
+    trusted = numpy.array([int(candidate) in known for candidate in candidates], dtype=bool)
+    addresses[numpy.flatnonzero(ap)[trusted[inverse]]] = values[ap][trusted[inverse]]
+    return addresses
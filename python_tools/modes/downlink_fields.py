@@ -1,3 +1,87 @@
+import warnings
+
+import numpy
+
+import gillham
+
+
+# Number of possible values of the 13 bit AC and ID fields
+FIELD_13_VALUES = 1 << 13
+FEET_PER_METRE = 1 / 0.3048
+
+
+def _decode_ac13(code):
+    """Decode a 13 bit AC field to an altitude in feet. Returns None for codes that don't give an altitude."""
+    m_bit = (code >> 6) & 1
+    q_bit = (code >> 4) & 1
+    if m_bit:
+        # Annex 10 reserves M = 1 for metric reporting without defining the coding. It is taken to be a plain
+        # binary count of metres in the remaining 12 bits.
+        return (((code & 0x1f80) >> 1) | (code & 0x3f)) * FEET_PER_METRE
+    if q_bit:
+        # 25 ft increments: D11 to D1 are an 11 bit binary number N and the altitude is 25N - 1000 ft.
+        n = ((code & 0x1f80) >> 2) | ((code & 0x20) >> 1) | (code & 0x0f)
+        return 25.0 * n - 1000.0
+    if code == 0:
+        return None  # Altitude not available
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return gillham.decode_from_message(code, has_mbit=True)
+
+
+def _decode_id13(code):
+    """Decode a 13 bit ID field (C1 A1 C2 A2 C4 A4 X B1 D1 B2 D2 B4 D4) to a Mode A code, e.g. 7700."""
+    def digit(bit4, bit2, bit1):
+        return ((code >> bit4) & 1) << 2 | ((code >> bit2) & 1) << 1 | ((code >> bit1) & 1)
+    return (1000 * digit(7, 9, 11) + 100 * digit(1, 3, 5) +
+            10 * digit(8, 10, 12) + digit(0, 2, 4))
+
+
+def encode_id13(squawk):
+    """Encode a Mode A code such as 7700 as a 13 bit ID field. The inverse of decode_id13()."""
+    a, b, c, d = (int(digit) for digit in '{0:04d}'.format(squawk))
+    if max(a, b, c, d) > 7:
+        raise ValueError('{0:04d} is not a valid Mode A code.'.format(squawk))
+
+    def bits(digit, bit4, bit2, bit1):
+        return ((digit >> 2) & 1) << bit4 | ((digit >> 1) & 1) << bit2 | (digit & 1) << bit1
+    return bits(a, 7, 9, 11) | bits(b, 1, 3, 5) | bits(c, 8, 10, 12) | bits(d, 0, 2, 4)
+
+
+def _build_tables():
+    ac13 = numpy.array([_decode_ac13(code) for code in range(FIELD_13_VALUES)], dtype=float)  # None -> NaN
+    id13 = numpy.array([_decode_id13(code) for code in range(FIELD_13_VALUES)], dtype=numpy.int16)
+    ac13.flags.writeable = False
+    id13.flags.writeable = False
+    return ac13, id13
+
+
+# Lookup tables indexed by the raw 13 bit field: altitude in feet (NaN if unavailable) and Mode A code
+AC13_TABLE, ID13_TABLE = _build_tables()
+_AC13_LIST = [None if numpy.isnan(alt) else float(alt) for alt in AC13_TABLE]
+_ID13_LIST = ID13_TABLE.tolist()
+
+
+def decode_ac13(code):
+    """Altitude in feet from a 13 bit AC field, or None if it isn't available."""
+    return _AC13_LIST[code & 0x1fff]
+
+
+def decode_ac13_array(codes):
+    """Vectorized decode_ac13 for an array of AC fields. Unavailable altitudes are NaN."""
+    return AC13_TABLE[numpy.asarray(codes, dtype=numpy.intp) & 0x1fff]
+
+
+def decode_id13(code):
+    """Mode A code (squawk) from a 13 bit ID field as an int whose decimal digits are the code, e.g. 7700."""
+    return _ID13_LIST[code & 0x1fff]
+
+
+def decode_id13_array(codes):
+    """Vectorized decode_id13 for an array of ID fields."""
+    return ID13_TABLE[numpy.asarray(codes, dtype=numpy.intp) & 0x1fff]
+
+
 class AltitudeCode(object):
     """
     3.1.2.6.5.4 AC: Altitude code.
@@ -16,6 +100,7 @@ class AltitudeCode(object):
     length = 13
     df_validity = (4, 20)
     unit = None
+    altitude = None
 
     def __init__(self, data):
         self.data = data
@@ -24,10 +109,34 @@ class AltitudeCode(object):
     def unpack(self):
         m, q = self.data.unpack('pad:6, bool, pad:1, bool, pad:4')
         self.unit = 'meters' if m else 'feet'
+        self.altitude = decode_ac13(self.data.uint)  # Always in feet
 
     @property
     def valid(self):
-        self.data.all(0)
+        return self.altitude is not None
+
+
+class IdentityCode(object):
+    """
+    3.1.2.6.7.1 ID: Identity (Mode A code).
+
+
+     0   1   2   3   4   5 | 6|  7   8   9  10  11  12
+    C1  A1  C2  A2  C4  A4 | X| B1  D1  B2  D2  B4  D4
 
 
+    """
+
+    length = 13
+    df_validity = (5, 21)
+    squawk = None
+
+    def __init__(self, data):
+        self.data = data
+        self.unpack()
+
+    def unpack(self):
+        self.squawk = decode_id13(self.data.uint)
 
+    def __str__(self):
+        return '{0:04d}'.format(self.squawk)
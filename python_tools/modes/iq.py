@@ -0,0 +1,341 @@
+"""
+Offline demodulation of raw IQ sample files with NumPy.
+
+This runs the receiver's signal processing over a file of 8 bit offset binary
+IQ samples such as one written by receiver -w, so that a capture can be
+reprocessed with a different detection threshold or number of fractional delay
+filters. The steps are the same as in receiver.c:
+
+1. Interpolate each sample period with windowed sinc fractional delay filters.
+2. Correlate the square magnitudes with the preamble, normalised by their sum.
+3. Demodulate the PPM bits at the peak of each run of correlation values above
+   the threshold.
+4. Check the CRC. Single bit errors are corrected in DF11/17/18 replies.
+
+Each step is vectorised over a whole chunk of samples. The file is memory
+mapped and split into chunks which are processed in parallel by a pool of
+processes. Each chunk is extended by a lead-in and a tail that overlap its
+neighbours, so replies near a chunk boundary are neither lost nor duplicated.
+
+Replies whose parity is overlaid with the aircraft address (address/parity, AP)
+are only accepted from aircraft that have been heard recently in a DF11/17/18
+reply, as in the receiver. This check needs the replies in time order, so the
+workers return every candidate and it is made as the chunks' results are
+merged in order. Within a chunk a worker can only tell that a candidate is a
+reply (so that its samples are skipped, as the receiver does) if the aircraft
+was heard earlier in the chunk.
+
+Replies are returned as lines in the receiver's output format, with the same
+timestamps the receiver would give them.
+"""
+
+import concurrent.futures
+import itertools
+import math
+import os
+
+import numpy
+
+from .crc import BIT_SYNDROMES, syndromes
+from .modes import SAMPLE_RATE
+
+
+# These match receiver.c.
+PROCESS_BLOCK_SIZE = 256 * 1024
+FILTER_LEN = 32
+N_FILTERS = 4
+PREAMBLE_SAMPLES = 16
+SAMPLES_PER_BIT = 2
+MESSAGE_BITS_MAX = 112
+MESSAGE_BITS_SHORT = 56
+DF_BITS = 5
+PARITY_BITS = 24
+# Downlink formats with plain parity (the address is in the message)
+PLAIN_FORMATS = (11, 17, 18)
+# The samples of the preamble with pulses
+PREAMBLE_PULSES = (0, 2, 7, 9)
+
+CHUNK_SIZE = 4 * 1024 * 1024  # Samples
+# Samples processed before and after each chunk so that detections spanning its boundaries are handled
+OVERLAP = 2048
+# A reply needs this many interpolated samples from the start of its preamble.
+REPLY_SAMPLES = PREAMBLE_SAMPLES + MESSAGE_BITS_MAX * SAMPLES_PER_BIT
+
+
+def filter_coeffs(n_filters=N_FILTERS, filter_len=FILTER_LEN):
+    """The Hann windowed sinc fractional delay filters of receiver.c, shape (n_filters, filter_len)."""
+    i = numpy.arange(n_filters)[:, None] / float(n_filters)
+    j = numpy.arange(filter_len)[None, :]
+    window = 0.5 * (1.0 - numpy.cos(2 * math.pi * ((j + 1) - i) / filter_len))
+    x = math.pi * (j - (filter_len // 2 - 1) - i)
+    sinc = numpy.where(x == 0.0, 1.0, numpy.sin(x) / numpy.where(x == 0.0, 1.0, x))
+    return (sinc * window).astype(numpy.float32)
+
+
+def interpolate(iq, coeffs):
+    """Square magnitudes of the interpolated samples, shape (n_filters, n_samples - filter_len + 1).
+
+    iq is an array of interleaved 8 bit I and Q values.
+    """
+    re = iq[0::2].astype(numpy.float32) - 128.0
+    im = iq[1::2].astype(numpy.float32) - 128.0
+    out = numpy.empty((len(coeffs), len(re) - coeffs.shape[1] + 1), dtype=numpy.float32)
+    for n, c in enumerate(coeffs):
+        out_re = numpy.correlate(re, c, 'valid')
+        out_im = numpy.correlate(im, c, 'valid')
+        out[n] = out_re * out_re + out_im * out_im
+    return out
+
+
+def correlate_preamble(interp):
+    """Preamble correlation normalised by signal energy for each start sample, shape (n_filters, n - 15)."""
+    n = interp.shape[1] - PREAMBLE_SAMPLES + 1
+    # The coefficients are +1 at the pulses and -1 elsewhere, so the correlation is 2 * pulses - total.
+    pulses = sum(interp[:, k:n + k] for k in PREAMBLE_PULSES)
+    total = interp[:, :-1] + interp[:, 1:]
+    for width in (2, 4, 8):
+        total = total[:, :-width] + total[:, width:]
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        detect = 2.0 * pulses / total - 1.0
+    detect[numpy.isnan(detect)] = -numpy.inf  # No signal at all
+    return detect
+
+
+def find_runs(flat, threshold):
+    """Find the runs of correlation values above threshold.
+
+    flat is the correlation in the receiver's search order (by sample, then by filter), i.e.
+    correlate_preamble(...).T.ravel(). Returns (starts, ends, peaks) as indices into flat: ends
+    are the first index after each run and peaks the first maximum of each run (the receiver
+    only replaces its maximum with a larger value). Runs still open at the end are left out.
+    """
+    above = numpy.concatenate(([False], flat > threshold, [False]))
+    edges = numpy.flatnonzero(above[1:] != above[:-1])
+    starts, ends = edges[0::2], edges[1::2]
+    closed = ends < len(flat)
+    starts, ends = starts[closed], ends[closed]
+    if not len(starts):
+        return starts, ends, starts
+
+    # Mask the values between runs so that reduceat() over each run and the gap after it finds the run's maximum.
+    end = ends[-1]
+    edges = numpy.zeros(end + 1, dtype=numpy.int64)
+    edges[starts] += 1
+    edges[ends] -= 1
+    masked = numpy.where(numpy.cumsum(edges[:-1]) > 0, flat[:end], -numpy.inf)
+    maxima = numpy.maximum.reduceat(masked, starts)
+    run_of = numpy.cumsum(edges[:-1] > 0) - 1
+    hits = numpy.flatnonzero(masked == maxima[run_of])
+    _, first = numpy.unique(run_of[hits], return_index=True)
+    return starts, ends, hits[first]
+
+
+def demodulate(interp, filters, positions):
+    """Hard PPM decisions for the replies whose preambles start at positions, shape (n, 112)."""
+    index = positions[:, None] + PREAMBLE_SAMPLES + SAMPLES_PER_BIT * numpy.arange(MESSAGE_BITS_MAX)
+    first = interp[filters[:, None], index]
+    second = interp[filters[:, None], index + 1]
+    return (first > second).astype(numpy.uint8)
+
+
+# The syndrome of each bit of a short (row 0) and a long (row 1) reply
+_TABLES = numpy.array([numpy.concatenate((BIT_SYNDROMES[MESSAGE_BITS_MAX - MESSAGE_BITS_SHORT:],
+                                          numpy.zeros(MESSAGE_BITS_MAX - MESSAGE_BITS_SHORT, numpy.uint32))),
+                       BIT_SYNDROMES])
+
+
+# Weights of bits 8-31, which hold the address of a DF11/17/18 reply
+_ADDRESS_VALUES = 1 << numpy.arange(PARITY_BITS - 1, -1, -1)
+
+
+def _syndromes(bits):
+    """The syndromes of a batch of demodulated replies, each taken as long or short according to its first bit."""
+    return numpy.where(bits[:, 0] == 1, syndromes(bits), syndromes(bits[:, :MESSAGE_BITS_SHORT]))
+
+
+def check_crc(bits):
+    """Check and correct the CRC of a batch of demodulated replies (modifying bits) as the receiver does.
+
+    Returns (plain, address): plain is true for DF11/17/18 replies which passed the CRC
+    (possibly after correcting one bit) and address the parity syndrome of the rest, which is
+    the aircraft address if they are valid AP replies.
+    """
+    long_ = bits[:, 0] == 1
+    syn = _syndromes(bits)
+    lengths = long_.astype(numpy.intp)
+    df = bits[:, :DF_BITS].dot(1 << numpy.arange(DF_BITS - 1, -1, -1))
+    is_plain = numpy.isin(df, PLAIN_FORMATS)
+    plain = is_plain & (syn == 0)
+
+    # A single bit error after the DF field leaves the syndrome of that bit.
+    n_body = numpy.where(long_, MESSAGE_BITS_MAX, MESSAGE_BITS_SHORT)
+    todo = numpy.flatnonzero(is_plain & ~plain)
+    match = (_TABLES[lengths[todo], DF_BITS:] == syn[todo, None]) & \
+        (numpy.arange(DF_BITS, MESSAGE_BITS_MAX) < n_body[todo, None])
+    found = match.any(axis=1)
+    fixed, bit = todo[found], match[found].argmax(axis=1) + DF_BITS
+    bits[fixed, bit] ^= 1
+    plain[fixed] = True
+
+    # An error in the DF field itself changes the format. Changing the first bit changes the length too.
+    for k in range(DF_BITS):
+        todo = numpy.flatnonzero(~plain)
+        new_df = df[todo] ^ (1 << (DF_BITS - 1 - k))
+        if k == 0:
+            flipped = bits[todo]
+            flipped[:, 0] ^= 1
+            new_syn = _syndromes(flipped)
+        else:
+            new_syn = syn[todo] ^ _TABLES[lengths[todo], k]
+        ok = todo[numpy.isin(new_df, PLAIN_FORMATS) & (new_syn == 0)]
+        bits[ok, k] ^= 1
+        plain[ok] = True
+
+    return plain, numpy.where(plain, 0, syn).astype(numpy.uint32)
+
+
+def frame_value(packed, n_bits):
+    """The reply (without parity) from one row of demodulated bits packed into bytes."""
+    return int.from_bytes(packed.tobytes(), 'big') >> (MESSAGE_BITS_MAX - n_bits + PARITY_BITS)
+
+
+def valid_address(icao):
+    return 0 < icao < 0xffffff
+
+
+def _decode(interp, filters, positions):
+    """Demodulate and check the replies at positions. Returns (bits, plain, addresses).
+
+    The address is the one in each DF11/17/18 reply which passed the CRC, and the parity syndrome
+    (the address if it's a valid AP reply) of the rest.
+    """
+    bits = demodulate(interp, filters, positions)
+    plain, syndrome = check_crc(bits)
+    return bits, plain, numpy.where(plain, bits[:, 8:32].dot(_ADDRESS_VALUES), syndrome)
+
+
+def decode_chunk(path, start, end, threshold=0.0, n_filters=N_FILTERS, known=frozenset()):
+    """Decode the replies whose preambles start at samples [start, end) of the IQ file at path.
+
+    Returns the arrays (timestamps, filters, plain, addresses, bits) of the DF11/17/18 replies
+    which passed the CRC (plain) and of the other candidates whose parity syndrome is a valid
+    address, in time order. bits holds each reply's demodulated bits packed into 14 bytes. The
+    candidates still have to be checked against the aircraft heard (see Demodulator). They only
+    take up their samples, so that no reply is looked for within them, if their address is in
+    known or was heard in a DF11/17/18 reply earlier in the chunk.
+    """
+    samples = numpy.memmap(path, dtype=numpy.uint8, mode='r')
+    n_samples = len(samples) // 2
+    first = max(start - OVERLAP, 0)
+    last = min(end + OVERLAP, n_samples)
+    iq = numpy.array(samples[2 * first:2 * last])
+    del samples
+
+    interp = interpolate(iq, filter_coeffs(n_filters))
+    flat = correlate_preamble(interp).T.ravel()
+    starts, ends, peaks = find_runs(flat, threshold)
+    positions, filters = peaks // n_filters, peaks % n_filters
+    # Only attempt replies which lie entirely within the data.
+    usable = numpy.flatnonzero(positions + REPLY_SAMPLES <= interp.shape[1])
+    bits = numpy.zeros((len(peaks), MESSAGE_BITS_MAX), dtype=numpy.uint8)
+    plain = numpy.zeros(len(peaks), dtype=bool)
+    addresses = numpy.zeros(len(peaks), dtype=numpy.int64)
+    bits[usable], plain[usable], addresses[usable] = _decode(interp, filters[usable], positions[usable])
+
+    # Walk the runs in order as the receiver does. After each run the rest of its last sample is skipped, and after a
+    # reply the samples it occupies are too.
+    found = []  # (position, filter_no, plain, address, bits)
+    local_known = set()
+    resume = 0
+    for r in range(len(starts)):
+        if ends[r] <= resume:
+            continue
+        if starts[r] < resume:
+            # The start of this run was skipped, so its peak must be found again.
+            peak = resume + int(numpy.argmax(flat[resume:ends[r]]))
+            position, filter_no = peak // n_filters, peak % n_filters
+            if position + REPLY_SAMPLES > interp.shape[1]:
+                resume = (ends[r] // n_filters + 1) * n_filters
+                continue
+            row_bits, row_plain, row_address = _decode(interp, numpy.array([filter_no]), numpy.array([position]))
+            row_bits, is_plain, icao = row_bits[0], bool(row_plain[0]), int(row_address[0])
+        else:
+            position, filter_no = int(positions[r]), int(filters[r])
+            row_bits, is_plain, icao = bits[r], bool(plain[r]), int(addresses[r])
+
+        if is_plain:
+            decoded = True  # Even if the address is invalid, the samples are skipped.
+            if valid_address(icao):
+                local_known.add(icao)
+        else:
+            decoded = icao in known or icao in local_known
+        if valid_address(icao) and start <= first + position < end:
+            found.append((position, filter_no, is_plain, icao, row_bits))
+        skip = (MESSAGE_BITS_MAX if row_bits[0] else MESSAGE_BITS_SHORT) * SAMPLES_PER_BIT if decoded else 0
+        resume = (ends[r] // n_filters + 1 + skip) * n_filters
+
+    return (numpy.array([PROCESS_BLOCK_SIZE + first + reply[0] + PREAMBLE_SAMPLES for reply in found],
+                        dtype=numpy.int64),
+            numpy.array([reply[1] for reply in found], dtype=numpy.uint8),
+            numpy.array([reply[2] for reply in found], dtype=bool),
+            numpy.array([reply[3] for reply in found], dtype=numpy.uint32),
+            numpy.packbits(numpy.array([reply[4] for reply in found], dtype=numpy.uint8).reshape(
+                (len(found), MESSAGE_BITS_MAX)), axis=1))
+
+
+def format_line(timestamp, filter_no, icao, value, n_bits, n_filters=N_FILTERS):
+    """A reply as a line of receiver.c output."""
+    return '{0:014d}.{1:02d}: 0x{2:06x}, 0x{3:0{4}x};\n'.format(
+        timestamp, 100 * filter_no // n_filters, icao, value, (n_bits - PARITY_BITS) // 4)
+
+
+class Demodulator(object):
+    """Demodulate IQ files in parallel, validating AP replies against the aircraft heard as the receiver does.
+
+    workers processes demodulate chunks of chunk_size samples. ttl is the time (s) for which an
+    aircraft stays known after it was last heard and known an optional collection of addresses
+    to start with (as receiver -l).
+    """
+
+    def __init__(self, threshold=0.0, n_filters=N_FILTERS, workers=None, chunk_size=CHUNK_SIZE, ttl=60.0,
+                 known=()):
+        self.threshold = threshold
+        self.n_filters = n_filters
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.ttl = ttl * SAMPLE_RATE
+        self.preload = frozenset(icao for icao in known if valid_address(icao))
+        self.known = dict((icao, 0) for icao in self.preload)  # ICAO No. -> timestamp last heard
+        self.replies = 0
+        self.rejected = 0
+
+    def _accept(self, timestamp, plain, icao):
+        if not plain:
+            heard = self.known.get(icao)
+            if heard is None or (self.ttl and timestamp - heard > self.ttl):
+                return False
+        self.known[icao] = timestamp
+        return True
+
+    def lines(self, path):
+        """Yield the replies decoded from the IQ file at path as receiver format lines, in time order."""
+        n_samples = os.path.getsize(path) // 2
+        starts = range(0, n_samples, self.chunk_size)
+        ends = [min(start + self.chunk_size, n_samples) for start in starts]
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            chunks = executor.map(decode_chunk, itertools.repeat(path), starts, ends, itertools.repeat(self.threshold),
+                                  itertools.repeat(self.n_filters), itertools.repeat(self.preload))
+            for timestamps, filters, plain, addresses, bits in chunks:
+                # Nearly all the candidates are noise. Only those with the address of an aircraft heard before can pass.
+                heard = numpy.array(list(self.known.keys() | set(addresses[plain].tolist())), dtype=numpy.uint32)
+                candidates = ~plain & numpy.isin(addresses, heard)
+                self.rejected += int((~plain).sum() - candidates.sum())
+                for i in numpy.flatnonzero(plain | candidates):
+                    timestamp, icao = int(timestamps[i]), int(addresses[i])
+                    if not self._accept(timestamp, plain[i], icao):
+                        self.rejected += 1
+                        continue
+                    n_bits = MESSAGE_BITS_MAX if bits[i, 0] & 0x80 else MESSAGE_BITS_SHORT
+                    self.replies += 1
+                    yield format_line(timestamp, int(filters[i]), icao, frame_value(bits[i], n_bits), n_bits,
+                                      self.n_filters)
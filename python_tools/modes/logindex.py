@@ -0,0 +1,260 @@
+"""
+Sparse index over raw receiver logs.
+
+A receiver log is a text file of lines in the format printed by receiver.c:
+
+    00000000506733.25: 0x4840d6, 0x8d4840d6202cc371c32ce0;
+
+The index splits the log into chunks covering a fixed span of timestamps and
+records, for each chunk, its byte range, the timestamps it covers and a Bloom
+filter of the ICAO addresses heard within it. Queries seek straight to the
+chunks that can contain matching replies and only parse those.
+
+The index is stored next to the log (<log>.idx by default) and is append only,
+so it can be brought up to date cheaply while the log is still being written.
+Its header records the index parameters and a checksum of the log's first line.
+An index written with other parameters, or for a log that has since been
+rotated (its first line changed) or truncated, is rebuilt from the start.
+"""
+
+import os
+import zlib
+
+from .modes import ModeSReply, SAMPLE_RATE
+
+
+INDEX_VERSION = 2
+
+
+class IcaoBloomFilter(object):
+    """A Bloom filter over 24 bit ICAO addresses stored in a Python int."""
+
+    def __init__(self, n_bits=4096, n_hashes=4, bits=0):
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.bits = bits
+
+    def positions(self, icao):
+        # Double hashing with two multiplicative hashes of the address.
+        h1 = (icao * 0x9e3779b1) & 0xffffffff
+        h2 = ((icao * 0x85ebca6b) & 0xffffffff) | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, icao):
+        for pos in self.positions(icao):
+            self.bits |= 1 << pos
+
+    def update(self, icaos):
+        for icao in icaos:
+            self.add(icao)
+
+    def __contains__(self, icao):
+        return all((self.bits >> pos) & 1 for pos in self.positions(icao))
+
+    def to_hex(self):
+        return '{0:x}'.format(self.bits)
+
+    @classmethod
+    def from_hex(cls, text, n_bits, n_hashes):
+        return cls(n_bits, n_hashes, int(text, 16))
+
+
+class LogChunk(object):
+    """A contiguous run of complete lines in the log."""
+
+    def __init__(self, offset, length, lines, min_timestamp, max_timestamp, bloom):
+        self.offset = offset
+        self.length = length
+        self.lines = lines
+        self.min_timestamp = min_timestamp
+        self.max_timestamp = max_timestamp
+        self.bloom = bloom
+
+    @property
+    def end(self):
+        return self.offset + self.length
+
+    def overlaps(self, start=None, end=None):
+        if start is not None and self.max_timestamp < start:
+            return False
+        if end is not None and self.min_timestamp > end:
+            return False
+        return True
+
+    def may_contain(self, icao):
+        return icao in self.bloom
+
+    def format(self):
+        return '{0} {1} {2} {3!r} {4!r} {5}\n'.format(
+            self.offset, self.length, self.lines,
+            self.min_timestamp, self.max_timestamp, self.bloom.to_hex())
+
+    @classmethod
+    def parse(cls, line, n_bits, n_hashes):
+        offset, length, lines, min_ts, max_ts, bloom = line.split()
+        return cls(int(offset), int(length), int(lines), float(min_ts), float(max_ts),
+                   IcaoBloomFilter.from_hex(bloom, n_bits, n_hashes))
+
+
+def split_line(line):
+    """Cheaply extract (timestamp, icao) from a raw log line without a full parse.
+
+    Returns None for lines that are not replies (blank lines, diagnostics etc.).
+    """
+    timestamp, sep, rest = line.partition(b': 0x')
+    if not sep or len(rest) < 6:
+        return None
+    try:
+        return float(timestamp), int(rest[:6], 16)
+    except ValueError:
+        return None
+
+
+class LogIndex(object):
+    """Sparse time/ICAO index over a receiver log file.
+
+    interval is the span of timestamps (in samples) covered by each chunk.
+    max_lines bounds the number of lines in a chunk so that the Bloom filters
+    stay selective in busy airspace.
+    """
+
+    def __init__(self, log_path, index_path=None, interval=10 * SAMPLE_RATE,
+                 max_lines=50000, bloom_bits=4096, bloom_hashes=4):
+        self.log_path = log_path
+        self.index_path = index_path if index_path else log_path + '.idx'
+        self.interval = interval
+        self.max_lines = max_lines
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        self.chunks = []
+        self._first_line = None  # Checksum of the log's first line recorded in the stored index
+        self._loaded = False  # Whether the stored index is compatible and can be appended to
+        self.load()
+
+    @property
+    def indexed_offset(self):
+        """The log offset up to which the stored chunks are complete."""
+        return self.chunks[-1].end if self.chunks else 0
+
+    def header(self, first_line):
+        return '# modes log index v{0} interval={1!r} bits={2} hashes={3} first={4}\n'.format(
+            INDEX_VERSION, self.interval, self.bloom_bits, self.bloom_hashes, first_line)
+
+    def log_first_line(self):
+        """A checksum of the first complete line of the log (in hex), or '-' if there isn't one yet."""
+        with open(self.log_path, 'rb') as log:
+            line = log.readline()
+        return '{0:08x}'.format(zlib.crc32(line)) if line.endswith(b'\n') else '-'
+
+    def load(self):
+        """Read the stored index. A missing or incompatible index is discarded (and rebuilt by update())."""
+        self.chunks = []
+        self._first_line = None
+        self._loaded = False
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path) as f:
+            header = f.readline()
+            prefix = self.header('')[:-1]
+            if not header.startswith(prefix) or not header.endswith('\n'):
+                return
+            self._first_line = header[len(prefix):-1]
+            for line in f:
+                if line.endswith('\n'):  # Ignore a partially written final entry.
+                    self.chunks.append(LogChunk.parse(line, self.bloom_bits, self.bloom_hashes))
+        self._loaded = True
+
+    def reset(self, first_line=None):
+        """Start a new, empty index of the log."""
+        self.chunks = []
+        self._first_line = first_line if first_line is not None else self.log_first_line()
+        with open(self.index_path, 'w') as f:
+            f.write(self.header(self._first_line))
+        self._loaded = True
+
+    def update(self):
+        """Index any complete chunks appended to the log since the last update.
+
+        The final, still growing chunk is left unindexed until it is complete
+        (its span exceeds the interval or it reaches max_lines) so the stored
+        index never needs rewriting. Returns the number of new chunks.
+        """
+        first_line = self.log_first_line()
+        if (not self._loaded or not os.path.exists(self.index_path) or first_line != self._first_line or
+                os.path.getsize(self.log_path) < self.indexed_offset):
+            # A new or incompatible index, or the log has been truncated or rotated
+            self.reset(first_line)
+
+        new_chunks = []
+        offset = self.indexed_offset
+        with open(self.log_path, 'rb') as log:
+            log.seek(offset)
+            chunk_start = offset
+            n_lines = 0
+            min_ts = max_ts = None
+            icaos = set()
+            for line in log:
+                if not line.endswith(b'\n'):
+                    break  # The receiver is part way through writing this line.
+                fields = split_line(line)
+                if fields is not None:
+                    timestamp, icao = fields
+                    if min_ts is not None and (max(max_ts, timestamp) - min(min_ts, timestamp) > self.interval or
+                                               n_lines >= self.max_lines):
+                        new_chunks.append(self._make_chunk(chunk_start, offset, n_lines, min_ts, max_ts, icaos))
+                        chunk_start = offset
+                        n_lines = 0
+                        min_ts = max_ts = None
+                        icaos = set()
+                    min_ts = timestamp if min_ts is None else min(min_ts, timestamp)
+                    max_ts = timestamp if max_ts is None else max(max_ts, timestamp)
+                    icaos.add(icao)
+                    n_lines += 1
+                offset += len(line)
+
+        if new_chunks:
+            with open(self.index_path, 'a') as f:
+                f.writelines(chunk.format() for chunk in new_chunks)
+            self.chunks.extend(new_chunks)
+        return len(new_chunks)
+
+    def _make_chunk(self, start, end, n_lines, min_ts, max_ts, icaos):
+        bloom = IcaoBloomFilter(self.bloom_bits, self.bloom_hashes)
+        bloom.update(icaos)
+        return LogChunk(start, end - start, n_lines, min_ts, max_ts, bloom)
+
+    def find_chunks(self, icao=None, start=None, end=None):
+        """Return the indexed chunks which may hold replies matching the query."""
+        return [c for c in self.chunks
+                if c.overlaps(start, end) and (icao is None or c.may_contain(icao))]
+
+    def lines(self, icao=None, start=None, end=None):
+        """Yield the raw log lines matching the query, in log order.
+
+        icao is an integer address; start and end are inclusive timestamp bounds
+        in samples. Lines appended after the last indexed chunk are scanned too,
+        so results are current even when the tail has not been indexed yet.
+        """
+        spans = [(c.offset, c.length) for c in self.find_chunks(icao, start, end)]
+        spans.append((self.indexed_offset, None))
+        with open(self.log_path, 'rb') as log:
+            for offset, length in spans:
+                log.seek(offset)
+                data = log.read() if length is None else log.read(length)
+                for line in data.splitlines(True):
+                    if not line.endswith(b'\n'):
+                        continue
+                    fields = split_line(line)
+                    if fields is None:
+                        continue
+                    timestamp, line_icao = fields
+                    if icao is not None and line_icao != icao:
+                        continue
+                    if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+                        continue
+                    yield line.decode('ascii')
+
+    def replies(self, icao=None, start=None, end=None):
+        """Yield a ModeSReply for each log line matching the query."""
+        for line in self.lines(icao, start, end):
+            yield ModeSReply.from_message(line)
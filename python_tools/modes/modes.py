@@ -1,6 +1,12 @@
 import re
 import bitstring
 import adsblib
+from .crc import check
+from .downlink_fields import decode_ac13, decode_id13
+
+
+# Reply timestamps are counted in receiver samples (receiver.c MODE_S_RATE).
+SAMPLE_RATE = 2000000
 
 
 class DownlinkFormat(object):
@@ -80,6 +86,7 @@ class ModeSReply(object):
     icao = None
     data = None
     message = None
+    signal = None  # Signal level (dBFS) if the source gives one
 
     def __init__(self, timestamp=None, icao=None, data=None):
         self.timestamp = timestamp
@@ -89,7 +96,7 @@ class ModeSReply(object):
         dlf = DownlinkFormat()
         link_format = dlf.get_format(self.format)
         if link_format[-1] == ('ME', '56'):
-            self.message = adsblib.Message(self.data[-56:].uint)
+            self.message = adsblib.decode(self.data[-56:].uint)
         else:
             self.message = None
 
@@ -105,6 +112,21 @@ class ModeSReply(object):
             data=data
         )
 
+    @classmethod
+    def from_frame(cls, frame, timestamp=None, known=()):
+        """A reply from a full frame, 7 or 14 bytes with the parity field, or None if it fails its parity check.
+
+        The address of an AP reply is only trusted if it's in known, e.g. an aircraft.AircraftRegistry (see crc.check).
+        """
+        address = check(frame, known)
+        if address is None:
+            return None
+        return cls(
+            timestamp=timestamp,
+            icao=bitstring.Bits(uint=address, length=24),
+            data=bitstring.Bits(bytes=bytes(frame[:-3]))
+        )
+
     @staticmethod
     def unpack(message):
         msg_format = re.compile('^(.*): (.*), (.*);$')
@@ -134,6 +156,20 @@ class ModeSReply(object):
         fmt = self.data[0:5]
         return 24 if fmt[0:2].all(1) else fmt.uint
 
+    @property
+    def altitude(self):
+        """Altitude in feet from the AC field of DF0/4/16/20 replies (None if unavailable or not present)."""
+        if self.format in (0, 4, 16, 20):
+            return decode_ac13(self.data[19:32].uint)
+        return None
+
+    @property
+    def squawk(self):
+        """Mode A code from the ID field of DF5/21 replies, e.g. 7700 (None if not present)."""
+        if self.format in (5, 21):
+            return decode_id13(self.data[19:32].uint)
+        return None
+
     def decode(self, print_format=False):
         dlf = DownlinkFormat()
         link_format = dlf.get_format(self.format)
@@ -0,0 +1,155 @@
+"""
+In-process publish/subscribe fan-out of decoded replies.
+
+A Pipeline decodes each receiver line once and publishes the resulting
+ModeSReply (and its ADS-B message) to every subscriber whose filter matches.
+The reply objects are shared between subscribers, which must treat them as
+read only.
+
+Each subscriber has its own bounded queue and handler thread, so a slow
+subscriber only affects itself. What happens when its queue is full is set
+by its policy:
+
+    DROP_NEWEST - the new reply is dropped (the default for live input)
+    DROP_OLDEST - the oldest queued reply is dropped to make room
+    BLOCK       - the publisher waits (for offline input which must not lose replies)
+
+Dropped replies are counted per subscriber.
+"""
+
+import queue
+import threading
+
+from .modes import ModeSReply
+
+
+DROP_NEWEST = 'drop-newest'
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+
+
+class Subscription(object):
+    """A subscriber: handler is called with each matching reply from the subscription's own thread.
+
+    formats is a collection of downlink formats and types a collection of
+    ADS-B type codes to accept; None accepts any. Giving types only accepts
+    replies carrying an ADS-B message.
+    """
+
+    def __init__(self, handler, formats=None, types=None, maxsize=10000, policy=DROP_NEWEST, name=None):
+        if policy not in (DROP_NEWEST, DROP_OLDEST, BLOCK):
+            raise ValueError('Unknown drop policy {0!r}.'.format(policy))
+        self.handler = handler
+        self.formats = frozenset(formats) if formats is not None else None
+        self.types = frozenset(types) if types is not None else None
+        self.policy = policy
+        self.name = name or getattr(handler, '__name__', repr(handler))
+        self.delivered = 0
+        self.dropped = 0
+        self.errors = 0
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run, name=self.name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def matches(self, reply):
+        if self.formats is not None and reply.format not in self.formats:
+            return False
+        if self.types is not None and (reply.message is None or reply.message.type not in self.types):
+            return False
+        return True
+
+    def offer(self, reply):
+        """Queue a reply according to the drop policy. Returns False if a reply was dropped."""
+        if self.policy == BLOCK:
+            self._queue.put(reply)
+            return True
+        try:
+            self._queue.put_nowait(reply)
+            return True
+        except queue.Full:
+            pass
+        self.dropped += 1
+        if self.policy == DROP_OLDEST:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(reply)
+            except queue.Full:
+                pass  # The queue filled again in the meantime, so count the new reply as dropped.
+        return False
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Handle everything queued and stop the thread."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            reply = self._queue.get()
+            if reply is None:
+                return
+            try:
+                self.handler(reply)
+                self.delivered += 1
+            except Exception:
+                # A failing subscriber mustn't take the others down with it.
+                self.errors += 1
+
+
+class Pipeline(object):
+    """Decode receiver lines once and publish the replies to the subscribers."""
+
+    def __init__(self):
+        self.subscriptions = []
+        self.published = 0
+        self.failed = 0
+
+    def subscribe(self, handler, formats=None, types=None, maxsize=10000, policy=DROP_NEWEST, name=None):
+        """Add a subscriber (see Subscription). Returns the Subscription."""
+        subscription = Subscription(handler, formats, types, maxsize, policy, name)
+        self.subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscriptions.remove(subscription)
+        subscription.close()
+
+    def publish(self, reply):
+        for subscription in self.subscriptions:
+            if subscription.matches(reply):
+                subscription.offer(reply)
+        self.published += 1
+
+    def feed(self, lines):
+        """Decode and publish receiver lines, skipping any that can't be decoded."""
+        for line in lines:
+            try:
+                reply = ModeSReply.from_message(line)
+            except Exception:
+                self.failed += 1
+                continue
+            self.publish(reply)
+
+    def feed_replies(self, replies):
+        """Publish replies which are already decoded, e.g. from a parser or TcpSource in sources.py."""
+        for reply in replies:
+            self.publish(reply)
+
+    def close(self):
+        """Let every subscriber handle what it has queued and stop them."""
+        for subscription in self.subscriptions:
+            subscription.close()
+
+    def report(self):
+        lines = ['{0} replies published, {1} lines failed to decode'.format(self.published, self.failed)]
+        for subscription in self.subscriptions:
+            lines.append('  {0}: {1} handled, {2} dropped, {3} errors'.format(
+                subscription.name, subscription.delivered, subscription.dropped, subscription.errors))
+        return '\n'.join(lines)
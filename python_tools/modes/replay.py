@@ -0,0 +1,199 @@
+"""
+Time-scaled replay of receiver logs.
+
+Replies are released at the rate given by their sample-based timestamps,
+scaled by a speed factor (or as fast as possible), and fanned out over one or
+more simulated receiver connections. Each connection has a bounded queue
+drained by its own writer thread so a slow consumer shows up as drops and lag
+rather than holding up the schedule. A connection whose write fails (the peer
+went away) drops everything after that.
+
+Timestamps restart from zero whenever the receiver is restarted so a jump
+backwards in time re-anchors the schedule instead of stalling it.
+"""
+
+import queue
+import threading
+import time
+
+from .modes import SAMPLE_RATE
+
+
+def line_timestamp(line):
+    """The timestamp (in samples) of a receiver log line or None if the line isn't a reply."""
+    text, sep, _ = line.partition(': ')
+    if not sep:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def line_icao(line):
+    _, _, rest = line.partition(': 0x')
+    return rest[:6]
+
+
+class Connection(object):
+    """A simulated receiver connection: a bounded queue of lines drained by a writer thread.
+
+    write is called with batches of lines joined into a single string. If it raises an OSError the error is kept in
+    error, the lines it was given and those still queued are counted in failed, and later lines are dropped.
+    """
+
+    def __init__(self, write, maxsize=10000, batch=256):
+        self.write = write
+        self.batch = batch
+        self.sent = 0
+        self.dropped = 0  # Only counted by offer()
+        self.failed = 0  # Only counted by the writer thread
+        self.error = None
+        self._queue = queue.Queue(maxsize)
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def offer(self, line):
+        """Queue a line without blocking. Returns False if it had to be dropped."""
+        if self.error is not None:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Flush the queued lines and stop the writer thread."""
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass  # The writer is still draining the queue, unless it has died.
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            try:
+                while len(lines) < self.batch:
+                    lines.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            done = lines[-1] is None
+            if done:
+                lines.pop()
+            if lines and self.error is None:
+                try:
+                    self.write(''.join(lines))
+                    self.sent += len(lines)
+                except OSError as error:
+                    self.error = error
+            if self.error is not None:
+                self.failed += len(lines)  # Keep draining so that close() isn't held up.
+            if done:
+                return
+
+
+class ReplayStats(object):
+    """Throughput, lag and drop statistics for a replay."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.offered = 0
+        self.dropped = 0
+        self.max_lag = 0.0
+        self.total_lag = 0.0
+        self.rebases = 0
+
+    def record(self, lag, delivered):
+        self.offered += 1
+        if not delivered:
+            self.dropped += 1
+        if lag > 0.0:
+            self.total_lag += lag
+            self.max_lag = max(self.max_lag, lag)
+
+    @property
+    def elapsed(self):
+        return time.time() - self.start
+
+    @property
+    def rate(self):
+        """Messages per second offered to the connections."""
+        elapsed = self.elapsed
+        return self.offered / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def mean_lag(self):
+        return self.total_lag / self.offered if self.offered else 0.0
+
+    def report(self):
+        return ('{0} msgs in {1:.1f}s ({2:.0f} msgs/s), {3} dropped, lag mean {4:.4f}s max {5:.4f}s'.format(
+            self.offered, self.elapsed, self.rate, self.dropped, self.mean_lag, self.max_lag))
+
+
+class Replayer(object):
+    """Replay receiver log lines into connections at speed times real time.
+
+    A speed of 0 (or None) replays as fast as possible. Lines are assigned to
+    connections by ICAO address so each aircraft's replies stay in order.
+    """
+
+    # Only sleep when at least this far ahead of schedule (seconds)
+    MIN_SLEEP = 0.001
+
+    def __init__(self, connections, speed=1.0):
+        self.connections = connections
+        self.speed = speed
+        self.stats = ReplayStats()
+
+    def run(self, lines, stats_interval=None, report=None):
+        """Replay lines. report is called with the stats every stats_interval seconds."""
+        stats = self.stats
+        n_connections = len(self.connections)
+        base_ts = base_wall = last_ts = None
+        next_report = time.time() + stats_interval if stats_interval else None
+
+        for line in lines:
+            ts = line_timestamp(line)
+            if ts is None:
+                continue
+
+            lag = 0.0
+            if self.speed:
+                now = time.time()
+                if base_ts is None or ts < last_ts:
+                    if base_ts is not None:
+                        stats.rebases += 1
+                    base_ts, base_wall = ts, now
+                due = base_wall + (ts - base_ts) / SAMPLE_RATE / self.speed
+                if due - now > self.MIN_SLEEP:
+                    time.sleep(due - now)
+                else:
+                    lag = now - due
+            last_ts = ts
+
+            if n_connections == 1:
+                connection = self.connections[0]
+            else:
+                connection = self.connections[hash(line_icao(line)) % n_connections]
+            stats.record(lag, connection.offer(line))
+
+            if next_report is not None and time.time() >= next_report:
+                report(stats)
+                next_report += stats_interval
+
+        return stats
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
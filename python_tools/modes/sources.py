@@ -0,0 +1,352 @@
+"""
+Parsers and network sources for the output formats of other Mode S receivers.
+
+Three formats are understood:
+
+    beast - the binary Beast protocol. Each frame is 0x1a, a type byte ('1'
+            Mode A/C, '2' short and '3' long Mode S), a 6 byte 12 MHz
+            timestamp, a signal level byte and the reply, with any 0x1a in the
+            rest of the frame doubled.
+    avr   - one reply per line in hex, '*8d4840d6...;', or with a 12 MHz
+            timestamp, '@0000a1b2c3d48d4840d6...;'.
+    sbs   - the BaseStation CSV records, 'MSG,3,1,1,4840D6,1,...'. These are
+            already decoded, so they give SbsRecords rather than replies.
+
+A parser is fed the data as it arrives, in blocks of any size, and returns the
+records completed by each block. Beast data is de-escaped and framed a block at
+a time by splitting it on 0x1a (a doubled 0x1a gives an empty piece, which
+joins its neighbours back together) rather than byte by byte, and the parity of
+the replies in a block is checked as a batch (see crc.check_batch).
+
+Beast and AVR replies become ModeSReplys like those from the receiver's log,
+with their timestamps converted to receiver samples (SAMPLE_RATE) and the
+Beast signal level in dBFS as reply.signal. DF11/17/18 replies must pass their
+parity check. AP replies are accepted if their address is in known, e.g. an
+aircraft.AircraftRegistry, so that only replies from aircraft heard in a
+DF11/17/18 reply are accepted as the receiver does. If known is None, every AP
+reply is accepted, which is right for decoders (such as dump1090) that only
+forward AP replies they have checked themselves.
+"""
+
+import calendar
+import math
+import socket
+import threading
+
+import bitstring
+
+from .crc import check_batch
+from .modes import ModeSReply, SAMPLE_RATE
+
+
+# The Beast and AVR timestamps count a 12 MHz clock.
+TIMESTAMP_RATE = 12000000
+BEAST_ESCAPE = b'\x1a'
+# Reply bytes for each Beast frame type
+BEAST_TYPES = {0x31: 2, 0x32: 7, 0x33: 14}
+BEAST_TYPES_BY_LENGTH = {length: frame_type for frame_type, length in BEAST_TYPES.items()}
+BEAST_MODE_AC = 0x31
+BEAST_HEADER = 8  # Type, timestamp and signal level
+BLOCK_SIZE = 64 * 1024
+
+
+class _AnyAddress(object):
+
+    def __contains__(self, address):
+        return True
+
+
+def _replies(frames, timestamps, signals, known):
+    """ModeSReplys from lists of frames (bytes) and their timestamps (12 MHz ticks or None) and signal levels.
+
+    Returns (replies, number rejected).
+    """
+    if known is None:
+        known = _AnyAddress()
+    replies = []
+    by_length = {}
+    for i, frame in enumerate(frames):
+        by_length.setdefault(len(frame), []).append(i)
+    for indexes in by_length.values():
+        batch = [frames[i] for i in indexes]
+        for i, address in zip(indexes, check_batch(batch, known).tolist()):
+            if address < 0:
+                continue
+            ticks = timestamps[i]
+            reply = ModeSReply(
+                timestamp=ticks * SAMPLE_RATE / float(TIMESTAMP_RATE) if ticks is not None else None,
+                icao=bitstring.Bits(uint=address, length=24),
+                data=bitstring.Bits(bytes=frames[i][:-3])
+            )
+            reply.signal = signals[i]
+            replies.append((i, reply))
+    replies.sort(key=lambda item: item[0])  # Back into the order they arrived
+    return [reply for _, reply in replies], len(frames) - len(replies)
+
+
+def signal_level(byte):
+    """The signal level in dBFS from a Beast signal level byte, or None for 0."""
+    return 20.0 * math.log10(byte / 255.0) if byte else None
+
+
+def beast_frame(frame, timestamp=0, signal=0):
+    """A Beast frame for a reply (7 or 14 bytes) with a 12 MHz timestamp and a signal level byte."""
+    body = bytes([BEAST_TYPES_BY_LENGTH[len(frame)]]) + timestamp.to_bytes(6, 'big') + bytes([signal]) + bytes(frame)
+    return BEAST_ESCAPE + body.replace(BEAST_ESCAPE, BEAST_ESCAPE + BEAST_ESCAPE)
+
+
+class BeastParser(object):
+    """Parse Beast binary data into ModeSReplys."""
+
+    def __init__(self, known=None):
+        self.known = known
+        self.replies = 0
+        self.rejected = 0  # Replies which failed their parity check
+        self.mode_ac = 0  # Mode A/C replies, which are skipped
+        self.malformed = 0  # Frames of an unknown type or the wrong length
+        self._pending = b''
+
+    def feed(self, data):
+        """Parse a block of data. Returns the replies in the frames it completes."""
+        pieces = (self._pending + data).split(BEAST_ESCAPE)
+        self._pending = b''
+        frames, timestamps, signals = [], [], []
+        n = len(pieces)
+        i = 1  # pieces[0] is whatever came before the first frame.
+        while i < n:
+            start = i
+            frame = pieces[i]
+            i += 1
+            while i < n and not pieces[i]:
+                if i + 1 == n:
+                    break  # A 0x1a at the end might be escaping the next byte.
+                frame += BEAST_ESCAPE + pieces[i + 1]
+                i += 2
+            length = BEAST_TYPES.get(frame[0]) if frame else None
+            if (i == n or not pieces[i]) and (not frame or length is not None and len(frame) < BEAST_HEADER + length):
+                # The frame runs to the end of the data, so the rest of it is still to come.
+                self._pending = BEAST_ESCAPE + BEAST_ESCAPE.join(pieces[start:])
+                break
+            if length is None or len(frame) != BEAST_HEADER + length:
+                self.malformed += 1
+                continue
+            if frame[0] == BEAST_MODE_AC:
+                self.mode_ac += 1
+                continue
+            frames.append(frame[BEAST_HEADER:])
+            timestamps.append(int.from_bytes(frame[1:7], 'big'))
+            signals.append(signal_level(frame[7]))
+        replies, rejected = _replies(frames, timestamps, signals, self.known)
+        self.replies += len(replies)
+        self.rejected += rejected
+        return replies
+
+
+class AvrParser(object):
+    """Parse AVR lines into ModeSReplys."""
+
+    def __init__(self, known=None):
+        self.known = known
+        self.replies = 0
+        self.rejected = 0  # Replies which failed their parity check
+        self.malformed = 0  # Lines which aren't a reply in hex
+        self._pending = b''
+
+    def feed(self, data):
+        """Parse a block of data. Returns the replies on the lines it completes."""
+        lines = (self._pending + data).split(b'\n')
+        self._pending = lines.pop()
+        frames, timestamps = [], []
+        for line in lines:
+            line = line.strip().rstrip(b';')
+            if not line:
+                continue
+            try:
+                if line[:1] == b'*':
+                    frame, ticks = bytes.fromhex(line[1:].decode('ascii')), None
+                elif line[:1] == b'@':
+                    frame, ticks = bytes.fromhex(line[13:].decode('ascii')), int(line[1:13], 16)
+                else:
+                    raise ValueError('Not an AVR line')
+            except ValueError:
+                self.malformed += 1
+                continue
+            if len(frame) not in (7, 14):
+                self.malformed += 1
+                continue
+            frames.append(frame)
+            timestamps.append(ticks)
+        replies, rejected = _replies(frames, timestamps, [None] * len(frames), self.known)
+        self.replies += len(replies)
+        self.rejected += rejected
+        return replies
+
+
+class SbsRecord(object):
+    """A decoded BaseStation record.
+
+    time is in seconds since the epoch (from the date and time the record was
+    generated, taken as UTC) and parameters holds the fields it gives, named as
+    in the aircraft parameters where they have an equivalent. format and message
+    are None so that records can go through a pipeline.Pipeline with replies.
+    """
+
+    format = None
+    message = None
+
+    def __init__(self, time, icao, transmission_type, parameters):
+        self.time = time
+        self.icao = icao
+        self.transmission_type = transmission_type
+        self.parameters = parameters
+
+
+def squawk(text):
+    """A Mode A code kept as its four octal digits, e.g. '0123', since as an int the leading zeros are lost."""
+    if len(text) != 4 or any(digit not in '01234567' for digit in text):
+        raise ValueError('{0!r} is not a Mode A code.'.format(text))
+    return text
+
+
+# The BaseStation fields after the date and time fields, and how to convert them
+SBS_FIELDS = (
+    (10, 'Identification', str),
+    (11, 'Altitude (ft)', int),
+    (12, 'Ground Speed (kt)', float),
+    (13, 'Track', float),
+    (14, 'Latitude', float),
+    (15, 'Longitude', float),
+    (16, 'Vertical Rate (ft/min)', int),
+    (17, 'Squawk', squawk),
+    (21, 'On Ground', lambda text: text not in ('0', '')),
+)
+
+
+def sbs_time(date, time_of_day):
+    """Seconds since the epoch from a BaseStation date and time, '2013/10/08' and '12:00:00.000'."""
+    year, month, day = date.split('/')
+    hours, minutes, seconds = time_of_day.split(':')
+    return calendar.timegm((int(year), int(month), int(day), int(hours), int(minutes), 0)) + float(seconds)
+
+
+class SbsParser(object):
+    """Parse BaseStation CSV lines into SbsRecords. Only the MSG lines are kept."""
+
+    def __init__(self, known=None):  # known is only for the same signature as the other parsers.
+        self.records = 0
+        self.malformed = 0
+        self._pending = b''
+
+    def feed(self, data):
+        """Parse a block of data. Returns the records on the lines it completes."""
+        lines = (self._pending + data).split(b'\n')
+        self._pending = lines.pop()
+        records = []
+        for line in lines:
+            fields = line.decode('ascii', 'replace').strip().split(',')
+            if fields[0] != 'MSG':
+                continue
+            try:
+                parameters = {}
+                for index, name, convert in SBS_FIELDS:
+                    if index < len(fields) and fields[index].strip():
+                        parameters[name] = convert(fields[index].strip())
+                records.append(SbsRecord(sbs_time(fields[6], fields[7]), bitstring.Bits(hex=fields[4]),
+                                         int(fields[1]), parameters))
+            except (ValueError, IndexError, bitstring.CreationError):
+                self.malformed += 1
+        self.records += len(records)
+        return records
+
+
+PARSERS = {'beast': BeastParser, 'avr': AvrParser, 'sbs': SbsParser}
+
+
+def parser(name, known=None):
+    """A new parser for the format called name: 'beast', 'avr' or 'sbs'."""
+    try:
+        return PARSERS[name](known)
+    except KeyError:
+        raise ValueError('Unknown input format {0!r}.'.format(name))
+
+
+def read_stream(stream, parser, block_size=BLOCK_SIZE):
+    """Yield the records parsed from a binary file object as its data arrives."""
+    read = getattr(stream, 'read1', stream.read)
+    while True:
+        data = read(block_size)
+        if not data:
+            return
+        for record in parser.feed(data):
+            yield record
+
+
+class TcpSource(object):
+    """The records parsed from a TCP connection to host:port, e.g. port 30005 of dump1090 for Beast data.
+
+    Iterating over a TcpSource yields the records until the connection is closed.
+    """
+
+    def __init__(self, host, port, parser, block_size=BLOCK_SIZE, timeout=10.0):
+        self.parser = parser
+        self.block_size = block_size
+        self._socket = socket.create_connection((host, port), timeout)
+        self._socket.settimeout(None)
+        self.bytes_received = 0
+
+    def __iter__(self):
+        while True:
+            data = self._socket.recv(self.block_size)
+            if not data:
+                return
+            self.bytes_received += len(data)
+            for record in self.parser.feed(data):
+                yield record
+
+    def close(self):
+        self._socket.close()
+
+
+class Feeder(object):
+    """A stand-in for a receiver's TCP output: each client that connects is sent data, a captured stream.
+
+    The data is sent in chunks of chunk_size bytes so that the clients see it split at arbitrary points. The
+    connection is closed once it has all been sent.
+    """
+
+    def __init__(self, data, host='127.0.0.1', port=0, chunk_size=4096):
+        self.data = data
+        self.chunk_size = chunk_size
+        self.connections = 0
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(5)
+        self.host, self.port = self._server.getsockname()
+        self._thread = threading.Thread(target=self._run, name='feeder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        try:
+            self._server.shutdown(socket.SHUT_RDWR)  # Wakes the accept()
+        except OSError:
+            pass
+        self._server.close()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:
+                return  # Closed
+            self.connections += 1
+            try:
+                with connection:
+                    # Every send is a separate segment, so each chunk arrives on its own (Nagle would merge them).
+                    connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    for offset in range(0, len(self.data), self.chunk_size):
+                        connection.sendall(self.data[offset:offset + self.chunk_size])
+            except OSError:
+                pass  # The client went away.
@@ -0,0 +1,101 @@
+import unittest
+from bitstring import Bits
+import adsblib
+from aircraft import Aircraft, AircraftRegistry
+from modes import ModeSReply, SAMPLE_RATE
+from modes.sources import SbsParser
+
+
+def position_reply(icao, lat, lon, alt, odd, t):
+    me = adsblib.encode_apos(lat, lon, alt, odd)
+    return ModeSReply(timestamp=t * SAMPLE_RATE, icao=Bits(uint=icao, length=24),
+                      data=Bits(uint=(0x8d << 80) | (icao << 56) | me, length=88))
+
+
+SBS = (b'MSG,1,1,1,4840D6,1,2013/10/08,12:00:00.000,2013/10/08,12:00:00.000,KLM1023,,,,,,,,,,,\n'
+       b'MSG,3,1,1,4840D6,1,2013/10/08,12:00:01.000,2013/10/08,12:00:01.000,,38000,,,52.25720,3.91940,,,,,,0\n'
+       b'MSG,3,1,1,4840D6,1,2013/10/08,12:00:02.000,2013/10/08,12:00:02.000,,38000,,,52.25720,3.91940,,,,,,0\n'
+       b'MSG,3,1,1,4840D6,1,2013/10/08,12:00:03.000,2013/10/08,12:00:03.000,,38025,,,52.25800,3.92000,,,,,,0\n')
+
+
+class Listener(object):
+
+    def __init__(self):
+        self.updates = []
+        self.removed = []
+
+    def aircraft_updated(self, aircraft, changed):
+        self.updates.append((aircraft.icao, changed))
+
+    def aircraft_removed(self, aircraft):
+        self.removed.append(aircraft.icao)
+
+
+class TestAircraft(unittest.TestCase):
+
+    def test_position_needs_an_even_odd_pair(self):
+        aircraft = Aircraft(0x4840d6)
+        aircraft.push_modes_reply(position_reply(0x4840d6, 52.2572, 3.9194, 38000, False, 0.0))
+        self.assertIsNone(aircraft.position)
+        changed = aircraft.push_modes_reply(position_reply(0x4840d6, 52.2580, 3.9200, 38000, True, 1.0))
+        self.assertIn('Latitude', changed)
+        self.assertAlmostEqual(52.2580, aircraft.position[0], 3)
+        self.assertAlmostEqual(3.9200, aircraft.position[1], 3)
+        self.assertEqual(38000, aircraft.parameters['Altitude (ft)'])
+        self.assertEqual([(1.0,) + aircraft.position + (38000,)], list(aircraft.track))
+
+    def test_stale_pair_falls_back_to_local_decoding(self):
+        aircraft = Aircraft(0x4840d6)
+        aircraft.push_modes_reply(position_reply(0x4840d6, 52.0, 4.0, 38000, False, 0.0))
+        aircraft.push_modes_reply(position_reply(0x4840d6, 52.0, 4.0, 38000, True, 1.0))
+        # Too long after the last odd message for a global decode, so it's decoded relative to the last position.
+        aircraft.push_modes_reply(position_reply(0x4840d6, 52.5, 4.5, 38000, False, 60.0))
+        self.assertAlmostEqual(52.5, aircraft.position[0], 3)
+        self.assertAlmostEqual(4.5, aircraft.position[1], 3)
+        self.assertEqual(2, len(aircraft.track))
+
+    def test_sbs_records(self):
+        aircraft = Aircraft(0x4840d6)
+        changes = [aircraft.push_sbs_record(record) for record in SbsParser().feed(SBS)]
+        self.assertEqual([['Identification'], ['Altitude (ft)', 'Latitude', 'Longitude', 'On Ground'], [],
+                          ['Altitude (ft)', 'Latitude', 'Longitude']], changes)
+        self.assertEqual((52.258, 3.92), aircraft.position)
+        self.assertEqual(1381233603.0, aircraft.replytime)
+        self.assertEqual(aircraft.replytime, aircraft.position_time)
+        self.assertIsNone(aircraft.message)
+        self.assertEqual([(1381233601.0, 52.2572, 3.9194, 38000), (1381233603.0, 52.258, 3.92, 38025)],
+                         list(aircraft.track))
+
+    def test_reply_from_another_aircraft_is_rejected(self):
+        self.assertRaises(ValueError, Aircraft(0x123456).push_modes_reply,
+                          position_reply(0x4840d6, 52.0, 4.0, 38000, False, 0.0))
+
+
+class TestAircraftRegistry(unittest.TestCase):
+
+    def test_listeners_and_expiry(self):
+        registry = AircraftRegistry()
+        listener = Listener()
+        registry.add_listener(listener)
+        registry.push_modes_reply(position_reply(0x4840d6, 52.0, 4.0, 38000, False, 0.0))
+        registry.push_modes_reply(position_reply(0x40621d, 51.0, 0.0, 10000, False, 0.0))
+        self.assertEqual(2, len(registry))
+        self.assertIn(0x4840d6, registry)
+        self.assertIn(Bits(uint=0x4840d6, length=24), registry)
+        self.assertEqual([0x4840d6, 0x40621d], [icao for icao, _ in listener.updates])
+
+        registry[0x4840d6]._lastupdate = 0.0
+        self.assertEqual([0x4840d6], [inst.icao for inst in registry.expire(60.0)])
+        self.assertEqual([0x4840d6], listener.removed)
+        self.assertNotIn(0x4840d6, registry)
+        self.assertIsNone(registry.get(0x4840d6))
+
+    def test_push_takes_replies_and_sbs_records(self):
+        registry = AircraftRegistry()
+        listener = Listener()
+        registry.add_listener(listener)
+        for record in SbsParser().feed(SBS):
+            registry.push(record)
+        registry.push(position_reply(0x40621d, 51.0, 0.0, 10000, False, 0.0))
+        self.assertEqual('KLM1023', registry[0x4840d6].parameters['Identification'])
+        self.assertEqual([0x4840d6] * 4 + [0x40621d], [icao for icao, _ in listener.updates])
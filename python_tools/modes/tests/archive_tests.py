@@ -0,0 +1,173 @@
+import calendar
+import math
+import random
+import shutil
+import tempfile
+import time
+import unittest
+from bitstring import Bits
+import adsblib
+import archive
+from aircraft import AircraftRegistry
+from modes import ModeSReply, SAMPLE_RATE
+
+
+DAY = calendar.timegm((2013, 10, 8, 0, 0, 0))
+
+
+def interpolate(points, t):
+    """The position at time t on a track interpolated linearly between its points."""
+    for (t0, lat0, lon0, alt0), (t1, lat1, lon1, alt1) in zip(points, points[1:]):
+        if t0 <= t <= t1:
+            f = (t - t0) / (t1 - t0) if t1 > t0 else 0.0
+            return lat0 + f * (lat1 - lat0), lon0 + f * (lon1 - lon0), alt0 + f * (alt1 - alt0)
+    raise ValueError('{0} is outside the track'.format(t))
+
+
+def flight(start, n, lat=51.0, lon=0.0, alt=20000, seed=1):
+    """n points a second apart of an aircraft turning and climbing now and then, with a little noise."""
+    rng = random.Random(seed)
+    points = []
+    heading, climb = 0.0, 0.0
+    for i in range(n):
+        if i % 60 == 0:
+            heading, climb = rng.uniform(0, 2 * math.pi), rng.choice((0, 0, 30, -30))
+        lat += 0.0012 * math.cos(heading) + rng.gauss(0, 5e-5)
+        lon += 0.0019 * math.sin(heading) + rng.gauss(0, 5e-5)
+        alt += climb
+        points.append((start + i, lat, lon, alt))
+    return points
+
+
+class TestCodec(unittest.TestCase):
+
+    def test_zigzag(self):
+        self.assertEqual([0, 1, 2, 3, 4], [archive.zigzag(n) for n in (0, -1, 1, -2, 2)])
+        for n in (0, 1, -1, 63, -64, 1 << 40, -(1 << 40)):
+            self.assertEqual(n, archive.unzigzag(archive.zigzag(n)))
+
+    def test_varint(self):
+        out = bytearray()
+        for n in (0, 127, 128, 300, 1 << 35):
+            archive.encode_varint(n, out)
+        self.assertEqual(b'\x00\x7f\x80\x01\xac\x02', bytes(out[:6]))
+        pos, values = 0, []
+        while pos < len(out):
+            value, pos = archive.decode_varint(out, pos)
+            values.append(value)
+        self.assertEqual([0, 127, 128, 300, 1 << 35], values)
+
+    def test_track_round_trip(self):
+        points = flight(DAY + 3600, 50) + [(DAY + 3700.5, -33.9, 151.2, None), (DAY + 3701.0, -33.9, -179.99, -1000)]
+        icao, decoded = archive.decode_track(archive.encode_track(0x4840d6, points))
+        self.assertEqual(0x4840d6, icao)
+        self.assertEqual(len(points), len(decoded))
+        for point, result in zip(points, decoded):
+            self.assertAlmostEqual(point[0], result[0], 2)
+            self.assertAlmostEqual(point[1], result[1], 5)
+            self.assertAlmostEqual(point[2], result[2], 5)
+            self.assertEqual(None if point[3] is None else round(point[3]), result[3])
+
+
+class TestTrackSimplifier(unittest.TestCase):
+
+    def test_error_is_within_tolerance(self):
+        points = flight(DAY, 2000)
+        simplifier = archive.TrackSimplifier(tolerance=50.0, altitude_tolerance=100.0)
+        for point in points:
+            simplifier.add(point)
+        kept = simplifier.finish()
+        self.assertLess(len(kept), len(points) / 5)
+        self.assertEqual(points[0], kept[0])
+        self.assertEqual(points[-1], kept[-1])
+        metres_per_degree = math.pi / 180.0 * archive.EARTH_RADIUS_M
+        for t, lat, lon, alt in points:
+            lat1, lon1, alt1 = interpolate(kept, t)
+            error = math.hypot((lat1 - lat) * metres_per_degree,
+                               (lon1 - lon) * metres_per_degree * math.cos(math.radians(lat)))
+            self.assertLess(error, 50.5)  # The flat approximation is a little off over a segment.
+            self.assertLessEqual(abs(alt1 - alt), 100.0)
+
+    def test_straight_line_keeps_its_ends(self):
+        simplifier = archive.TrackSimplifier()
+        for i in range(100):
+            simplifier.add((DAY + i, 51.0 + 0.001 * i, 0.0, 10000))
+        self.assertEqual([(DAY, 51.0, 0.0, 10000), (DAY + 99, 51.099, 0.0, 10000)],
+                         [(t, round(lat, 6), lon, alt) for t, lat, lon, alt in simplifier.finish()])
+
+
+class TestTrackArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.archive = archive.TrackArchive(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_tracks_are_split_at_midnight(self):
+        archiver = archive.TrackArchiver(self.archive)
+        for point in flight(DAY + 86400 - 100, 200):
+            archiver.add(0x4840d6, point)
+        archiver.close()
+        days = self.archive.days()
+        self.assertEqual(['2013-10-08', '2013-10-09'], [day.isoformat() for day in days])
+        first, second = [self.archive.entries(day)[0] for day in days]
+        self.assertLess(first.end, DAY + 86400)
+        self.assertGreaterEqual(second.start, DAY + 86400)
+        self.assertEqual(1, second.start - first.end)
+
+    def test_scan_filters(self):
+        archiver = archive.TrackArchiver(self.archive)
+        for icao, start in ((0x4840d6, DAY + 1000), (0x40621d, DAY + 5000), (0x4840d6, DAY + 86400 + 1000)):
+            for point in flight(start, 100):
+                archiver.add(icao, point)
+            archiver.finish(icao)
+
+        def scan(start=None, end=None, icao=None):
+            return [(icao, points[0][0] - DAY) for icao, points in self.archive.scan(start, end, icao)]
+        self.assertEqual([(0x4840d6, 1000), (0x40621d, 5000), (0x4840d6, 87400)], scan())
+        self.assertEqual([(0x40621d, 5000), (0x4840d6, 87400)], scan(start=DAY + 1100))
+        self.assertEqual([(0x4840d6, 1000), (0x40621d, 5000)], scan(end=DAY + 5000))
+        self.assertEqual([(0x4840d6, 1000), (0x4840d6, 87400)], scan(icao=0x4840d6))
+        self.assertEqual([(0x4840d6, 87400)], scan(DAY + 2000, DAY + 90000, 0x4840d6))
+        self.assertEqual([], scan(DAY + 2 * 86400))
+
+    def test_idle_tracks_are_flushed(self):
+        archiver = archive.TrackArchiver(self.archive, idle=60.0, epoch=DAY)
+        for point in flight(DAY, 100):
+            archiver.add(0x4840d6, point)
+        for point in flight(DAY + 100, 100, seed=2):
+            archiver.add(0x40621d, point)
+        self.assertEqual([0x4840d6], archiver.flush())  # Timed by the latest point, as there's an epoch
+        self.assertEqual(1, self.archive.tracks_written)
+        self.assertEqual([], archiver.flush(DAY + 150))
+        self.assertEqual([0x40621d], archiver.flush(DAY + 300))
+        self.assertEqual([0x4840d6, 0x40621d], [icao for icao, _ in self.archive.scan()])
+
+    def test_long_tracks_are_written_in_segments(self):
+        archiver = archive.TrackArchiver(self.archive, max_points=20)
+        points = flight(DAY, 3000)
+        for point in points:
+            archiver.add(0x4840d6, point)
+            self.assertLess(len(archiver._tracks[0x4840d6][1].points), 20)
+        archiver.close()
+        segments = [track for _, track in self.archive.scan()]
+        self.assertGreater(len(segments), 2)
+        for previous, segment in zip(segments, segments[1:]):
+            self.assertEqual(previous[-1], segment[0])  # Segments join up.
+        self.assertAlmostEqual(points[-1][0], segments[-1][-1][0], 2)
+
+    def test_epoch_only_applies_to_sample_timestamps(self):
+        archiver = archive.TrackArchiver(self.archive, epoch=DAY)
+        registry = AircraftRegistry()
+        registry.add_listener(archiver)
+        for n, timestamp in enumerate((0.0, 1.0, None, None)):  # Then replies from an AVR '*' line
+            me = adsblib.encode_apos(51.0 + 0.01 * n, 0.0, 10000, n % 2 == 1)
+            registry.push_modes_reply(ModeSReply(
+                timestamp=timestamp * SAMPLE_RATE if timestamp is not None else None,
+                icao=Bits(uint=0x4840d6, length=24), data=Bits(uint=(0x8d4840d6 << 56) | me, length=88)))
+        archiver.close()
+        points = [track for _, track in self.archive.scan()]
+        self.assertAlmostEqual(DAY + 1.0, points[0][0][0], 2)
+        self.assertAlmostEqual(time.time(), points[-1][-1][0], -1)
@@ -0,0 +1,133 @@
+import random
+import unittest
+
+import numpy
+
+from modes import SAMPLE_RATE
+from modes.clocksync import C, METRES_PER_FOOT, ClockSync, ReceiverClock, ecef
+
+
+RECEIVERS = {
+    'ref': (51.50, -0.50, 30.0),
+    'north': (51.90, -0.40, 80.0),
+    'east': (51.60, 0.30, 10.0),
+}
+# Start epoch (s of reference time) and clock error (ppm) of each receiver
+CLOCKS = {
+    'ref': (0.0, 0.0),
+    'north': (-1234.5, 30.0),
+    'east': (-250.25, -45.0),
+}
+
+
+def local_samples(name, t):
+    epoch, ppm = CLOCKS[name]
+    return (t - epoch) * (1.0 + ppm * 1e-6) * SAMPLE_RATE
+
+
+def reports(duration, rate, hearers, seed=1):
+    """Yield (lat, lon, alt, heard) for position reports heard by the receivers in hearers."""
+    rng = random.Random(seed)
+    for n in range(int(duration * rate)):
+        t = 100.0 + n / float(rate)
+        lat, lon, alt = rng.uniform(51.0, 52.5), rng.uniform(-1.5, 1.0), rng.uniform(1000.0, 40000.0)
+        aircraft = ecef(lat, lon, alt * METRES_PER_FOOT)
+        heard = {}
+        for name in hearers:
+            delay = numpy.linalg.norm(aircraft - ecef(*RECEIVERS[name])) / C
+            heard[name] = round(local_samples(name, t + delay) + rng.gauss(0.0, 0.2))
+        yield lat, lon, alt, heard
+
+
+class TestReceiverClock(unittest.TestCase):
+
+    def test_fits_offset_and_drift(self):
+        clock = ReceiverClock()
+        local = numpy.arange(0.0, 60.0, 0.1) * SAMPLE_RATE + 1e9
+        common = (local / SAMPLE_RATE) * (1.0 - 20e-6) + 500.0
+        for start in range(0, len(local), 50):
+            clock.update(local[start:start + 50], common[start:start + 50])
+        self.assertTrue(clock.synced)
+        numpy.testing.assert_allclose(clock.to_common(local), common, rtol=0, atol=1e-9)
+        self.assertAlmostEqual(-20e-6, clock.drift, places=9)
+
+    def test_unsynchronised_clock_cannot_convert(self):
+        with self.assertRaises(ValueError):
+            ReceiverClock().to_common(0)
+
+    def test_outliers_are_gated(self):
+        clock = ReceiverClock()
+        local = numpy.arange(0.0, 10.0, 0.1) * SAMPLE_RATE
+        clock.update(local, local / SAMPLE_RATE + 3.0)
+        local += 10 * SAMPLE_RATE
+        common = local / SAMPLE_RATE + 3.0
+        common[5] += 1e-3
+        self.assertEqual(99, clock.update(local, common))
+        self.assertAlmostEqual(3.0, clock.offset, places=9)
+
+    def test_small_step_back_is_not_a_restart(self):
+        clock = ReceiverClock()
+        local = numpy.arange(0.0, 10.0, 0.1) * SAMPLE_RATE
+        clock.update(local, local / SAMPLE_RATE + 3.0)
+        late = local[-5:] - 0.001 * SAMPLE_RATE
+        self.assertEqual(5, clock.update(late, late / SAMPLE_RATE + 3.0))
+        self.assertTrue(clock.synced)
+        self.assertEqual(105, clock.measurements)
+
+    def test_restart_resets(self):
+        clock = ReceiverClock()
+        local = numpy.arange(0.0, 10.0, 0.1) * SAMPLE_RATE + 1e8
+        clock.update(local, local / SAMPLE_RATE)
+        self.assertTrue(clock.synced)
+        clock.update(local[:10] - 1e8, local[:10] / SAMPLE_RATE)
+        self.assertFalse(clock.synced)
+        self.assertAlmostEqual(50.0, clock.offset, places=9)
+
+
+class TestClockSync(unittest.TestCase):
+
+    def test_syncs_receivers_to_reference(self):
+        sync = ClockSync(RECEIVERS, 'ref')
+        for report in reports(60, 20, ['ref', 'north', 'east']):
+            sync.observe(*report)
+        sync.flush()
+        for name in ('north', 'east'):
+            self.assertTrue(sync.synced(name))
+            t = numpy.linspace(150.0, 160.0, 11)
+            error = sync.to_common(name, local_samples(name, t)) - t
+            self.assertLess(numpy.abs(error).max(), 0.2e-6)
+
+    def test_syncs_via_an_intermediate_receiver(self):
+        sync = ClockSync(RECEIVERS, 'ref')
+        for report in reports(30, 20, ['ref', 'north'], seed=1):
+            sync.observe(*report)
+        for report in reports(30, 20, ['north', 'east'], seed=2):
+            sync.observe(*report)
+        sync.flush()
+        self.assertEqual(1, sync.clocks['north'].level)
+        self.assertEqual(2, sync.clocks['east'].level)
+        t = numpy.linspace(110.0, 120.0, 11)
+        error = sync.to_common('east', local_samples('east', t)) - t
+        self.assertLess(numpy.abs(error).max(), 0.5e-6)
+
+    def test_high_report_rate(self):
+        # At this rate the propagation delays reorder the reports across the boundaries of the blocks fitted,
+        # which mustn't be taken for restarts.
+        sync = ClockSync(RECEIVERS, 'ref')
+        for report in reports(4, 5000, ['ref', 'north', 'east']):
+            sync.observe(*report)
+        sync.flush()
+        for name in ('north', 'east'):
+            self.assertTrue(sync.synced(name))
+            self.assertGreater(sync.clocks[name].measurements, 19000)
+            t = numpy.linspace(101.0, 103.0, 11)
+            error = sync.to_common(name, local_samples(name, t)) - t
+            self.assertLess(numpy.abs(error).max(), 0.2e-6)
+
+    def test_needs_a_synchronised_receiver(self):
+        sync = ClockSync(RECEIVERS, 'ref')
+        for report in reports(30, 20, ['north', 'east']):
+            sync.observe(*report)
+        sync.flush()
+        self.assertFalse(sync.synced('north'))
+        self.assertFalse(sync.synced('east'))
@@ -0,0 +1,122 @@
+import unittest
+from modes import ModeSReply, SAMPLE_RATE, commb
+
+
+def mb_of(message):
+    """The MB field of a DF20/21 reply given in hex including the parity."""
+    return int(message[8:22], 16)
+
+
+def mb_with_bits(*bits):
+    """An MB with the given (1-based) bits set."""
+    return sum(1 << (commb.MB_LENGTH_BITS - bit) for bit in bits)
+
+
+class TestRegisterDecoders(unittest.TestCase):
+
+    def test_bds10_capabilities(self):
+        # Overlay, ACAS, subnetwork version 3, Mode S specific services, aircraft identification, squitter and GICB
+        # capabilities, SIC clear and the ACAS bits 37-40 (which aren't decoded) set
+        mb = (0x10 << 48) | mb_with_bits(15, 16, 22, 23, 25, 33, 34, 36, 37, 38, 39, 40)
+        params = commb.decode_bds10(mb)
+        self.assertEqual(3, params['Mode S Subnetwork Version'])
+        self.assertTrue(params['Overlay Command Capability'])
+        self.assertTrue(params['ACAS Operational'])
+        self.assertTrue(params['Mode S Specific Services Capability'])
+        self.assertTrue(params['Squitter Capability'])
+        self.assertFalse(params['Surveillance Identifier Capability'])
+        self.assertTrue(params['Common Usage GICB Capability Report'])
+        params = commb.decode_bds10((0x10 << 48) | mb_with_bits(35))
+        self.assertEqual((False, True, False), (params['Squitter Capability'],
+                                                params['Surveillance Identifier Capability'],
+                                                params['Common Usage GICB Capability Report']))
+
+    def test_bds20_identification(self):
+        params = commb.decode_bds20(mb_of('A000083E202CC371C31DE0AA1CCF'))
+        self.assertEqual('KLM1017 ', params['Identification'])
+
+    def test_decode_reply_ages_the_cache_by_reply_time(self):
+        decoder = commb.CommBDecoder(max_age=10.0)
+        line = '{0:017.2f}: 0x4840d6, 0xa000083e202cc371c31de0;'
+        decoder.decode_reply(ModeSReply.from_message(line.format(0)))
+        decoder.decode_reply(ModeSReply.from_message(line.format(5 * SAMPLE_RATE)))
+        self.assertEqual((1, 1), (decoder.inferences, decoder.cache_hits))
+        # 20 s later by the receiver's clock, however soon it's decoded
+        decoder.decode_reply(ModeSReply.from_message(line.format(25 * SAMPLE_RATE)))
+        self.assertEqual(2, decoder.inferences)
+
+    def test_bds40_selected_altitude(self):
+        params = commb.decode_bds40(mb_of('A000029C85E42F313000007047D3'))
+        self.assertEqual(3008, params['MCP/FCU Selected Altitude (ft)'])
+        self.assertEqual(3008, params['FMS Selected Altitude (ft)'])
+        self.assertAlmostEqual(1020.0, params['Barometric Pressure Setting (mb)'])
+
+    def test_bds50_track_and_turn(self):
+        params = commb.decode_bds50(mb_of('A000139381951536E024D4CCF6B5'))
+        self.assertAlmostEqual(2.1, params['Roll Angle'], places=1)
+        self.assertAlmostEqual(114.258, params['True Track'], places=3)
+        self.assertEqual(438, params['Ground Speed (kt)'])
+        self.assertEqual(424, params['True Airspeed (kt)'])
+
+    def test_bds60_heading_and_speed(self):
+        params = commb.decode_bds60(mb_of('A00004128F39F91A7E27C46ADC21'))
+        self.assertAlmostEqual(42.715, params['Magnetic Heading'], places=3)
+        self.assertEqual(252, params['Indicated Airspeed (kt)'])
+        self.assertAlmostEqual(0.42, params['Mach'], places=2)
+        self.assertEqual(-1920, params['Baro. Vertical Rate (ft/min)'])
+
+    def test_status_bit_clear_with_value_bits_set_is_invalid(self):
+        # Roll status clear but roll bits set
+        self.assertIsNone(commb.decode_bds50(0x01 << 48))
+
+    def test_empty_mb_matches_nothing(self):
+        self.assertEqual([], commb.infer(0))
+
+
+class TestCommBDecoder(unittest.TestCase):
+
+    def test_unambiguous_mb_is_inferred_and_cached(self):
+        decoder = commb.CommBDecoder()
+        mb = mb_of('A000139381951536E024D4CCF6B5')
+        self.assertEqual('5,0', decoder.decode(0x4840d6, mb, now=0.0)[0])
+        self.assertEqual(1, decoder.inferences)
+        self.assertEqual('5,0', decoder.decode(0x4840d6, mb, now=1.0)[0])
+        self.assertEqual(1, decoder.inferences)
+        self.assertEqual(1, decoder.cache_hits)
+
+    def test_cache_expires(self):
+        decoder = commb.CommBDecoder(max_age=10.0)
+        mb = mb_of('A000139381951536E024D4CCF6B5')
+        decoder.decode(0x4840d6, mb, now=0.0)
+        decoder.decode(0x4840d6, mb, now=100.0)
+        self.assertEqual(2, decoder.inferences)
+
+    def test_cache_is_per_aircraft(self):
+        decoder = commb.CommBDecoder()
+        mb = mb_of('A000139381951536E024D4CCF6B5')
+        decoder.decode(0x4840d6, mb, now=0.0)
+        decoder.decode(0x40621d, mb, now=0.0)
+        self.assertEqual(2, decoder.inferences)
+
+    def test_inconsistent_cached_register_falls_back_to_inference(self):
+        decoder = commb.CommBDecoder()
+        decoder.decode(0x4840d6, mb_of('A000139381951536E024D4CCF6B5'), now=0.0)
+        bds, _ = decoder.decode(0x4840d6, mb_of('A00004128F39F91A7E27C46ADC21'), now=1.0)
+        self.assertEqual('6,0', bds)
+
+    def test_decode_reply(self):
+        decoder = commb.CommBDecoder()
+        reply = ModeSReply.from_message('00000000000001.00: 0x4840d6, 0xa000083e202cc371c31de0;')
+        bds, params = decoder.decode_reply(reply, now=0.0)
+        self.assertEqual('2,0', bds)
+        self.assertEqual('KLM1017 ', params['Identification'])
+
+    def test_decode_reply_ages_the_cache_by_reply_time(self):
+        decoder = commb.CommBDecoder(max_age=10.0)
+        line = '{0:017.2f}: 0x4840d6, 0xa000083e202cc371c31de0;'
+        decoder.decode_reply(ModeSReply.from_message(line.format(0)))
+        decoder.decode_reply(ModeSReply.from_message(line.format(5 * SAMPLE_RATE)))
+        self.assertEqual((1, 1), (decoder.inferences, decoder.cache_hits))
+        # 20 s later by the receiver's clock, however soon it's decoded
+        decoder.decode_reply(ModeSReply.from_message(line.format(25 * SAMPLE_RATE)))
+        self.assertEqual(2, decoder.inferences)
@@ -0,0 +1,47 @@
+import unittest
+import cpr
+
+
+# The even/odd pair from "The 1090 Megahertz Riddle": 8d40621d58c382d690c8ac2863a7 and 8d40621d58c386435cc412692ad6
+EVEN = (93000, 51372)
+ODD = (74158, 50194)
+
+
+class TestCpr(unittest.TestCase):
+
+    def assertPosition(self, expected, position, places=3):
+        self.assertIsNotNone(position)
+        self.assertAlmostEqual(expected[0], position[0], places)
+        self.assertAlmostEqual(expected[1], position[1], places)
+
+    def test_global_decode(self):
+        self.assertPosition((52.2572, 3.91937), cpr.decode_global(EVEN, ODD, False), 4)
+        self.assertPosition((52.2658, 3.93891), cpr.decode_global(EVEN, ODD, True), 4)
+
+    def test_local_decode(self):
+        self.assertPosition((52.2572, 3.91937), cpr.decode_local(EVEN, False, 52.258, 3.918), 4)
+
+    def test_round_trip(self):
+        for lat, lon in ((0.0, 0.0), (51.5, -0.1), (-33.9, 151.2), (10.0, 179.999), (-45.3, -179.9), (86.9, -179.5),
+                         (88.0, 170.0), (-89.0, -10.0)):
+            even, odd = cpr.encode(lat, lon, False), cpr.encode(lat, lon, True)
+            self.assertPosition((lat, lon), cpr.decode_global(even, odd, False))
+            self.assertPosition((lat, lon), cpr.decode_global(even, odd, True))
+            self.assertPosition((lat, lon), cpr.decode_local(even, False, lat + 0.2, lon))
+            self.assertPosition((lat, lon), cpr.decode_local(odd, True, lat, lon - 0.2))
+
+    def test_pair_across_a_longitude_zone_boundary_is_rejected(self):
+        # The number of longitude zones drops from 59 to 58 at 10.4704 degrees.
+        self.assertEqual(59, cpr.nl(10.465))
+        self.assertEqual(58, cpr.nl(10.475))
+        self.assertIsNone(cpr.decode_global(cpr.encode(10.465, 3.0, False), cpr.encode(10.475, 3.0, True), True))
+
+    def test_local_decode_across_the_antimeridian(self):
+        # The reference is on the other side of the antimeridian, but the result is still in [-180, 180).
+        self.assertPosition((10.0, 179.999), cpr.decode_local(cpr.encode(10.0, 179.999, False), False, 10.0, -179.9))
+        self.assertPosition((10.0, -179.999), cpr.decode_local(cpr.encode(10.0, -179.999, True), True, 10.0, 179.9))
+
+    def test_zones(self):
+        self.assertEqual(59, cpr.nl(0.0))
+        self.assertEqual(2, cpr.nl(87.0))
+        self.assertEqual(1, cpr.nl(-88.0))
@@ -0,0 +1,92 @@
+import unittest
+import numpy
+from modes import crc
+from modes.downlink_fields import decode_id13, encode_id13
+
+
+class TestCrc(unittest.TestCase):
+
+    def test_extended_squitter_syndrome_is_zero(self):
+        self.assertEqual(0, crc.syndrome(0x8D40621D58C382D690C8AC2863A7, 112))
+
+    def test_damaged_reply_has_nonzero_syndrome(self):
+        self.assertNotEqual(0, crc.syndrome(0x8D40621D58C382D690C8AC2863A7 ^ (1 << 50), 112))
+
+    def test_append_parity_round_trip(self):
+        frame = crc.append_parity(0x8D40621D58C382D690C8AC, 88)
+        self.assertEqual(0x8D40621D58C382D690C8AC2863A7, frame)
+
+    def test_address_parity_syndrome_is_address(self):
+        frame = crc.append_parity(0x20001838, 32, address=0x4840d6)
+        self.assertEqual(0x4840d6, crc.syndrome(frame, 56))
+
+    def test_batch_syndromes_match_scalar(self):
+        random = numpy.random.RandomState(2)
+        bits = random.randint(0, 2, (50, 112)).astype(numpy.uint8)
+        frames = [int(''.join(str(b) for b in row), 2) for row in bits]
+        self.assertEqual([crc.syndrome(frame, 112) for frame in frames], crc.syndromes(bits).tolist())
+        self.assertEqual([crc.syndrome(frame >> 56, 56) for frame in frames], crc.syndromes(bits[:, :56]).tolist())
+
+    def test_table_parity_matches_bitwise(self):
+        random = numpy.random.RandomState(3)
+        for n_bits in (32, 88):
+            for data in random.randint(0, 1 << 31, 20):
+                data = int(data) << (n_bits - 31)
+                self.assertEqual(crc._bitwise_parity(data, n_bits), crc.parity(data, n_bits))
+
+    def test_byte_syndromes(self):
+        frame = bytes.fromhex('8D40621D58C382D690C8AC2863A7')
+        self.assertEqual(0, crc.syndrome_bytes(frame))
+        random = numpy.random.RandomState(4)
+        frames = random.randint(0, 256, (50, 14)).astype(numpy.uint8)
+        expected = [crc.syndrome_bytes(bytes(row)) for row in frames]
+        self.assertEqual(expected, crc.syndromes_bytes(frames).tolist())
+        self.assertEqual(crc.syndromes(numpy.unpackbits(frames, axis=1)).tolist(), expected)
+        self.assertEqual([crc.syndrome_bytes(bytes(row[7:])) for row in frames],
+                         crc.syndromes_bytes([bytes(row[7:]) for row in frames]).tolist())
+
+
+class TestCheck(unittest.TestCase):
+
+    EXTENDED_SQUITTER = bytes.fromhex('8D40621D58C382D690C8AC2863A7')
+    ALL_CALL = crc.append_parity(0x5d4840d6, 32).to_bytes(7, 'big')
+    ALTITUDE_REPLY = crc.append_parity(0x20001838, 32, address=0x4840d6).to_bytes(7, 'big')
+
+    def test_plain_parity(self):
+        self.assertEqual(0x40621d, crc.check(self.EXTENDED_SQUITTER))
+        self.assertEqual(0x4840d6, crc.check(self.ALL_CALL))
+        damaged = bytearray(self.EXTENDED_SQUITTER)
+        damaged[5] ^= 0x10
+        self.assertIsNone(crc.check(damaged))
+
+    def test_all_call_with_interrogator_code(self):
+        with_code = bytearray(self.ALL_CALL)
+        with_code[-1] ^= 0x25
+        self.assertEqual(0x4840d6, crc.check(with_code))
+        with_code[-1] ^= 0x80
+        self.assertIsNone(crc.check(with_code))
+
+    def test_address_parity_needs_known_aircraft(self):
+        self.assertIsNone(crc.check(self.ALTITUDE_REPLY))
+        self.assertEqual(0x4840d6, crc.check(self.ALTITUDE_REPLY, {0x4840d6}))
+        self.assertIsNone(crc.check(self.ALTITUDE_REPLY, {0x123456}))
+
+    def test_wrong_length_fails(self):
+        self.assertIsNone(crc.check(self.EXTENDED_SQUITTER[:7]))
+
+    def test_batch_matches_scalar(self):
+        damaged = bytearray(self.ALL_CALL)
+        damaged[2] ^= 1
+        frames = [self.ALL_CALL, self.ALTITUDE_REPLY, bytes(damaged), self.ALTITUDE_REPLY]
+        for known in ((), {0x4840d6}):
+            expected = [crc.check(frame, known) for frame in frames]
+            self.assertEqual([-1 if address is None else address for address in expected],
+                             crc.check_batch(frames, known).tolist())
+        self.assertEqual([0x40621d], crc.check_batch([self.EXTENDED_SQUITTER]).tolist())
+
+
+class TestEncodeId13(unittest.TestCase):
+
+    def test_round_trip(self):
+        for squawk in (0, 1200, 7500, 7700, 7777, 2471):
+            self.assertEqual(squawk, decode_id13(encode_id13(squawk)))
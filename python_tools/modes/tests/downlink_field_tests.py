@@ -1,6 +1,9 @@
 import unittest
 import bitstring
-from modes.downlink_fields import AltitudeCode
+import numpy
+from modes import ModeSReply
+from modes.downlink_fields import AltitudeCode, IdentityCode, decode_ac13, decode_ac13_array, \
+    decode_id13, decode_id13_array
 
 
 class TestAltitudeCode(unittest.TestCase):
@@ -24,3 +27,54 @@ class TestAltitudeCode(unittest.TestCase):
         ac_data = bitstring.Bits('0b0000000000000')
         ac_field = AltitudeCode(ac_data)
         self.assertFalse(ac_field.valid)
+
+    def test_altitude_in_25_foot_increments(self):
+        # Q = 1, N = 1560
+        ac_data = bitstring.Bits('0b1100000111000')
+        ac_field = AltitudeCode(ac_data)
+        self.assertTrue(ac_field.valid)
+        self.assertEqual(38000, ac_field.altitude)
+
+    def test_altitude_gillham_coded(self):
+        # C1 B1 B2 B4 set, Q = 0
+        ac_field = AltitudeCode(bitstring.Bits('0b1000000101010'))
+        self.assertTrue(ac_field.valid)
+        self.assertEqual(1300, ac_field.altitude)
+
+
+class TestIdentityCode(unittest.TestCase):
+
+    def test_emergency_squawk(self):
+        # A1 A2 A4 B1 B2 B4 set
+        id_data = bitstring.Bits('0b0101010101010')
+        self.assertEqual(7700, IdentityCode(id_data).squawk)
+        self.assertEqual('7700', str(IdentityCode(id_data)))
+
+    def test_x_bit_ignored(self):
+        self.assertEqual(decode_id13(0b0000001000000), 0)
+
+    def test_c_and_d_digits(self):
+        # C1 C2 C4 D1 D2 D4
+        self.assertEqual(77, decode_id13(0b1010100010101))
+
+
+class TestLookupTables(unittest.TestCase):
+
+    def test_array_decode_matches_scalar(self):
+        codes = numpy.arange(1 << 13)
+        altitudes = decode_ac13_array(codes)
+        squawks = decode_id13_array(codes)
+        for code in (0, 0x1838, 0b0000010000010, 0b1111111111111, 0x40):
+            expected = decode_ac13(code)
+            if expected is None:
+                self.assertTrue(numpy.isnan(altitudes[code]))
+            else:
+                self.assertEqual(expected, altitudes[code])
+            self.assertEqual(decode_id13(code), squawks[code])
+
+    def test_reply_altitude_and_squawk(self):
+        reply = ModeSReply.from_message('00000000000001.00: 0x4840d6, 0x20001838;')
+        self.assertEqual(38000, reply.altitude)
+        self.assertIsNone(reply.squawk)
+        reply = ModeSReply.from_message('00000000000001.00: 0x4840d6, 0x28000aaa;')
+        self.assertEqual(7700, reply.squawk)
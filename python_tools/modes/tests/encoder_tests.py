@@ -0,0 +1,45 @@
+import unittest
+import adsblib
+import cpr
+
+
+class TestEncoders(unittest.TestCase):
+
+    def test_ident_round_trip(self):
+        params = adsblib.decode(adsblib.encode_ident('KLM1017', category=3)).params
+        self.assertEqual('KLM1017 ', params['Identification'])
+        self.assertEqual('Large (75000 to 300000 lbs)', params['Category'])
+        self.assertRaises(ValueError, adsblib.encode_ident, 'KLM-1017')
+        self.assertRaises(ValueError, adsblib.encode_ident, 'KLM1017', msg_type=11)
+
+    def test_altitude_round_trip(self):
+        for alt in (-1000, 0, 2500, 37000, 50175):
+            params = adsblib.decode(adsblib.encode_apos(51.5, -0.1, alt, False)).params
+            self.assertEqual(alt, params['Altitude (ft)'])
+        # Altitudes are sent in 25 ft steps.
+        self.assertEqual(adsblib.encode_altitude(37000), adsblib.encode_altitude(37010))
+
+    def test_position_round_trip(self):
+        for odd in (False, True):
+            message = adsblib.decode(adsblib.encode_apos(51.5, -0.1, 37000, odd, msg_type=12, time_sync=True))
+            self.assertEqual(12, message.type)
+            params = message.params
+            self.assertEqual('Odd' if odd else 'Even', params['CPR Format'])
+            self.assertTrue(params['Time Synchronized'])
+            self.assertEqual(cpr.encode(51.5, -0.1, odd), (params['CPR Latitude'], params['CPR Longitude']))
+        self.assertRaises(ValueError, adsblib.encode_apos, 51.5, -0.1, 37000, False, msg_type=19)
+
+    def test_velocity_round_trip(self):
+        params = adsblib.decode(adsblib.encode_avel(-120.4, 300.2, -1500)).params
+        self.assertEqual((-120.0, 300.0), (params['Velocity East (kt)'], params['Velocity North (kt)']))
+        self.assertAlmostEqual(-1500, params['Vertical Rate (ft/min)'], delta=32)
+        self.assertEqual('Baro', params['Vertical Rate Source'])
+        # Supersonic speeds use the subtype with 4 kt steps.
+        params = adsblib.decode(adsblib.encode_avel(1500, -2000)).params
+        self.assertEqual((1500.0, -2000.0), (params['Velocity East (kt)'], params['Velocity North (kt)']))
+        self.assertNotIn('Vertical Rate (ft/min)', params)
+
+    def test_status_round_trip(self):
+        params = adsblib.decode(adsblib.encode_astatus(0x1234, emergency=1)).params
+        self.assertEqual(0x1234, params['Mode A Code'])
+        self.assertEqual('General emergency', params['Emergency'])
@@ -0,0 +1,76 @@
+import os
+import tempfile
+import unittest
+import numpy
+from modes import crc, iq
+
+
+EXTENDED_SQUITTER = crc.append_parity(0x8d4840d6202cc371c32ce0, 88)
+ALL_CALL = crc.append_parity(0x5d4840d6, 32)
+ALTITUDE_REPLY = crc.append_parity(0x20001838, 32, address=0x4840d6)
+UNKNOWN_ALTITUDE_REPLY = crc.append_parity(0x20001838, 32, address=0x123456)
+
+
+def samples(replies, n_samples, seed=1):
+    """Interleaved 8 bit IQ samples of noise with replies, a list of (start sample, reply, n_bits), in it."""
+    random = numpy.random.RandomState(seed)
+    amplitude = numpy.zeros(n_samples)
+    for start, reply, n_bits in replies:
+        pulses = numpy.zeros(iq.PREAMBLE_SAMPLES + 2 * n_bits)
+        pulses[list(iq.PREAMBLE_PULSES)] = 1
+        for k in range(n_bits):
+            pulses[iq.PREAMBLE_SAMPLES + 2 * k + (0 if (reply >> (n_bits - 1 - k)) & 1 else 1)] = 1
+        amplitude[start:start + len(pulses)] = 60 * pulses
+    data = numpy.empty(2 * n_samples)
+    data[0::2] = 128 + amplitude + random.normal(0, 3, n_samples)
+    data[1::2] = 128 + random.normal(0, 3, n_samples)
+    return numpy.clip(numpy.round(data), 0, 255).astype(numpy.uint8)
+
+
+class TestDemodulator(unittest.TestCase):
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.iq')
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def demodulate(self, replies, n_samples=20000, **kwargs):
+        samples(replies, n_samples).tofile(self.path)
+        demodulator = iq.Demodulator(workers=2, **kwargs)
+        return list(demodulator.lines(self.path)), demodulator
+
+    def test_receiver_output_format_and_timestamps(self):
+        lines, demodulator = self.demodulate([(1000, EXTENDED_SQUITTER, 112), (3000, ALL_CALL, 56)])
+        self.assertEqual(['{0:014d}.00: 0x4840d6, 0x8d4840d6202cc371c32ce0;\n'.format(iq.PROCESS_BLOCK_SIZE + 1001),
+                          '{0:014d}.00: 0x4840d6, 0x5d4840d6;\n'.format(iq.PROCESS_BLOCK_SIZE + 3001)], lines)
+        self.assertEqual(2, demodulator.replies)
+
+    def test_single_bit_error_is_corrected(self):
+        lines, _ = self.demodulate([(1000, EXTENDED_SQUITTER ^ (1 << 40), 112)])
+        self.assertEqual(1, len(lines))
+        self.assertTrue(lines[0].endswith('0x8d4840d6202cc371c32ce0;\n'))
+
+    def test_address_parity_replies_need_a_known_aircraft(self):
+        replies = [(1000, ALTITUDE_REPLY, 56), (3000, EXTENDED_SQUITTER, 112), (5000, ALTITUDE_REPLY, 56),
+                   (7000, UNKNOWN_ALTITUDE_REPLY, 56)]
+        lines, _ = self.demodulate(replies)
+        self.assertEqual([' 0x4840d6, 0x8d4840d6202cc371c32ce0;\n', ' 0x4840d6, 0x20001838;\n'],
+                         [line[18:] for line in lines])
+        lines, _ = self.demodulate(replies, known=[0x123456])
+        self.assertEqual(3, len(lines))
+        self.assertEqual(' 0x123456, 0x20001838;\n', lines[-1][18:])
+
+    def test_aircraft_are_forgotten_after_ttl(self):
+        lines, _ = self.demodulate([(1000, EXTENDED_SQUITTER, 112), (10000, ALTITUDE_REPLY, 56)], ttl=0.001)
+        self.assertEqual(1, len(lines))
+
+    def test_chunk_boundaries(self):
+        replies = [(start, EXTENDED_SQUITTER, 112) for start in range(500, 19000, 600)]
+        whole, _ = self.demodulate(replies)
+        self.assertEqual(len(replies), len(whole))
+        for chunk_size in (1000, 1237, 5000):
+            chunked, _ = self.demodulate(replies, chunk_size=chunk_size)
+            self.assertEqual(whole, chunked)
+
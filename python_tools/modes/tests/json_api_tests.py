@@ -0,0 +1,85 @@
+import http.client
+import json
+import threading
+import unittest
+from aircraft import AircraftRegistry
+from json_api import ApiServer
+from modes import ModeSReply
+
+
+IDENT = '00000000000001.00: 0x4840d6, 0x8d4840d6202cc371c32ce0;'
+ALTITUDE = '00000000000002.00: 0x40621d, 0x8d40621d58c382d690c8ac;'
+
+
+class TestApiServer(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = AircraftRegistry()
+        self.registry.push_modes_reply(ModeSReply.from_message(IDENT))
+        self.api = ApiServer(self.registry, port=0)  # Publishes keyframe 0
+
+    def tearDown(self):
+        self.api.close()
+
+    def tick(self):
+        self.api.tick()
+
+    def get(self, path, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.api.port, timeout=10)
+        try:
+            connection.request('GET', path, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, response.read(), response.getheader('ETag')
+        finally:
+            connection.close()
+
+    def get_json(self, path):
+        status, body, _ = self.get(path)
+        self.assertEqual(200, status)
+        return json.loads(body.decode())
+
+    def test_aircraft_list_and_detail(self):
+        self.assertEqual(['4840d6'], [entry['icao'] for entry in self.get_json('/aircraft')['aircraft']])
+        detail = self.get_json('/aircraft/4840d6')
+        self.assertEqual('KLM1023 ', detail['parameters']['Identification'])
+        self.assertEqual([], detail['track'])
+        self.assertEqual(404, self.get('/aircraft/123456')[0])
+        self.assertEqual(404, self.get('/aircraft/xyz')[0])
+        self.assertEqual(404, self.get('/nothing')[0])
+
+    def test_etag_gives_not_modified(self):
+        status, body, etag = self.get('/aircraft')
+        self.assertEqual(304, self.get('/aircraft', {'If-None-Match': etag})[0])
+        self.tick()  # Nothing changed, so the list is the same.
+        self.assertEqual(304, self.get('/aircraft', {'If-None-Match': etag})[0])
+        self.registry.push_modes_reply(ModeSReply.from_message(ALTITUDE))
+        self.tick()
+        status, body, new_etag = self.get('/aircraft', {'If-None-Match': etag})
+        self.assertEqual(200, status)
+        self.assertNotEqual(etag, new_etag)
+        self.assertEqual(2, self.api.not_modified)
+
+    def test_updates_since(self):
+        keyframe = self.get_json('/updates')
+        self.assertEqual([0], [update['seq'] for update in keyframe])
+        self.assertTrue(keyframe[0]['keyframe'])
+        self.registry.push_modes_reply(ModeSReply.from_message(ALTITUDE))
+        self.tick()
+        self.tick()
+        updates = self.get_json('/updates?since=0')
+        self.assertEqual([1, 2], [update['seq'] for update in updates])
+        self.assertEqual(['40621d'], list(updates[0]['aircraft']))
+        self.assertEqual([2], [update['seq'] for update in self.get_json('/updates?since=1')])
+        # A client ahead of the server (which was restarted) starts again from the keyframe.
+        self.assertEqual([0, 1, 2], [update['seq'] for update in self.get_json('/updates?since=50&timeout=5')])
+
+    def test_long_poll(self):
+        self.assertEqual([], self.get_json('/updates?since=0&timeout=0.2'))
+        result = []
+        thread = threading.Thread(target=lambda: result.append(self.get_json('/updates?since=0&timeout=10')))
+        thread.start()
+        while self.api.requests < 2:
+            thread.join(0.01)
+        self.tick()
+        thread.join()
+        self.assertEqual([1], [update['seq'] for update in result[0]])
@@ -0,0 +1,125 @@
+import os
+import shutil
+import tempfile
+import unittest
+from modes.logindex import LogIndex, IcaoBloomFilter, split_line
+
+
+def log_line(timestamp, icao):
+    return '{0:014d}.00: 0x{1:06x}, 0x5d{1:06x}000000;\n'.format(timestamp, icao)
+
+
+class TestIcaoBloomFilter(unittest.TestCase):
+
+    def test_added_addresses_are_members(self):
+        bloom = IcaoBloomFilter()
+        bloom.update([0x4840d6, 0x400f2e])
+        self.assertIn(0x4840d6, bloom)
+        self.assertIn(0x400f2e, bloom)
+
+    def test_round_trip_through_hex(self):
+        bloom = IcaoBloomFilter(1024, 3)
+        bloom.add(0xabcdef)
+        copy = IcaoBloomFilter.from_hex(bloom.to_hex(), 1024, 3)
+        self.assertEqual(bloom.bits, copy.bits)
+
+
+class TestLogIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, 'receiver.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_log(self, lines, mode='w'):
+        with open(self.log_path, mode) as f:
+            f.writelines(lines)
+
+    def test_split_line(self):
+        self.assertEqual((1000.25, 0x4840d6), split_line(b'00000000001000.25: 0x4840d6, 0x00;\n'))
+        self.assertIsNone(split_line(b'Overflow!\n'))
+
+    def test_chunks_cover_interval(self):
+        self.write_log([log_line(t * 100, 0x100000 + t) for t in range(100)])
+        index = LogIndex(self.log_path, interval=1000)
+        index.update()
+        # The final chunk is still open so only nine are stored.
+        self.assertEqual(9, len(index.chunks))
+        self.assertEqual(0, index.chunks[0].min_timestamp)
+        self.assertEqual(1000, index.chunks[0].max_timestamp)
+
+    def test_query_by_icao_and_time(self):
+        lines = [log_line(t * 100, 0x4840d6 if t % 10 == 0 else 0x100000 + t) for t in range(200)]
+        self.write_log(lines)
+        index = LogIndex(self.log_path, interval=1000)
+        index.update()
+        replies = list(index.replies(icao=0x4840d6, start=5000, end=12000))
+        self.assertEqual([5000.0, 6000.0, 7000.0, 8000.0, 9000.0, 10000.0, 11000.0, 12000.0],
+                         [r.timestamp for r in replies])
+        self.assertTrue(all(r.icao.uint == 0x4840d6 for r in replies))
+
+    def test_query_skips_chunks(self):
+        self.write_log([log_line(t * 100, 0x100000 + t) for t in range(100)])
+        index = LogIndex(self.log_path, interval=1000)
+        index.update()
+        self.assertEqual(1, len(index.find_chunks(start=2050, end=2070)))
+        self.assertEqual([], index.find_chunks(icao=0xffff00, start=0))
+
+    def test_incremental_update_of_growing_log(self):
+        self.write_log([log_line(t * 100, 0x100000) for t in range(50)])
+        index = LogIndex(self.log_path, interval=1000)
+        index.update()
+        n_chunks = len(index.chunks)
+        # A partially written line must not be indexed.
+        self.write_log([log_line(t * 100, 0x200000) for t in range(50, 100)] + ['00000000010000.00: 0x2'], 'a')
+        index.update()
+        self.assertGreater(len(index.chunks), n_chunks)
+        self.assertEqual(50, len(list(index.lines(icao=0x200000))))
+
+        reloaded = LogIndex(self.log_path, interval=1000)
+        self.assertEqual(len(index.chunks), len(reloaded.chunks))
+        self.assertEqual(index.indexed_offset, reloaded.indexed_offset)
+
+    def test_truncated_log_is_reindexed(self):
+        self.write_log([log_line(t * 100, 0x100000) for t in range(100)])
+        index = LogIndex(self.log_path, interval=1000)
+        index.update()
+        self.write_log([log_line(t * 100, 0x300000) for t in range(30)])
+        index.update()
+        self.assertEqual(30, len(list(index.lines(icao=0x300000))))
+        self.assertEqual(0, len(list(index.lines(icao=0x100000))))
+
+    def test_rotated_log_is_reindexed(self):
+        self.write_log([log_line(t * 100, 0x100000) for t in range(100)])
+        index = LogIndex(self.log_path, interval=1000)
+        index.update()
+        # A new log at least as long as the old one
+        self.write_log([log_line(t * 100, 0x300000) for t in range(1, 120)])
+        index.update()
+        self.assertEqual(119, len(list(index.lines(icao=0x300000))))
+        self.assertEqual(0, len(list(index.lines(icao=0x100000))))
+        self.assertEqual(0, LogIndex(self.log_path, interval=1000).chunks[0].offset)
+
+    def test_index_with_other_parameters_is_rebuilt(self):
+        self.write_log([log_line(t * 100, 0x100000) for t in range(100)])
+        LogIndex(self.log_path, interval=1000).update()
+        index = LogIndex(self.log_path, interval=2000)
+        self.assertEqual([], index.chunks)
+        index.update()
+        self.assertEqual(4, len(index.chunks))
+        with open(index.index_path) as f:
+            self.assertEqual(1 + 4, len(f.readlines()))  # No chunks left over from the old index
+        self.assertEqual([], LogIndex(self.log_path, interval=1000).chunks)
+        self.assertEqual(4, len(LogIndex(self.log_path, interval=2000).chunks))
+
+    def test_index_of_an_empty_log_records_its_first_line_later(self):
+        self.write_log([])
+        index = LogIndex(self.log_path, interval=1000)
+        index.update()
+        self.write_log([log_line(t * 100, 0x100000) for t in range(100)])
+        index.update()
+        self.write_log([log_line(t * 100, 0x300000) for t in range(1, 120)])
+        LogIndex(self.log_path, interval=1000).update()
+        self.assertEqual(119, len(list(LogIndex(self.log_path, interval=1000).lines(icao=0x300000))))
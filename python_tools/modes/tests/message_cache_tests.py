@@ -0,0 +1,47 @@
+import unittest
+import adsblib
+from modes import ModeSReply
+
+
+IDENT = '00000000000001.00: 0x4840d6, 0x8d4840d6202cc371c32ce0;'
+POSITION = '00000000000002.00: 0x40621d, 0x8d40621d58c382d690c8ac;'
+
+
+class TestMessageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = adsblib.enable_cache(2)
+
+    def tearDown(self):
+        adsblib.disable_cache()
+
+    def test_repeated_ident_is_shared(self):
+        first = ModeSReply.from_message(IDENT).message
+        second = ModeSReply.from_message(IDENT).message
+        self.assertIs(first, second)
+        self.assertEqual('KLM1023 ', first.params['Identification'])
+        self.assertEqual((1, 1), (self.cache.hits, self.cache.misses))
+
+    def test_cached_params_are_read_only(self):
+        message = ModeSReply.from_message(IDENT).message
+        with self.assertRaises(TypeError):
+            message.params['Identification'] = 'X'
+
+    def test_position_is_not_cached(self):
+        ModeSReply.from_message(POSITION)
+        ModeSReply.from_message(POSITION)
+        self.assertEqual((0, 0), (self.cache.hits, self.cache.misses))
+        self.assertEqual(0, len(self.cache))
+
+    def test_least_recently_used_is_evicted(self):
+        for mode_a in (0x0123, 0x0456, 0x0123, 0x0789):
+            self.cache.get(adsblib.encode_astatus(mode_a))
+        self.assertEqual(2, len(self.cache))
+        self.cache.get(adsblib.encode_astatus(0x0123))
+        self.assertEqual(2, self.cache.hits)
+        self.cache.get(adsblib.encode_astatus(0x0456))
+        self.assertEqual(4, self.cache.misses)
+
+    def test_disabled_cache_decodes_afresh(self):
+        adsblib.disable_cache()
+        self.assertIsNot(ModeSReply.from_message(IDENT).message, ModeSReply.from_message(IDENT).message)
@@ -0,0 +1,76 @@
+import threading
+import unittest
+from modes.pipeline import BLOCK, DROP_NEWEST, DROP_OLDEST, Pipeline
+
+
+LINES = [
+    '00000000000001.00: 0x4840d6, 0x8d4840d6202cc371c32ce0;\n',  # DF17 identification
+    '00000000000002.00: 0x40621d, 0x8d40621d58c382d690c8ac;\n',  # DF17 airborne position
+    '00000000000003.00: 0x4840d6, 0xa000083e202cc371c31de0;\n',  # DF20
+    'Overflow!\n',
+]
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_replies_are_decoded_once_and_shared(self):
+        pipeline = Pipeline()
+        first, second = [], []
+        pipeline.subscribe(first.append, policy=BLOCK)
+        pipeline.subscribe(second.append, policy=BLOCK)
+        pipeline.feed(LINES)
+        pipeline.close()
+        self.assertEqual(3, len(first))
+        self.assertTrue(all(a is b for a, b in zip(first, second)))
+        self.assertEqual(1, pipeline.failed)
+
+    def test_filters(self):
+        pipeline = Pipeline()
+        df20, positions = [], []
+        pipeline.subscribe(df20.append, formats=[20], policy=BLOCK)
+        pipeline.subscribe(positions.append, types=range(9, 19), policy=BLOCK)
+        pipeline.feed(LINES)
+        pipeline.close()
+        self.assertEqual([20], [reply.format for reply in df20])
+        self.assertEqual([11], [reply.message.type for reply in positions])
+
+    def test_slow_subscriber_drops_without_stalling_others(self):
+        gate = threading.Event()
+        pipeline = Pipeline()
+        fast = []
+        slow = pipeline.subscribe(lambda reply: gate.wait(), maxsize=2, policy=DROP_NEWEST)
+        pipeline.subscribe(fast.append, policy=BLOCK)
+        pipeline.feed(LINES[:3] * 10)
+        gate.set()
+        pipeline.close()
+        self.assertEqual(30, len(fast))
+        self.assertGreater(slow.dropped, 0)
+        self.assertEqual(30, slow.delivered + slow.dropped)
+
+    def test_drop_oldest_keeps_latest(self):
+        gate = threading.Event()
+        pipeline = Pipeline()
+        seen = []
+
+        def handler(reply):
+            gate.wait()
+            seen.append(reply.timestamp)
+        pipeline.subscribe(handler, maxsize=1, policy=DROP_OLDEST)
+        pipeline.feed('{0:017.2f}: 0x4840d6, 0x5d4840d6;\n'.format(t) for t in range(100))
+        gate.set()
+        pipeline.close()
+        self.assertEqual(99.0, seen[-1])
+
+    def test_failing_subscriber_is_isolated(self):
+        pipeline = Pipeline()
+        received = []
+        failing = pipeline.subscribe(lambda reply: 1 / 0)
+        pipeline.subscribe(received.append, policy=BLOCK)
+        pipeline.feed(LINES)
+        pipeline.close()
+        self.assertEqual(3, failing.errors)
+        self.assertEqual(3, len(received))
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            Pipeline().subscribe(print, policy='sometimes')
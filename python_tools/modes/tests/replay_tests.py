@@ -0,0 +1,114 @@
+import socket
+import threading
+import time
+import unittest
+from modes import SAMPLE_RATE
+from modes.replay import Connection, Replayer, line_timestamp
+
+
+def log_lines(timestamps, icao=0x4840d6):
+    return ['{0:017.2f}: 0x{1:06x}, 0x5d{1:06x};\n'.format(t, icao) for t in timestamps]
+
+
+class Collector(object):
+
+    def __init__(self, delay=0.0):
+        self.lines = []
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.lines.extend(text.splitlines(True))
+
+
+class TestReplayer(unittest.TestCase):
+
+    def test_line_timestamp(self):
+        self.assertEqual(506733.25, line_timestamp('00000000506733.25: 0x111111, 0xffffffff;\n'))
+        self.assertIsNone(line_timestamp('Overflow!\n'))
+
+    def test_as_fast_as_possible_delivers_everything_in_order(self):
+        collector = Collector()
+        replayer = Replayer([Connection(collector.write)], speed=0)
+        lines = log_lines(range(0, 1000 * SAMPLE_RATE, SAMPLE_RATE))
+        stats = replayer.run(lines)
+        replayer.close()
+        self.assertEqual(lines, collector.lines)
+        self.assertEqual(1000, stats.offered)
+        self.assertEqual(0, stats.dropped)
+
+    def test_paced_by_timestamps(self):
+        collector = Collector()
+        replayer = Replayer([Connection(collector.write)], speed=10.0)
+        # 1 second of traffic at 10x takes 0.1 seconds.
+        start = time.time()
+        replayer.run(log_lines([0, SAMPLE_RATE / 2, SAMPLE_RATE]))
+        replayer.close()
+        self.assertGreaterEqual(time.time() - start, 0.09)
+        self.assertEqual(3, len(collector.lines))
+
+    def test_restarted_receiver_timestamps_are_rebased(self):
+        collector = Collector()
+        replayer = Replayer([Connection(collector.write)], speed=1.0)
+        start = time.time()
+        stats = replayer.run(log_lines([100 * SAMPLE_RATE, 100 * SAMPLE_RATE + 1000, 5, 1005]))
+        replayer.close()
+        self.assertLess(time.time() - start, 1.0)
+        self.assertEqual(1, stats.rebases)
+
+    def test_slow_connection_drops_instead_of_blocking(self):
+        gate = threading.Event()
+        connection = Connection(lambda text: gate.wait(), maxsize=10, batch=1)
+        replayer = Replayer([connection], speed=0)
+        stats = replayer.run(log_lines(range(100)))
+        gate.set()
+        replayer.close()
+        self.assertGreater(stats.dropped, 0)
+        self.assertEqual(100, connection.sent + connection.dropped)
+
+    def test_fan_out_keeps_aircraft_on_one_connection(self):
+        collectors = [Collector() for _ in range(3)]
+        replayer = Replayer([Connection(c.write) for c in collectors], speed=0)
+        lines = []
+        for icao in range(0x100000, 0x100010):
+            lines.extend(log_lines(range(5), icao))
+        replayer.run(lines)
+        replayer.close()
+        self.assertEqual(len(lines), sum(len(c.lines) for c in collectors))
+        icao_sets = [set(line.split(', ')[0][-6:] for line in c.lines) for c in collectors]
+        self.assertEqual(16, sum(len(icaos) for icaos in icao_sets))
+
+    def test_peer_closing_mid_replay(self):
+        sender, receiver = socket.socketpair()
+        connection = Connection(lambda text: sender.sendall(text.encode('ascii')), maxsize=100, batch=16)
+        replayer = Replayer([connection], speed=0)
+        lines = log_lines(range(20000))
+
+        def read_a_little():
+            receiver.recv(1000)
+            receiver.close()
+        reader = threading.Thread(target=read_a_little)
+        reader.start()
+        stats = replayer.run(lines)
+        reader.join()
+        replayer.close()  # Mustn't hang on the full queue.
+        sender.close()
+        self.assertIsInstance(connection.error, OSError)
+        self.assertEqual(20000, connection.sent + connection.failed + connection.dropped)
+        self.assertEqual(connection.dropped, stats.dropped)
+        self.assertGreater(connection.failed + connection.dropped, 0)
+
+    def test_close_after_the_writer_died(self):
+        def fail(text):
+            raise KeyboardInterrupt()  # Not an OSError, so the writer thread stops.
+        connection = Connection(fail, maxsize=10, batch=1)
+        thread_excepthook, threading.excepthook = threading.excepthook, lambda args: None
+        try:
+            connection.offer('x\n')
+            connection._thread.join()
+        finally:
+            threading.excepthook = thread_excepthook
+        for _ in range(20):
+            connection.offer('x\n')
+        connection.close()
+        self.assertEqual(10, connection.dropped)
@@ -0,0 +1,44 @@
+import io
+import unittest
+import simulator
+from aircraft import AircraftRegistry
+from modes import ModeSReply, SAMPLE_RATE, crc
+
+
+class TestSimulator(unittest.TestCase):
+
+    def test_frames_have_valid_parity(self):
+        frame = simulator.frame_df17(0x4840d6, 0x202cc371c32ce0)
+        self.assertEqual(0, crc.syndrome(frame, 112))
+        self.assertEqual('00000000000001.00: 0x4840d6, 0x8d4840d6202cc371c32ce0;\n',
+                         simulator.receiver_line(1, 0x4840d6, frame))
+
+    def test_seeded_run_parses_and_decodes(self):
+        truth = io.StringIO()
+        lines = list(simulator.TrafficSimulator(5, 100.0, seed=1).lines(10.0, truth))
+        self.assertEqual(lines, list(simulator.TrafficSimulator(5, 100.0, seed=1).lines(10.0)))
+        self.assertAlmostEqual(1000, len(lines), delta=100)
+
+        registry = AircraftRegistry()
+        timestamps = []
+        for line in lines:
+            reply = ModeSReply.from_message(line.strip())
+            self.assertEqual(17, reply.format)
+            self.assertIsNotNone(reply.message)
+            registry.push_modes_reply(reply)
+            timestamps.append(reply.timestamp)
+        self.assertEqual(sorted(timestamps), timestamps)
+        self.assertEqual(5, len(registry))
+
+        # The decoded positions are where the simulator says the aircraft were.
+        last = {}
+        for row in truth.getvalue().splitlines():
+            timestamp, icao, lat, lon, alt = row.split(',')[:5]
+            last[int(icao, 16)] = (int(timestamp) / float(SAMPLE_RATE), float(lat), float(lon), float(alt))
+        for inst in registry:
+            t, lat, lon, alt = last[inst.icao]
+            self.assertAlmostEqual(t, inst.track[-1][0], 6)
+            self.assertAlmostEqual(lat, inst.position[0], 3)
+            self.assertAlmostEqual(lon, inst.position[1], 3)
+            self.assertAlmostEqual(alt, inst.parameters['Altitude (ft)'], delta=12.5)
+            self.assertIn('Identification', inst.parameters)
@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+import unittest
+from bitstring import Bits
+import adsblib
+from aircraft import AircraftRegistry
+from modes import ModeSReply
+from snapshot import ChangeTracker, SnapshotEmitter, Ticker
+
+
+def ident_reply(icao, ident):
+    me = adsblib.encode_ident(ident)
+    return ModeSReply(timestamp=0, icao=Bits(uint=icao, length=24),
+                      data=Bits(uint=(0x8d << 80) | (icao << 56) | me, length=88))
+
+
+class TestSnapshotEmitter(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = AircraftRegistry()
+        self.written = []
+        self.emitter = SnapshotEmitter(self.registry, self.written.append, interval=1.0, keyframe_interval=10.0)
+
+    def test_keyframe_then_deltas(self):
+        self.registry.push_modes_reply(ident_reply(0x4840d6, 'BAW123'))
+        keyframe = self.emitter.tick(100.0)
+        self.assertEqual({'seq': 0, 'time': 100.0, 'keyframe': True, 'removed': [],
+                          'aircraft': {'4840d6': {'Identification': 'BAW123  '}}}, keyframe)
+        self.assertEqual(keyframe, json.loads(self.written[-1]))
+
+        # Only what changed goes in a delta.
+        self.registry.push_modes_reply(ident_reply(0x4840d6, 'BAW123'))
+        self.registry.push_modes_reply(ident_reply(0x40621d, 'EZY1'))
+        delta = self.emitter.tick(101.0)
+        self.assertEqual({'seq': 1, 'time': 101.0, 'keyframe': False, 'removed': [],
+                          'aircraft': {'40621d': {'Identification': 'EZY1    '}}}, delta)
+
+        self.assertTrue(self.emitter.tick(110.0)['keyframe'])
+        self.assertEqual(2, len(self.emitter.tick(111.0, keyframe=True)['aircraft']))
+
+    def test_removals(self):
+        self.registry.push_modes_reply(ident_reply(0x4840d6, 'BAW123'))
+        self.emitter.tick(100.0)
+        self.registry.push_modes_reply(ident_reply(0x4840d6, 'BAW124'))
+        self.registry.remove(0x4840d6)
+        delta = self.emitter.tick(101.0)
+        self.assertEqual(['4840d6'], delta['removed'])
+        self.assertEqual({}, delta['aircraft'])
+
+    def test_poll_interval(self):
+        self.assertIsNotNone(self.emitter.poll(100.0))
+        self.assertIsNone(self.emitter.poll(100.5))
+        self.assertEqual(1, self.emitter.poll(101.0)['seq'])
+        self.emitter.close()
+        self.registry.push_modes_reply(ident_reply(0x4840d6, 'BAW123'))
+        self.assertEqual({}, self.emitter.tick(102.0)['aircraft'])
+
+
+class TestChangeTracker(unittest.TestCase):
+
+    def test_take(self):
+        registry = AircraftRegistry()
+        tracker = ChangeTracker()
+        registry.add_listener(tracker)
+        registry.push_modes_reply(ident_reply(0x4840d6, 'BAW123'))
+        registry.push_modes_reply(ident_reply(0x40621d, 'EZY1'))
+        registry.remove(0x40621d)
+        self.assertEqual(({0x4840d6: {'Identification'}}, {0x40621d}), tracker.take())
+        self.assertEqual(({}, set()), tracker.take())
+
+
+class TestTicker(unittest.TestCase):
+
+    def test_ticks_without_input_and_holds_the_lock(self):
+        lock = threading.Lock()
+        calls = []
+        ticker = Ticker(lambda: calls.append(lock.locked()), lock, period=0.01)
+        time.sleep(0.2)
+        with lock:
+            n_calls = len(calls)
+            time.sleep(0.05)
+            self.assertEqual(n_calls, len(calls))
+        ticker.close()
+        self.assertGreater(len(calls), 3)
+        self.assertTrue(all(calls))
@@ -0,0 +1,119 @@
+import unittest
+from bitstring import Bits
+from modes import crc, sources
+from modes.pipeline import BLOCK, Pipeline
+
+
+EXTENDED_SQUITTER = crc.append_parity(0x8d4840d6202cc371c32ce0, 88).to_bytes(14, 'big')
+ALL_CALL = crc.append_parity(0x5d4840d6, 32).to_bytes(7, 'big')
+ALTITUDE_REPLY = crc.append_parity(0x20001838, 32, address=0x4840d6).to_bytes(7, 'big')
+DAMAGED = EXTENDED_SQUITTER[:5] + b'\x00' + EXTENDED_SQUITTER[6:]
+
+# A capture with 0x1a to escape in a timestamp, a signal level and a reply, a frame of an unknown type at the start
+# and a Mode A/C reply
+BEAST = (b'\x00\x1a\x05' + sources.beast_frame(EXTENDED_SQUITTER, 0x1a1a00000006, 0x1a) +
+         b'\x1a1' + b'\x00' * 6 + b'\x80\x12\x34' +
+         sources.beast_frame(ALL_CALL, 12, 255) +
+         sources.beast_frame(DAMAGED, 18, 100) +
+         sources.beast_frame(ALTITUDE_REPLY, 24, 100) +
+         sources.beast_frame(ALL_CALL[:4] + b'\x1a' + ALL_CALL[5:], 30, 100))
+
+
+def parse_in_chunks(parser, data, chunk_size):
+    records = []
+    for offset in range(0, len(data), chunk_size):
+        records.extend(parser.feed(data[offset:offset + chunk_size]))
+    return records
+
+
+class TestBeastParser(unittest.TestCase):
+
+    def test_replies_timestamps_and_signal_levels(self):
+        parser = sources.BeastParser()
+        replies = parser.feed(BEAST)
+        self.assertEqual([Bits('0x8d4840d6202cc371c32ce0'), Bits('0x5d4840d6'), Bits('0x20001838')],
+                         [reply.data for reply in replies])
+        self.assertEqual([0x4840d6] * 3, [reply.icao.uint for reply in replies])
+        self.assertEqual([0x1a1a00000006 / 6.0, 2.0, 4.0], [reply.timestamp for reply in replies])
+        self.assertAlmostEqual(-19.8, replies[0].signal, 1)
+        self.assertEqual(0.0, replies[1].signal)
+        self.assertEqual('Aircraft identifiaction and category (set A)', replies[0].message.describe())
+        self.assertEqual((3, 2, 1, 1), (parser.replies, parser.rejected, parser.mode_ac, parser.malformed))
+
+    def test_any_split_gives_the_same_replies(self):
+        whole = [(reply.timestamp, reply.data) for reply in sources.BeastParser().feed(BEAST)]
+        for chunk_size in range(1, 40):
+            parser = sources.BeastParser()
+            replies = parse_in_chunks(parser, BEAST, chunk_size)
+            self.assertEqual(whole, [(reply.timestamp, reply.data) for reply in replies])
+            self.assertEqual((1, 1), (parser.mode_ac, parser.malformed))
+
+    def test_address_parity_replies_need_a_known_aircraft(self):
+        parser = sources.BeastParser(known={0x123456})
+        replies = parser.feed(BEAST)
+        self.assertEqual([11, 17], sorted(reply.format for reply in replies))
+        self.assertEqual(3, parser.rejected)
+
+    def test_resynchronises_after_a_malformed_frame(self):
+        data = b'\x1a3\x01\x02' + sources.beast_frame(ALL_CALL, 6)
+        parser = sources.BeastParser()
+        self.assertEqual([1.0], [reply.timestamp for reply in parser.feed(data)])
+        self.assertEqual(1, parser.malformed)
+
+
+class TestAvrParser(unittest.TestCase):
+
+    def test_lines(self):
+        data = ('*' + EXTENDED_SQUITTER.hex().upper() + ';\r\n' +
+                '@00000000000c' + ALL_CALL.hex() + ';\n' +
+                '*' + DAMAGED.hex() + ';\n' +
+                '*8d4840;\n' +
+                'garbage\n' +
+                '*' + ALTITUDE_REPLY.hex()).encode()
+        parser = sources.AvrParser()
+        replies = parse_in_chunks(parser, data, 10)
+        self.assertEqual([None, 2.0], [reply.timestamp for reply in replies])
+        self.assertEqual([17, 11], [reply.format for reply in replies])
+        self.assertEqual((1, 2), (parser.rejected, parser.malformed))
+        self.assertEqual(1, len(parser.feed(b'\n')))  # The last line is only complete at its newline.
+
+
+class TestSbsParser(unittest.TestCase):
+
+    def test_records(self):
+        data = (b'MSG,3,1,1,4840D6,1,2013/10/08,12:00:01.500,2013/10/08,12:00:01.510,,37000,,,51.50000,-0.10000,'
+                b',,0,0,0,0\n'
+                b'MSG,1,1,1,4840D6,1,2013/10/08,12:00:02.000,2013/10/08,12:00:02.000,BAW123  ,,,,,,,,,,,\n'
+                b'MSG,6,1,1,4840D6,1,2013/10/08,12:00:02.500,2013/10/08,12:00:02.500,,,,,,,,0123,0,0,0,0\n'
+                b'MSG,6,1,1,4840D6,1,2013/10/08,12:00:02.500,2013/10/08,12:00:02.500,,,,,,,,0128,0,0,0,0\n'
+                b'STA,,1,1,4840D6,1,2013/10/08,12:00:02.000,2013/10/08,12:00:02.000,RM\n'
+                b'MSG,3,1,1,XYZ,1,2013/10/08,12:00:02.000,2013/10/08,12:00:02.000,,,,,,,,,,,,\n')
+        parser = sources.SbsParser()
+        records = parser.feed(data)
+        self.assertEqual(3, len(records))
+        self.assertEqual(1381233601.5, records[0].time)
+        self.assertEqual(0x4840d6, records[0].icao.uint)
+        self.assertEqual({'Altitude (ft)': 37000, 'Latitude': 51.5, 'Longitude': -0.1, 'On Ground': False},
+                         records[0].parameters)
+        self.assertEqual({'Identification': 'BAW123'}, records[1].parameters)
+        self.assertEqual({'Squawk': '0123', 'On Ground': False}, records[2].parameters)
+        self.assertEqual(2, parser.malformed)
+
+
+class TestTcpSource(unittest.TestCase):
+
+    def test_feeder_replay_into_pipeline(self):
+        feeder = sources.Feeder(BEAST * 50, chunk_size=7)
+        source = sources.TcpSource(feeder.host, feeder.port, sources.parser('beast'))
+        pipeline = Pipeline()
+        received = []
+        pipeline.subscribe(received.append, policy=BLOCK)
+        pipeline.feed_replies(source)
+        source.close()
+        feeder.close()
+        pipeline.close()
+        self.assertEqual(150, len(received))
+        self.assertEqual(len(BEAST) * 50, source.bytes_received)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, sources.parser, 'json')
@@ -0,0 +1,57 @@
+import unittest
+from spatial import GridIndex, distance_nm
+
+
+class TestGridIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = GridIndex(cell_size=1.0)
+
+    def brute_force(self, lat, lon, radius):
+        return sorted((distance_nm(lat, lon, plat, plon), icao) for icao, (plat, plon) in self.positions.items()
+                      if distance_nm(lat, lon, plat, plon) <= radius)
+
+    def add(self, positions):
+        self.positions = positions
+        for icao, (lat, lon) in positions.items():
+            self.index.update(icao, lat, lon)
+
+    def test_distance(self):
+        self.assertAlmostEqual(60.0, distance_nm(0.0, 0.0, 1.0, 0.0), 0)
+        self.assertAlmostEqual(12.0, distance_nm(0.0, 179.9, 0.0, -179.9), 0)
+
+    def test_radius_query(self):
+        self.add({1: (51.5, -0.1), 2: (51.6, 0.3), 3: (52.5, -0.1), 4: (48.9, 2.3)})
+        found = self.index.within_radius(51.5, -0.1, 70.0)
+        self.assertEqual([1, 2, 3], [icao for _, icao in found])
+        self.assertEqual(self.brute_force(51.5, -0.1, 70.0), found)
+
+    def test_radius_query_across_the_antimeridian(self):
+        self.add({1: (0.0, 179.9), 2: (0.0, -179.9), 3: (0.5, -178.5), 4: (0.0, 178.0)})
+        for lon in (179.95, -179.95, 180.0):
+            self.assertEqual(self.brute_force(0.0, lon, 60.0), self.index.within_radius(0.0, lon, 60.0))
+        self.assertEqual([1, 2, 3], sorted(icao for _, icao in self.index.within_radius(0.0, -179.95, 100.0)))
+
+    def test_radius_query_near_the_poles(self):
+        self.add({1: (89.9, 0.0), 2: (89.9, 180.0), 3: (89.0, 90.0), 4: (-89.5, -45.0), 5: (-89.5, 135.0)})
+        self.assertEqual(self.brute_force(89.95, 45.0, 70.0), self.index.within_radius(89.95, 45.0, 70.0))
+        self.assertEqual([1, 2, 3], sorted(icao for _, icao in self.index.within_radius(89.95, 45.0, 70.0)))
+        self.assertEqual([4, 5], sorted(icao for _, icao in self.index.within_radius(-90.0, 0.0, 60.0)))
+
+    def test_box_across_the_antimeridian(self):
+        self.add({1: (10.0, 179.5), 2: (10.0, -179.5), 3: (10.0, 0.0)})
+        self.assertEqual([1, 2], sorted(self.index.within_box(9.0, 179.0, 11.0, -179.0)))
+        self.assertEqual([3], self.index.within_box(9.0, -179.0, 11.0, 179.0))
+
+    def test_move_and_remove(self):
+        self.add({1: (51.5, -0.1)})
+        self.index.update(1, 40.0, -74.0)
+        self.assertEqual([], self.index.within_radius(51.5, -0.1, 10.0))
+        self.assertEqual([1], [icao for _, icao in self.index.within_radius(40.0, -74.0, 10.0)])
+        self.index.remove(1)
+        self.assertEqual(0, len(self.index))
+
+    def test_nearest(self):
+        self.add({1: (51.5, -0.1), 2: (40.0, -74.0), 3: (-33.9, 151.2)})
+        self.assertEqual([2, 1], [icao for _, icao in self.index.nearest(45.0, -60.0, 2)])
+        self.assertEqual([3], [icao for _, icao in self.index.nearest(-40.0, 170.0)])
@@ -0,0 +1,117 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from bitstring import Bits
+import adsblib
+from aircraft import Aircraft
+from modes import ModeSReply
+from sqlite_sink import SqliteSink
+
+
+IDENT = '00000000000001.00: 0x4840d6, 0x8d4840d6202cc371c32ce0;'
+ALTITUDE = '00000000000002.00: 0x4840d6, 0x20001838;'
+VELOCITY = ModeSReply(timestamp=3, icao=Bits(uint=0x4840d6, length=24),
+                      data=Bits(uint=(0x8d4840d6 << 56) | adsblib.encode_avel(100.0, 200.0, -640.0), length=88))
+
+
+class TestSqliteSink(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'adsb.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def query(self, sql):
+        db = sqlite3.connect(self.path)
+        try:
+            return db.execute(sql).fetchall()
+        finally:
+            db.close()
+
+    def block_writer(self, sink):
+        """Make the writer wait in its next transaction until the returned event is set."""
+        entered, release = threading.Event(), threading.Event()
+        write = sink._write
+
+        def blocked(db, items):
+            entered.set()
+            release.wait()
+            write(db, items)
+        sink._write = blocked
+        return entered, release
+
+    def test_replies_are_written(self):
+        sink = SqliteSink(self.path)
+        sink.write_reply(ModeSReply.from_message(IDENT), received=10.0)
+        sink.write_reply(ModeSReply.from_message(ALTITUDE), received=11.0)
+        sink.close()
+        self.assertEqual([(1.0, 10.0, 0x4840d6, 17, 4, '8d4840d6202cc371c32ce0'),
+                          (2.0, 11.0, 0x4840d6, 4, None, '20001838')],
+                         self.query('SELECT timestamp, received, icao, df, type, data FROM replies ORDER BY id'))
+        self.assertEqual((2, 0, None), (sink.written, sink.dropped, sink.error))
+
+    def test_aircraft_keep_their_latest_state(self):
+        sink = SqliteSink(self.path)
+        entered, release = self.block_writer(sink)
+        aircraft = Aircraft.from_reply(ModeSReply.from_message(IDENT))
+        sink.write_aircraft(aircraft, last_seen=1.0)
+        entered.wait()
+        # These queue up behind the blocked transaction and are written together, as a single row.
+        for last_seen in (2.0, 3.0, 4.0):
+            sink.write_aircraft(aircraft, last_seen=last_seen)
+        aircraft.push_modes_reply(VELOCITY)
+        sink.write_aircraft(aircraft, last_seen=5.0)
+        release.set()
+        sink.close()
+        self.assertEqual([(0x4840d6, 5.0, 'KLM1023 ', -640.0)],
+                         self.query('SELECT icao, last_seen, identification, vertical_rate FROM aircraft'))
+        self.assertEqual((5, 2), (sink.written, sink.transactions))
+
+    def test_rows_are_dropped_when_the_queue_is_full(self):
+        sink = SqliteSink(self.path, maxsize=4)
+        entered, release = self.block_writer(sink)
+        reply = ModeSReply.from_message(IDENT)
+        sink.write_reply(reply)
+        entered.wait()
+        for _ in range(7):
+            sink.write_reply(reply)
+        self.assertEqual((4, 3), (sink.depth, sink.dropped))
+        release.set()
+        sink.close()
+        self.assertEqual([(5,)], self.query('SELECT count(*) FROM replies'))
+
+    def test_write_errors_are_recorded(self):
+        sink = SqliteSink(self.path, maxsize=4)
+        entered, release = self.block_writer(sink)
+        reply = ModeSReply.from_message(IDENT)
+        sink.write_reply(reply)
+        entered.wait()
+        self.query('DROP TABLE replies')
+        for _ in range(10):
+            sink.write_reply(reply)
+        release.set()
+        sink.close()
+        self.assertIsInstance(sink.error, sqlite3.OperationalError)
+        self.assertEqual((0, 6, 5, 11), (sink.written, sink.queue_full, sink.failed, sink.dropped))
+
+    def test_close_after_the_writer_died(self):
+        sink = SqliteSink(self.path, maxsize=4)
+
+        def fail(db, items):
+            raise KeyboardInterrupt()  # Not a sqlite3.Error, so the writer thread stops.
+        sink._write = fail
+        thread_excepthook, threading.excepthook = threading.excepthook, lambda args: None
+        try:
+            sink.write_reply(ModeSReply.from_message(IDENT))
+            sink._thread.join()
+        finally:
+            threading.excepthook = thread_excepthook
+        for _ in range(10):
+            sink.write_reply(ModeSReply.from_message(IDENT))
+        sink.close()  # Mustn't wait for room in the full queue.
+        self.assertEqual(6, sink.dropped)
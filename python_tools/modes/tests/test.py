@@ -32,6 +32,18 @@ class TestModeSReply(unittest.TestCase):
         self.assertEqual(Bits('0xffffff'), reply.icao)
         self.assertEqual(Bits('0xffffffff'), reply.data)
 
+    def test_instance_from_frame(self):
+        reply = ModeSReply.from_frame(bytes.fromhex('8d4840d6202cc371c32ce0576098'), 1.0)
+        self.assertEqual(1.0, reply.timestamp)
+        self.assertEqual(Bits('0x4840d6'), reply.icao)
+        self.assertEqual(Bits('0x8d4840d6202cc371c32ce0'), reply.data)
+        self.assertIsNone(ModeSReply.from_frame(bytes.fromhex('8d4840d6202cc371c32ce0576099')))
+
+    def test_address_parity_frame_needs_known_aircraft(self):
+        frame = bytes.fromhex('2000183859c38d')  # Address 4840d6
+        self.assertIsNone(ModeSReply.from_frame(frame))
+        self.assertEqual(Bits('0x4840d6'), ModeSReply.from_frame(frame, known={0x4840d6}).icao)
+
     def test_5bit_downlink_format(self):
         # formats 0 to 23
         data = Bits('0b00001') + Bits(length=(83 - 5))
@@ -0,0 +1,124 @@
+import io
+import math
+import unittest
+import numpy
+from bitstring import Bits
+import adsblib
+import simulator
+from aircraft import AircraftRegistry
+from modes import ModeSReply, SAMPLE_RATE
+from tracking import FleetTracker, MPS_PER_KNOT
+
+
+def es_reply(icao, me, t):
+    return ModeSReply(timestamp=t * SAMPLE_RATE, icao=Bits(uint=icao, length=24),
+                      data=Bits(uint=(0x8d << 80) | (icao << 56) | me, length=88))
+
+
+class TestFleetTracker(unittest.TestCase):
+
+    def test_predict_extrapolates_and_grows_uncertainty(self):
+        tracker = FleetTracker(capacity=2)
+        tracker.update_position(1, 0.0, 51.0, 0.0, 10000)
+        tracker.update_velocity(1, 0.0, 0.0, 360.0, 600.0)
+        spread = tracker.P[0, 0, 0]
+        self.assertEqual([], tracker.predict(10.0))
+        state = tracker.state(1)
+        # 360 kt north for 10 s is 1 NM, one minute of latitude.
+        self.assertAlmostEqual(51.0 + 1.0 / 60.0, state['lat'], 3)
+        self.assertAlmostEqual(10100.0, state['alt'], -1)
+        self.assertGreater(tracker.P[0, 0, 0], spread)
+
+    def test_predict_matches_single_track_prediction(self):
+        tracker = FleetTracker(capacity=1)
+        for icao in range(5):  # Grows the arrays
+            tracker.update_position(icao, float(icao), 51.0 + icao, 0.0, 10000)
+            tracker.update_velocity(icao, float(icao), 100.0 * icao, -50.0, 0.0)
+        x, P = tracker.x.copy(), tracker.P.copy()
+        tracker.predict(20.0)
+        for slot in range(5):
+            single = FleetTracker(capacity=1)
+            single.x[0], single.P[0], single.time[0] = x[slot], P[slot], float(slot)
+            single._predict_one(0, 20.0)
+            numpy.testing.assert_allclose(single.x[0], tracker.x[slot])
+            numpy.testing.assert_allclose(single.P[0], tracker.P[slot], rtol=1e-9, atol=1e-9)
+
+    def test_coasting_tracks_are_dropped(self):
+        tracker = FleetTracker(max_coast=60.0)
+        tracker.update_position(1, 0.0, 51.0, 0.0, 10000)
+        tracker.update_position(2, 30.0, 52.0, 0.0, 10000)
+        self.assertEqual([1], tracker.predict(70.0))
+        self.assertNotIn(1, tracker)
+        self.assertEqual(1, len(tracker))
+
+    def test_update_converges_on_a_moving_aircraft(self):
+        tracker = FleetTracker()
+        rng = numpy.random.RandomState(1)
+        vel_north = 400.0 * MPS_PER_KNOT
+        for n in range(60):
+            t = n * 0.5
+            north = vel_north * t + rng.normal(0, 25.0)
+            tracker.update_position(1, t, 51.0 + math.degrees(north / 6371000.0), 0.0, 20000)
+        state = tracker.state(1)
+        self.assertAlmostEqual(400.0, state['vel_north'], delta=10.0)
+        self.assertAlmostEqual(0.0, state['vel_east'], delta=10.0)
+        self.assertAlmostEqual(51.0 + math.degrees(vel_north * 29.5 / 6371000.0), state['lat'], 3)
+
+    def test_outliers_are_gated_then_restart_the_track(self):
+        tracker = FleetTracker(max_rejects=3)
+        tracker.update_position(1, 0.0, 51.0, 0.0, 10000)
+        tracker.update_position(1, 1.0, 51.0, 0.0, 10000)
+        for n in range(2):
+            tracker.update_position(1, 2.0 + n, 52.0, 0.0, 10000)
+            self.assertAlmostEqual(51.0, tracker.state(1)['lat'], 3)
+        tracker.update_position(1, 4.0, 52.0, 0.0, 10000)
+        self.assertAlmostEqual(52.0, tracker.state(1)['lat'], 6)
+
+
+class TestRegistryListener(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = AircraftRegistry()
+        self.tracker = FleetTracker()
+        self.registry.add_listener(self.tracker)
+        self.registry.push_modes_reply(es_reply(1, adsblib.encode_apos(51.0, 0.0, 10000, False), 0.0))
+        self.registry.push_modes_reply(es_reply(1, adsblib.encode_apos(51.0, 0.0, 10000, True), 0.5))
+
+    def test_repeated_reports_are_all_applied(self):
+        self.assertEqual(1, self.tracker.position_updates)
+        for n in range(4):
+            self.registry.push_modes_reply(es_reply(1, adsblib.encode_apos(51.0, 0.0, 10000, n % 2 == 0), 1.0 + n))
+        self.assertEqual(5, self.tracker.position_updates)
+        for n in range(5):
+            self.registry.push_modes_reply(es_reply(1, adsblib.encode_avel(0.0, 300.0, 0.0), 5.0 + n))
+        self.assertEqual(5, self.tracker.velocity_updates)
+
+    def test_vertical_rate_alone_does_not_refeed_the_velocity(self):
+        self.registry.push_modes_reply(es_reply(1, adsblib.encode_avel(0.0, 300.0, 0.0), 1.0))
+        # An airspeed velocity message only gives the vertical rate.
+        airspeed = (19 << 51) | (3 << 48) | (1 << 20) | (1 << 19) | (11 << 10)
+        self.assertEqual({'Vertical Rate (ft/min)', 'Airspeed Type', 'Intent Change', 'Vertical Rate Source'},
+                         set(adsblib.decode(airspeed).params) - {'Heading', 'Airspeed'})
+        calls = []
+        self.tracker.update_velocity = lambda *args: calls.append(args)
+        self.registry.push_modes_reply(es_reply(1, airspeed, 2.0))
+        self.assertEqual([(1, 2.0, None, None, -640.0)], calls)
+
+    def test_tracks_simulated_traffic(self):
+        registry = AircraftRegistry()
+        tracker = FleetTracker()
+        registry.add_listener(tracker)
+        truth = io.StringIO()
+        for line in simulator.TrafficSimulator(10, 200.0, seed=3).lines(60.0, truth):
+            registry.push_modes_reply(ModeSReply.from_message(line.strip()))
+        last = {}
+        for row in truth.getvalue().splitlines():
+            fields = row.split(',')
+            last[int(fields[1], 16)] = [float(value) for value in fields[2:8]]
+        for icao, (lat, lon, alt, vel_east, vel_north, vert_rate) in last.items():
+            state = tracker.state(icao)
+            error = math.hypot((state['lat'] - lat) * 111195.0,
+                               (state['lon'] - lon) * 111195.0 * math.cos(math.radians(lat)))
+            self.assertLess(error, 100.0)
+            self.assertAlmostEqual(vel_east, state['vel_east'], delta=10.0)
+            self.assertAlmostEqual(vel_north, state['vel_north'], delta=10.0)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# Run several consumers over one decode of the input, instead of running dump_adsb.py, db_adsb.py etc. over the
+# same input separately. Each line is decoded once (see modes/pipeline.py) and the replies are handed to each
+# consumer selected:
+#   -d               dump the decoded replies as dump_adsb.py does
+#   -i INTERVAL      print JSON delta snapshots of the aircraft state as db_adsb.py -i does
+#   --db FILE        write the replies and aircraft state to a SQLite database as db_adsb.py --db does
+#   --http PORT      serve the aircraft state as JSON over HTTP (see json_api.py)
+#   --http-host HOST the address to serve it on (default localhost only)
+#   -f DF[,DF...]    only dump replies with these downlink formats
+# E.g.
+# >>$ receiver/receiver | python_tools/monitor.py -i 1 --db adsb.sqlite -
+#
+# On a live stream a consumer which falls behind drops replies rather than holding up the others. Reading
+# from files nothing is dropped. The number of replies handled and dropped by each consumer is reported at EOF.
+# Snapshots and the HTTP API's ticks run on a timer, so they carry on while the input is quiet.
+
+import argparse
+import fileinput
+import sys
+import threading
+
+import aircraft
+import dump_adsb
+import json_api
+import snapshot
+import sqlite_sink
+from modes.commb import CommBDecoder
+from modes.pipeline import BLOCK, DROP_NEWEST, Pipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dump, track and store replies from a single decode pass.')
+    parser.add_argument('-d', '--dump', action='store_true', help='dump the decoded replies')
+    parser.add_argument('-f', '--formats', help='comma separated downlink formats to dump (default all)')
+    parser.add_argument('-i', '--interval', type=float, help='print delta snapshots every INTERVAL seconds')
+    parser.add_argument('-k', '--keyframe', type=float, default=60.0, help='seconds between full keyframes')
+    parser.add_argument('--db', metavar='FILE', help='write the replies and aircraft state to SQLite database FILE')
+    parser.add_argument('--http', type=int, metavar='PORT', help='serve the aircraft state as JSON on PORT')
+    parser.add_argument('--http-host', default='127.0.0.1', metavar='HOST',
+                        help='address to serve --http on (default 127.0.0.1, 0.0.0.0 for every interface)')
+    parser.add_argument('-q', '--queue', type=int, default=10000, help='maximum replies queued for each consumer')
+    parser.add_argument('files', nargs='*')
+    args = parser.parse_args()
+
+    # Live input can't wait for a slow consumer but there's no need to lose replies when reading files.
+    live = not args.files or '-' in args.files
+    policy = DROP_NEWEST if live else BLOCK
+    pipeline = Pipeline()
+    output_lock = threading.Lock()
+
+    def write(text):
+        with output_lock:
+            sys.stdout.write(text + '\n')
+            sys.stdout.flush()
+
+    if args.dump:
+        commb_decoder = CommBDecoder()
+
+        def dump(reply):
+            write('\n'.join(dump_adsb.format_reply(reply, commb_decoder)))
+        formats = [int(df) for df in args.formats.split(',')] if args.formats else None
+        pipeline.subscribe(dump, formats=formats, maxsize=args.queue, policy=policy, name='dump')
+
+    registry = emitter = sink = api = ticker = None
+    if args.interval or args.db or args.http:
+        # The registry and everything listening to it are updated by the one subscriber thread, and polled by a
+        # ticker holding the same lock.
+        registry = aircraft.AircraftRegistry()
+        if args.interval:
+            emitter = snapshot.SnapshotEmitter(registry, write, args.interval, args.keyframe)
+        if args.db:
+            sink = sqlite_sink.SqliteSink(args.db)
+            registry.add_listener(sink)
+        if args.http:
+            api = json_api.ApiServer(registry, args.http_host, args.http)
+
+        def housekeeping():
+            if emitter:
+                emitter.poll()
+            if api:
+                api.poll()
+
+        lock = threading.Lock()
+
+        def track(reply):
+            with lock:
+                registry.push_modes_reply(reply)
+            if sink:
+                sink.write_reply(reply)
+        pipeline.subscribe(track, maxsize=args.queue, policy=policy, name='aircraft')
+        if emitter or api:
+            ticker = snapshot.Ticker(housekeeping, lock)
+
+    if not pipeline.subscriptions:
+        parser.error('nothing to do: give at least one of -d, -i, --db and --http')
+
+    pipeline.feed(fileinput.input(args.files))
+    pipeline.close()
+    if ticker:
+        ticker.close()
+    if emitter:
+        emitter.tick()
+    if sink:
+        sink.close()
+        if sink.error:
+            print('Database error: {0}'.format(sink.error), file=sys.stderr)
+    if api:
+        api.tick()
+        print('HTTP API: {0} requests ({1} not modified), {2} aircraft serializations'.format(
+            api.requests, api.not_modified, api.serializations), file=sys.stderr)
+        api.close()
+    print(pipeline.report(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -8,7 +8,7 @@ setup(
     license='MIT License',
     author='td',
     description='SSR Mode-S decoding tools',
-    install_requires=['bitstring'],
+    install_requires=['bitstring', 'numpy'],
     packages=['modes'],
     tests_require=['nose'],
     test_suite='nose.collector'
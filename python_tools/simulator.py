@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# A kinematic ADS-B traffic simulator.
+#
+# Synthetic aircraft fly straight and level, climb, descend and turn around a centre point. Each one broadcasts
+# airborne position, velocity, identification and status extended squitters, and the output is written in the
+# format produced by receiver.c with the message rates scaled to give the requested aggregate rate. This gives
+# soak tests of the tracking code a high, known message rate and a ground truth to compare against. E.g.
+# >>$ python_tools/simulator.py -n 2000 -r 10000 -d 60 --truth truth.csv | python_tools/db_adsb.py -i 1 -
+#
+# The ground truth (written with --truth) is a CSV line per position message: time (samples), ICAO No.,
+# latitude, longitude, altitude (ft), east and north velocity (kt) and vertical rate (ft/min).
+
+import argparse
+import heapq
+import math
+import random
+import sys
+import time
+
+import adsblib
+from modes import SAMPLE_RATE
+from modes.crc import append_parity
+from modes.downlink_fields import encode_id13
+
+
+# Relative broadcast rates of each message type (per second, per aircraft) as required by DO-260
+MESSAGE_RATES = (
+    ('position', 2.0),
+    ('velocity', 2.0),
+    ('ident', 0.2),
+    ('status', 0.2),
+)
+
+
+def frame_df17(icao, me, ca=5):
+    """Frame an ME field as a DF17 extended squitter from icao. Returns the 112 bit reply (including parity) as an int."""
+    return append_parity((17 << 83) | (ca << 80) | (icao << 56) | me, 88)
+
+
+def receiver_line(timestamp, icao, frame):
+    """Format a 112 bit reply as a line of receiver.c output. The receiver doesn't print the parity."""
+    return '{0:014d}.00: 0x{1:06x}, 0x{2:022x};\n'.format(int(timestamp), icao, frame >> 24)
+
+
+class SimulatedAircraft:
+    """The kinematic state of one synthetic aircraft. Speeds are in knots, rates in ft/min and deg/s."""
+
+    def __init__(self, icao, ident, squawk, lat, lon, alt, speed, track, vert_rate=0.0, turn_rate=0.0):
+        self.icao = icao
+        self.ident = ident
+        self.squawk = squawk
+        self.lat = lat
+        self.lon = lon
+        self.alt = alt
+        self.speed = speed
+        self.track = track
+        self.vert_rate = vert_rate
+        self.turn_rate = turn_rate
+        self.time = 0.0
+        self.odd = False
+
+    @property
+    def velocity(self):
+        """(east, north) velocity in knots"""
+        return (self.speed * math.sin(math.radians(self.track)),
+                self.speed * math.cos(math.radians(self.track)))
+
+    def advance(self, t):
+        """Fly the aircraft forward to time t (seconds) using a flat earth approximation."""
+        dt = t - self.time
+        if dt <= 0.0:
+            return
+        vel_east, vel_north = self.velocity
+        self.lat += vel_north * dt / 3600.0 / 60.0  # One minute of latitude is one nautical mile.
+        self.lon += vel_east * dt / 3600.0 / 60.0 / max(math.cos(math.radians(self.lat)), 0.01)
+        self.lon = (self.lon + 180.0) % 360.0 - 180.0
+        self.alt = min(max(self.alt + self.vert_rate * dt / 60.0, 500.0), 45000.0)
+        if self.alt in (500.0, 45000.0):
+            self.vert_rate = 0.0
+        self.track = (self.track + self.turn_rate * dt) % 360.0
+        self.time = t
+
+    def manoeuvre(self, rng):
+        """Randomly pick a new vertical rate and turn rate."""
+        self.vert_rate = rng.choice((0.0, 0.0, 0.0, 1500.0, -1500.0, 3000.0, -2000.0))
+        self.turn_rate = rng.choice((0.0, 0.0, 0.0, 1.5, -1.5, 3.0, -3.0))
+
+    def message(self, kind):
+        """Encode the ME field of a message of the given kind from the current state."""
+        if kind == 'position':
+            self.odd = not self.odd
+            return adsblib.encode_apos(self.lat, self.lon, self.alt, self.odd)
+        elif kind == 'velocity':
+            vel_east, vel_north = self.velocity
+            return adsblib.encode_avel(vel_east, vel_north, self.vert_rate)
+        elif kind == 'ident':
+            return adsblib.encode_ident(self.ident, category=3)
+        elif kind == 'status':
+            return adsblib.encode_astatus(encode_id13(self.squawk))
+        raise ValueError('Unknown message kind {0}'.format(kind))
+
+
+class TrafficSimulator:
+    """Fly n_aircraft synthetic aircraft within radius NM of centre, emitting rate messages per second in total."""
+
+    def __init__(self, n_aircraft, rate, centre=(51.5, -0.5), radius=150.0, manoeuvre_interval=60.0, seed=None):
+        self.rng = random.Random(seed)
+        self.rate = rate
+        self.manoeuvre_interval = manoeuvre_interval
+        self.aircraft = []
+
+        icaos = self.rng.sample(range(0x000001, 0xfffffe), n_aircraft)
+        for icao in icaos:
+            distance = radius * math.sqrt(self.rng.random()) / 60.0
+            bearing = self.rng.uniform(0.0, 2.0 * math.pi)
+            lat = centre[0] + distance * math.cos(bearing)
+            lon = centre[1] + distance * math.sin(bearing) / math.cos(math.radians(centre[0]))
+            ident = ''.join(self.rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(3)) + \
+                    str(self.rng.randint(1, 9999))
+            squawk = int(''.join(str(self.rng.randint(0, 7)) for _ in range(4)))
+            inst = SimulatedAircraft(icao, ident, squawk, lat, lon,
+                                     alt=self.rng.uniform(2000.0, 41000.0), speed=self.rng.uniform(150.0, 500.0),
+                                     track=self.rng.uniform(0.0, 360.0))
+            inst.manoeuvre(self.rng)
+            self.aircraft.append(inst)
+
+        # Scale the nominal message rates so that the total comes to the requested rate.
+        nominal = sum(r for _, r in MESSAGE_RATES) * n_aircraft
+        self.periods = dict((kind, nominal / (r * rate)) for kind, r in MESSAGE_RATES)
+
+    def messages(self, duration):
+        """Yield (time, aircraft, kind, frame) tuples for duration seconds of traffic in time order."""
+        queue = []
+        for n, inst in enumerate(self.aircraft):
+            for kind, period in self.periods.items():
+                queue.append((self.rng.uniform(0.0, period), n, kind))
+            queue.append((self.rng.uniform(0.0, self.manoeuvre_interval), n, 'manoeuvre'))
+        heapq.heapify(queue)
+
+        while queue and queue[0][0] < duration:
+            t, n, kind = heapq.heappop(queue)
+            inst = self.aircraft[n]
+            inst.advance(t)
+            if kind == 'manoeuvre':
+                inst.manoeuvre(self.rng)
+                heapq.heappush(queue, (t + self.rng.expovariate(1.0 / self.manoeuvre_interval), n, kind))
+                continue
+            # Jitter the periods a little as real transponders do.
+            period = self.periods[kind]
+            heapq.heappush(queue, (t + self.rng.uniform(0.9 * period, 1.1 * period), n, kind))
+            yield t, inst, kind, frame_df17(inst.icao, inst.message(kind))
+
+    def lines(self, duration, truth=None, start=0):
+        """Yield receiver.c format lines for duration seconds of traffic, timestamped from start (samples).
+
+        If truth is a file object the true state is written to it for every position message.
+        """
+        for t, inst, kind, frame in self.messages(duration):
+            timestamp = start + int(t * SAMPLE_RATE)
+            if truth is not None and kind == 'position':
+                vel_east, vel_north = inst.velocity
+                truth.write('{0},{1:06x},{2:.6f},{3:.6f},{4:.0f},{5:.1f},{6:.1f},{7:.0f}\n'.format(
+                    timestamp, inst.icao, inst.lat, inst.lon, inst.alt, vel_east, vel_north, inst.vert_rate))
+            yield receiver_line(timestamp, inst.icao, frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate ADS-B traffic in receiver.c output format.')
+    parser.add_argument('-n', '--aircraft', type=int, default=1000, help='number of aircraft')
+    parser.add_argument('-r', '--rate', type=float, default=5000.0, help='aggregate message rate (msgs/s)')
+    parser.add_argument('-d', '--duration', type=float, default=60.0, help='seconds of traffic to generate')
+    parser.add_argument('-c', '--centre', type=float, nargs=2, default=(51.5, -0.5), metavar=('LAT', 'LON'))
+    parser.add_argument('--radius', type=float, default=150.0, help='radius of the traffic area (NM)')
+    parser.add_argument('--realtime', action='store_true', help='write the messages at their real rate')
+    parser.add_argument('--seed', type=int, help='random seed')
+    parser.add_argument('--truth', metavar='FILE', help='write the ground truth of each position message to FILE')
+    args = parser.parse_args()
+
+    sim = TrafficSimulator(args.aircraft, args.rate, args.centre, args.radius, seed=args.seed)
+    truth = open(args.truth, 'w') if args.truth else None
+    start = time.time()
+    try:
+        for line in sim.lines(args.duration, truth):
+            if args.realtime:
+                delay = start + float(line.partition(':')[0]) / SAMPLE_RATE - time.time()
+                if delay > 0.001:
+                    sys.stdout.flush()
+                    time.sleep(delay)
+            sys.stdout.write(line)
+    finally:
+        if truth:
+            truth.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Incremental snapshots of the aircraft registry.
+#
+# A SnapshotEmitter periodically serializes the changes made to an aircraft.AircraftRegistry since
+# its previous tick: only the parameters that changed and the ICAO numbers of aircraft that were
+# removed. Every so often it emits a keyframe holding the full state so that late joining consumers
+# (and ones which missed a delta) can resynchronise. Snapshots are compact JSON objects:
+#
+#   {"seq": 12, "time": 1381234567.5, "keyframe": false,
+#    "removed": ["40621d"], "aircraft": {"4840d6": {"Altitude (ft)": 38000.0}}}
+#
+# Consumers should apply the removals before the aircraft updates.
+#
+# A Ticker calls poll() (and anything else periodic) from a background thread, so that snapshots keep
+# coming while the input is quiet.
+
+import json
+import threading
+import time
+
+
+class ChangeTracker:
+    """Registry listener which accumulates the changed parameters and removals since the last take()."""
+
+    def __init__(self):
+        self._dirty = {}
+        self._removed = set()
+
+    def aircraft_updated(self, aircraft, changed):
+        if changed:
+            self._dirty.setdefault(aircraft.icao, set()).update(changed)
+
+    def aircraft_removed(self, aircraft):
+        self._dirty.pop(aircraft.icao, None)
+        self._removed.add(aircraft.icao)
+
+    def take(self):
+        """Return (dirty, removed) and start afresh. dirty maps ICAO No. -> set of parameter names."""
+        dirty, removed = self._dirty, self._removed
+        self._dirty, self._removed = {}, set()
+        return dirty, removed
+
+
+class SnapshotEmitter:
+    """Emit delta snapshots of a registry every interval seconds and a keyframe every keyframe_interval seconds.
+
+    write is called with each serialized snapshot (a str without a trailing newline).
+    """
+
+    def __init__(self, registry, write, interval=1.0, keyframe_interval=60.0):
+        self.registry = registry
+        self.write = write
+        self.interval = interval
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self._last_tick = None
+        self._last_keyframe = None
+        self._tracker = ChangeTracker()
+        registry.add_listener(self._tracker)
+
+    def close(self):
+        self.registry.remove_listener(self._tracker)
+
+    def poll(self, now=None):
+        """Tick if interval has elapsed since the last tick. Returns the snapshot or None."""
+        if now is None:
+            now = time.time()
+        if self._last_tick is None or now - self._last_tick >= self.interval:
+            return self.tick(now)
+        return None
+
+    def tick(self, now=None, keyframe=None):
+        if now is None:
+            now = time.time()
+        if keyframe is None:
+            keyframe = self._last_keyframe is None or now - self._last_keyframe >= self.keyframe_interval
+
+        dirty, removed = self._tracker.take()
+        if keyframe:
+            snapshot = self.keyframe(now)
+            self._last_keyframe = now
+        else:
+            aircraft = {}
+            for icao, keys in dirty.items():
+                params = self.registry[icao].parameters
+                aircraft['{0:06x}'.format(icao)] = {key: params[key] for key in keys}
+            snapshot = {
+                'seq': self.seq,
+                'time': now,
+                'keyframe': False,
+                'removed': ['{0:06x}'.format(icao) for icao in sorted(removed)],
+                'aircraft': aircraft,
+            }
+
+        self.seq += 1
+        self._last_tick = now
+        self.write(json.dumps(snapshot, separators=(',', ':')))
+        return snapshot
+
+    def keyframe(self, now):
+        return {
+            'seq': self.seq,
+            'time': now,
+            'keyframe': True,
+            'removed': [],
+            'aircraft': {'{0:06x}'.format(inst.icao): dict(inst.parameters) for inst in self.registry},
+        }
+
+
+class Ticker:
+    """Call function every period seconds from a background thread, holding lock while it runs.
+
+    A registry must only be used by one thread at a time, so the thread that updates it has to hold the
+    same lock while it does.
+    """
+
+    def __init__(self, function, lock, period=0.25):
+        self.function = function
+        self.lock = lock
+        self.period = period
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='ticker')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.period):
+            with self.lock:
+                self.function()
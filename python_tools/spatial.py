@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# A spatial index over aircraft positions.
+#
+# Positions are bucketed into a uniform latitude/longitude grid so that radius, bounding box and
+# nearest neighbour queries only need to look at the aircraft in nearby cells. The index can be
+# attached to an aircraft.AircraftRegistry as a listener so that it follows position updates.
+
+import math
+
+
+EARTH_RADIUS_NM = 3440.065
+# Half of the Earth's circumference. No two points are further apart than this.
+MAX_DISTANCE_NM = math.pi * EARTH_RADIUS_NM
+
+
+def distance_nm(lat1, lon1, lat2, lon2):
+    """Great circle distance in nautical miles between two points (haversine formula)."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_NM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def lon_in_range(lon, west, east):
+    """Test whether lon falls within [west, east], allowing the range to cross the antimeridian."""
+    if west <= east:
+        return west <= lon <= east
+    return lon >= west or lon <= east
+
+
+class GridIndex:
+    """A uniform lat/lon grid of ICAO numbers. cell_size is in degrees."""
+
+    def __init__(self, cell_size=0.5):
+        self.cell_size = float(cell_size)
+        self._n_rows = int(math.ceil(180.0 / self.cell_size))
+        self._n_cols = int(math.ceil(360.0 / self.cell_size))
+        self._cells = {}
+        self._positions = {}  # ICAO No. -> (lat, lon, cell)
+
+    def _row(self, lat):
+        return min(max(int((lat + 90.0) // self.cell_size), 0), self._n_rows - 1)
+
+    def _col(self, lon):
+        return int(((lon + 180.0) % 360.0) // self.cell_size) % self._n_cols
+
+    def update(self, icao, lat, lon):
+        """Insert or move an aircraft."""
+        cell = (self._row(lat), self._col(lon))
+        old = self._positions.get(icao)
+        if old is not None and old[2] != cell:
+            self._discard(icao, old[2])
+        if old is None or old[2] != cell:
+            self._cells.setdefault(cell, set()).add(icao)
+        self._positions[icao] = (lat, lon, cell)
+
+    def remove(self, icao):
+        old = self._positions.pop(icao, None)
+        if old is not None:
+            self._discard(icao, old[2])
+
+    def _discard(self, icao, cell):
+        members = self._cells[cell]
+        members.discard(icao)
+        if not members:
+            del self._cells[cell]
+
+    def position(self, icao):
+        lat, lon, _ = self._positions[icao]
+        return lat, lon
+
+    def __contains__(self, icao):
+        return icao in self._positions
+
+    def __len__(self):
+        return len(self._positions)
+
+    def _candidates(self, south, west, north, east):
+        """Yield the ICAO numbers in all cells overlapping a box. West may be greater than east."""
+        rows = range(self._row(south), self._row(north) + 1)
+        if west <= east and east - west >= 360.0:
+            cols = range(self._n_cols)
+        else:
+            first = self._col(west)
+            n_cols = (self._col(east) - first) % self._n_cols + 1
+            if west > east and n_cols == 1:
+                n_cols = self._n_cols  # The box wraps all the way round within a single column.
+            cols = [(first + c) % self._n_cols for c in range(n_cols)]
+
+        if len(rows) * len(cols) > len(self._cells):
+            # Cheaper to walk the occupied cells than to probe every cell in the box.
+            row_set, col_set = set(rows), set(cols)
+            for (row, col), members in self._cells.items():
+                if row in row_set and col in col_set:
+                    yield from members
+        else:
+            for row in rows:
+                for col in cols:
+                    members = self._cells.get((row, col))
+                    if members:
+                        yield from members
+
+    def within_box(self, south, west, north, east):
+        """Return the ICAO numbers of the aircraft inside a bounding box.
+
+        If west > east the box is taken to cross the antimeridian.
+        """
+        result = []
+        for icao in self._candidates(south, west, north, east):
+            lat, lon, _ = self._positions[icao]
+            if south <= lat <= north and lon_in_range(lon, west, east):
+                result.append(icao)
+        return result
+
+    def within_radius(self, lat, lon, radius_nm):
+        """Return (distance, ICAO No.) pairs for aircraft within radius_nm of a point, nearest first."""
+        dlat = radius_nm / 60.0  # One minute of latitude is one nautical mile.
+        south, north = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+        max_lat = max(abs(south), abs(north))
+        if max_lat >= 90.0 or dlat >= 90.0:
+            west, east = -180.0, 180.0
+        else:
+            dlon = dlat / math.cos(math.radians(max_lat))
+            if dlon >= 180.0:
+                west, east = -180.0, 180.0
+            else:
+                west = (lon - dlon + 180.0) % 360.0 - 180.0
+                east = (lon + dlon + 180.0) % 360.0 - 180.0
+
+        result = []
+        for icao in self._candidates(south, west, north, east):
+            plat, plon, _ = self._positions[icao]
+            d = distance_nm(lat, lon, plat, plon)
+            if d <= radius_nm:
+                result.append((d, icao))
+        result.sort()
+        return result
+
+    def nearest(self, lat, lon, k=1):
+        """Return the k nearest aircraft to a point as (distance, ICAO No.) pairs, nearest first."""
+        radius = self.cell_size * 60.0
+        while True:
+            found = self.within_radius(lat, lon, radius)
+            # Everything within radius has been found, so if there are k of them they're the nearest.
+            if len(found) >= k or radius >= MAX_DISTANCE_NM:
+                return found[:k]
+            radius *= 2.0
+
+    # Listener interface for aircraft.AircraftRegistry
+    def aircraft_updated(self, aircraft, changed):
+        if 'Latitude' in changed or 'Longitude' in changed:
+            lat, lon = aircraft.position
+            self.update(aircraft.icao, lat, lon)
+
+    def aircraft_removed(self, aircraft):
+        self.remove(aircraft.icao)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# A SQLite sink for decoded replies and aircraft state.
+#
+# Rows are handed to a background writer thread through a bounded queue, so the decode loop never waits for
+# the disk: when the queue is full rows are dropped and counted instead. The writer inserts whatever has
+# queued up (up to batch_size rows) with executemany() in a single transaction. The database is run in WAL
+# mode so that readers can query it while it is being written. If a transaction fails (e.g. the disk is full) its
+# rows are counted as dropped, the error is kept in error and the writer carries on with the next batch.
+#
+# Two tables are written:
+#   replies  - one row per reply: sample timestamp, receive time, ICAO No., downlink format, ADS-B type and data
+#   aircraft - the latest state of each aircraft, upserted as the aircraft are updated
+#
+# The sink can be attached to an aircraft.AircraftRegistry as a listener to follow the aircraft state.
+
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+from aircraft import icao_number
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS replies (
+    id INTEGER PRIMARY KEY,
+    timestamp REAL,
+    received REAL NOT NULL,
+    icao INTEGER NOT NULL,
+    df INTEGER NOT NULL,
+    type INTEGER,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS replies_icao_received ON replies (icao, received);
+CREATE TABLE IF NOT EXISTS aircraft (
+    icao INTEGER PRIMARY KEY,
+    last_seen REAL NOT NULL,
+    identification TEXT,
+    latitude REAL,
+    longitude REAL,
+    altitude REAL,
+    velocity_east REAL,
+    velocity_north REAL,
+    vertical_rate REAL,
+    parameters TEXT
+);
+'''
+
+INSERT_REPLY = 'INSERT INTO replies (timestamp, received, icao, df, type, data) VALUES (?, ?, ?, ?, ?, ?)'
+
+# Columns which aren't present in the update keep their previous value.
+UPSERT_AIRCRAFT = '''
+INSERT INTO aircraft (icao, last_seen, identification, latitude, longitude, altitude, velocity_east, velocity_north,
+                      vertical_rate, parameters)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (icao) DO UPDATE SET
+    last_seen = excluded.last_seen,
+    identification = coalesce(excluded.identification, identification),
+    latitude = coalesce(excluded.latitude, latitude),
+    longitude = coalesce(excluded.longitude, longitude),
+    altitude = coalesce(excluded.altitude, altitude),
+    velocity_east = coalesce(excluded.velocity_east, velocity_east),
+    velocity_north = coalesce(excluded.velocity_north, velocity_north),
+    vertical_rate = coalesce(excluded.vertical_rate, vertical_rate),
+    parameters = excluded.parameters
+'''
+
+# Aircraft parameters stored in their own columns
+AIRCRAFT_COLUMNS = ('Identification', 'Latitude', 'Longitude', 'Altitude (ft)', 'Velocity East (kt)',
+                    'Velocity North (kt)', 'Vertical Rate (ft/min)')
+
+
+class SqliteSink:
+    """Write replies and aircraft state to the SQLite database at path from a background thread.
+
+    At most maxsize rows are queued; beyond that rows are dropped and counted in queue_full. The writer commits
+    a transaction of at most batch_size rows at a time. The rows of a transaction which fails are counted in
+    failed and the last error is kept in error. dropped is the total of both.
+    """
+
+    def __init__(self, path, maxsize=100000, batch_size=5000):
+        self.path = path
+        self.batch_size = batch_size
+        self.written = 0
+        self.queue_full = 0  # Only counted by the caller's thread
+        self.failed = 0  # Only counted by the writer thread
+        self.transactions = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize)
+
+        # Create the schema here so that errors are raised in the caller's thread.
+        db = sqlite3.connect(path)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript(SCHEMA)
+        db.close()
+
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _offer(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.queue_full += 1
+
+    def write_reply(self, reply, received=None):
+        """Queue a reply (a modes.ModeSReply) for writing. received defaults to the current time."""
+        message = reply.message
+        self._offer((False, (reply.timestamp, received if received is not None else time.time(),
+                             icao_number(reply.icao), reply.format, message.type if message else None,
+                             reply.data.hex)))
+
+    def write_aircraft(self, aircraft, last_seen=None):
+        """Queue an update of the latest state of aircraft (an aircraft.Aircraft).
+
+        last_seen defaults to the aircraft's last update.
+        """
+        params = aircraft.parameters
+        row = ((aircraft.icao, last_seen if last_seen is not None else aircraft.lastupdate) +
+               tuple(params.get(key) for key in AIRCRAFT_COLUMNS) +
+               (json.dumps(params, default=str),))
+        self._offer((True, row))
+
+    @property
+    def dropped(self):
+        return self.queue_full + self.failed
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def close(self):
+        """Write everything queued and stop the writer thread."""
+        while self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass  # The writer is still draining the queue, unless it has died.
+        self._thread.join()
+
+    def _run(self):
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA journal_mode=WAL')
+        # Durable enough with WAL (a power cut loses at most the last transactions) and much faster
+        db.execute('PRAGMA synchronous=NORMAL')
+        try:
+            while True:
+                items = [self._queue.get()]
+                try:
+                    while len(items) < self.batch_size:
+                        items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                done = items[-1] is None
+                if done:
+                    items.pop()
+                if items:
+                    try:
+                        self._write(db, items)
+                    except sqlite3.Error as error:
+                        self.error = error
+                        self.failed += len(items)
+                if done:
+                    return
+        finally:
+            db.close()
+
+    def _write(self, db, items):
+        replies = []
+        aircraft = {}  # Only the latest update of each aircraft in the batch is needed.
+        for is_aircraft, row in items:
+            if is_aircraft:
+                aircraft[row[0]] = row
+            else:
+                replies.append(row)
+        with db:
+            if replies:
+                db.executemany(INSERT_REPLY, replies)
+            if aircraft:
+                db.executemany(UPSERT_AIRCRAFT, list(aircraft.values()))
+        self.written += len(items)
+        self.transactions += 1
+
+    # Listener interface for aircraft.AircraftRegistry
+    def aircraft_updated(self, aircraft, changed):
+        if changed:
+            self.write_aircraft(aircraft)
+
+    def aircraft_removed(self, aircraft):
+        pass
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+# A Kalman filter tracker for a whole fleet of aircraft.
+#
+# Every track's state (east, north, up positions in metres and their velocities in m/s) and covariance are
+# rows of contiguous NumPy arrays, so the predict step for the whole fleet is a handful of array operations
+# rather than a Python loop per aircraft. Measurements (decoded positions with altitude, velocities with
+# vertical rate) update a single track as they arrive.
+#
+# Positions are kept in a local flat east/north/up frame around an origin of each track's own, which is moved
+# to follow the aircraft once it has flown far from it. Tracks coast on their predicted state through gaps in
+# reception and are dropped once they have coasted for longer than max_coast seconds.
+#
+# The tracker can be attached to an aircraft.AircraftRegistry as a listener so that it follows the decoded
+# positions and velocities. Every position and velocity message is a measurement, including ones which repeat
+# the last, so the listener works from the message of each reply rather than from the parameters that changed.
+
+import math
+
+import numpy
+
+
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_FOOT = 0.3048
+MPS_PER_KNOT = 1852.0 / 3600.0
+MPS_PER_FPM = METRES_PER_FOOT / 60.0
+
+# ADS-B type code of airborne velocity messages
+AIRBORNE_VELOCITY = 19
+
+# Indices of the state vector
+POSITION = numpy.array([0, 1, 2])
+VELOCITY = numpy.array([3, 4, 5])
+
+
+class FleetTracker:
+    """Track aircraft with a constant velocity Kalman filter, their states held in arrays indexed by slot.
+
+    The process noise is white acceleration with standard deviations accel (horizontal) and vert_accel
+    (vertical) in m/s^2. The measurement standard deviations are pos_noise (m), alt_noise (ft),
+    vel_noise (kt) and vert_rate_noise (ft/min). A position more than gate standard deviations from its
+    prediction is rejected; after max_rejects rejections in a row the track is restarted from the new position.
+    position_updates and velocity_updates count the measurements applied.
+    """
+
+    # Move a track's origin once it is this far (m) from the aircraft
+    REORIGIN_DISTANCE = 100000.0
+
+    def __init__(self, capacity=1024, accel=3.0, vert_accel=1.0, pos_noise=25.0, alt_noise=50.0, vel_noise=2.0,
+                 vert_rate_noise=64.0, max_coast=60.0, gate=5.0, max_rejects=3):
+        self.accel = accel
+        self.vert_accel = vert_accel
+        self.pos_noise = pos_noise
+        self.alt_noise = alt_noise * METRES_PER_FOOT
+        self.vel_noise = vel_noise * MPS_PER_KNOT
+        self.vert_rate_noise = vert_rate_noise * MPS_PER_FPM
+        self.max_coast = max_coast
+        self.gate = gate
+        self.max_rejects = max_rejects
+
+        # The white acceleration process noise over a time step dt is dt^3/3 q3 + dt^2/2 q2 + dt q1.
+        var = numpy.array([accel, accel, vert_accel]) ** 2
+        self._q3 = numpy.zeros((6, 6))
+        self._q2 = numpy.zeros((6, 6))
+        self._q1 = numpy.zeros((6, 6))
+        self._q3[POSITION, POSITION] = var
+        self._q2[POSITION, VELOCITY] = self._q2[VELOCITY, POSITION] = var
+        self._q1[VELOCITY, VELOCITY] = var
+
+        self.x = numpy.zeros((capacity, 6))
+        self.P = numpy.zeros((capacity, 6, 6))
+        self.time = numpy.zeros(capacity)  # Time of the state (s)
+        self.last_measured = numpy.zeros(capacity)
+        self.origin = numpy.zeros((capacity, 2))  # (lat, lon) in degrees
+        self.active = numpy.zeros(capacity, dtype=bool)
+        self.icaos = numpy.zeros(capacity, dtype=numpy.int64)
+        self.rejects = numpy.zeros(capacity, dtype=numpy.int32)
+        self.position_updates = 0
+        self.velocity_updates = 0
+        self._slots = {}  # ICAO No. -> slot
+        self._free = list(range(capacity - 1, -1, -1))
+
+    def __len__(self):
+        return len(self._slots)
+
+    def __contains__(self, icao):
+        return icao in self._slots
+
+    def _grow(self):
+        capacity = len(self.x)
+        for name in ('x', 'P', 'time', 'last_measured', 'origin', 'active', 'icaos', 'rejects'):
+            array = getattr(self, name)
+            grown = numpy.zeros((2 * capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:capacity] = array
+            setattr(self, name, grown)
+        self._free.extend(range(2 * capacity - 1, capacity - 1, -1))
+
+    def _allocate(self, icao):
+        if not self._free:
+            self._grow()
+        slot = self._free.pop()
+        self._slots[icao] = slot
+        self.active[slot] = True
+        self.icaos[slot] = icao
+        return slot
+
+    def remove(self, icao):
+        slot = self._slots.pop(icao)
+        self.active[slot] = False
+        self._free.append(slot)
+
+    def _predict_one(self, slot, now):
+        dt = now - self.time[slot]
+        if dt <= 0.0:
+            return
+        F = numpy.identity(6)
+        F[POSITION, VELOCITY] = dt
+        self.x[slot] = F.dot(self.x[slot])
+        self.P[slot] = F.dot(self.P[slot]).dot(F.T) + (dt * dt * dt / 3.0) * self._q3 + (dt * dt / 2.0) * self._q2 + \
+            dt * self._q1
+        self.time[slot] = now
+
+    def _predict_slots(self, slots, now):
+        dt = numpy.maximum(now - self.time[slots], 0.0)
+        x = self.x[slots]
+        P = self.P[slots]
+        x[:, POSITION] += x[:, VELOCITY] * dt[:, None]
+        # F P F^T for F = [[I, dt I], [0, I]] written out by blocks
+        pp, pv, vv = P[:, :3, :3], P[:, :3, 3:], P[:, 3:, 3:]
+        dt = dt[:, None, None]
+        new_pv = pv + dt * vv
+        new_pp = pp + dt * (pv + pv.transpose(0, 2, 1)) + dt * dt * vv
+        P = numpy.concatenate([numpy.concatenate([new_pp, new_pv], axis=2),
+                               numpy.concatenate([new_pv.transpose(0, 2, 1), vv], axis=2)], axis=1)
+        P += (dt * dt * dt / 3.0) * self._q3 + (dt * dt / 2.0) * self._q2 + dt * self._q1
+        self.x[slots] = x
+        self.P[slots] = P
+        self.time[slots] = numpy.maximum(self.time[slots], now)
+
+    def predict(self, now):
+        """Advance every track to time now (s) and drop those which have coasted for longer than max_coast.
+
+        Returns the ICAO numbers of the dropped tracks.
+        """
+        slots = numpy.flatnonzero(self.active)
+        stale = slots[now - self.last_measured[slots] > self.max_coast]
+        dropped = [int(icao) for icao in self.icaos[stale]]
+        for icao in dropped:
+            self.remove(icao)
+        slots = numpy.flatnonzero(self.active)
+        if len(slots):
+            self._predict_slots(slots, now)
+        return dropped
+
+    def _to_local(self, slot, lat, lon):
+        lat0, lon0 = self.origin[slot]
+        dlon = (lon - lon0 + 180.0) % 360.0 - 180.0
+        return (math.radians(dlon) * EARTH_RADIUS_M * math.cos(math.radians(lat0)),
+                math.radians(lat - lat0) * EARTH_RADIUS_M)
+
+    def _to_geodetic(self, slots, east, north):
+        lat0, lon0 = self.origin[slots, 0], self.origin[slots, 1]
+        lat = lat0 + numpy.degrees(north / EARTH_RADIUS_M)
+        lon = lon0 + numpy.degrees(east / (EARTH_RADIUS_M * numpy.cos(numpy.radians(lat0))))
+        return lat, (lon + 180.0) % 360.0 - 180.0
+
+    def _start(self, icao, t, lat, lon, alt):
+        slot = self._slots.get(icao)
+        if slot is None:
+            slot = self._allocate(icao)
+        self.origin[slot] = (lat, lon)
+        self.x[slot] = (0.0, 0.0, alt, 0.0, 0.0, 0.0)
+        # The velocity is unknown until a velocity report arrives: allow for anything up to about 600 kt.
+        self.P[slot] = numpy.diag([self.pos_noise ** 2, self.pos_noise ** 2, self.alt_noise ** 2,
+                                   300.0 ** 2, 300.0 ** 2, 30.0 ** 2])
+        self.time[slot] = self.last_measured[slot] = t
+        self.rejects[slot] = 0
+        return slot
+
+    def _update(self, slot, indices, z, noise, gate=None):
+        """Kalman update of slot with a measurement z of the state elements indices. Returns False if gated out."""
+        x = self.x[slot]
+        P = self.P[slot]
+        innovation = z - x[indices]
+        S = P[numpy.ix_(indices, indices)] + numpy.diag(noise ** 2)
+        S_inv = numpy.linalg.inv(S)
+        if gate is not None and innovation.dot(S_inv).dot(innovation) > gate * gate * len(indices):
+            return False
+        K = P[:, indices].dot(S_inv)
+        self.x[slot] = x + K.dot(innovation)
+        P = P - K.dot(P[indices, :])
+        self.P[slot] = (P + P.T) / 2.0
+        return True
+
+    def update_position(self, icao, t, lat, lon, alt=None):
+        """Update (or start) the track of icao with a position at time t (s). alt is in feet."""
+        alt = alt * METRES_PER_FOOT if alt is not None else None
+        slot = self._slots.get(icao)
+        if slot is None:
+            if alt is None:
+                return None
+            self.position_updates += 1
+            return self._start(icao, t, lat, lon, alt)
+
+        self._predict_one(slot, t)
+        east, north = self._to_local(slot, lat, lon)
+        if alt is not None:
+            indices, z = POSITION, numpy.array([east, north, alt])
+            noise = numpy.array([self.pos_noise, self.pos_noise, self.alt_noise])
+        else:
+            indices, z = POSITION[:2], numpy.array([east, north])
+            noise = numpy.array([self.pos_noise, self.pos_noise])
+
+        if not self._update(slot, indices, z, noise, self.gate):
+            self.rejects[slot] += 1
+            if self.rejects[slot] >= self.max_rejects and alt is not None:
+                self.position_updates += 1
+                return self._start(icao, t, lat, lon, alt)
+            return slot
+        self.rejects[slot] = 0
+        self.last_measured[slot] = t
+        self.position_updates += 1
+
+        if math.hypot(self.x[slot, 0], self.x[slot, 1]) > self.REORIGIN_DISTANCE:
+            lat, lon = self._to_geodetic([slot], self.x[slot, 0:1], self.x[slot, 1:2])
+            self.origin[slot] = (lat[0], lon[0])
+            self.x[slot, :2] = 0.0
+        return slot
+
+    def update_velocity(self, icao, t, vel_east=None, vel_north=None, vert_rate=None):
+        """Update the track of icao with a velocity (kt) and/or vertical rate (ft/min) at time t (s)."""
+        slot = self._slots.get(icao)
+        if slot is None:
+            return None
+        self._predict_one(slot, t)
+        indices, z, noise = [], [], []
+        if vel_east is not None and vel_north is not None:
+            indices.extend((3, 4))
+            z.extend((vel_east * MPS_PER_KNOT, vel_north * MPS_PER_KNOT))
+            noise.extend((self.vel_noise, self.vel_noise))
+        if vert_rate is not None:
+            indices.append(5)
+            z.append(vert_rate * MPS_PER_FPM)
+            noise.append(self.vert_rate_noise)
+        if indices:
+            self._update(slot, numpy.array(indices), numpy.array(z), numpy.array(noise))
+            self.last_measured[slot] = t
+            self.velocity_updates += 1
+        return slot
+
+    def states(self, now=None):
+        """The state of every track, extrapolated to now (s) if given without changing the tracks.
+
+        Returns a dict of arrays: icao, lat, lon, alt (ft), vel_east, vel_north (kt), vert_rate (ft/min)
+        and coasting (the time in seconds since the last measurement).
+        """
+        slots = numpy.flatnonzero(self.active)
+        x = self.x[slots]
+        if now is not None:
+            dt = numpy.maximum(now - self.time[slots], 0.0)
+            x = x.copy()
+            x[:, POSITION] += x[:, VELOCITY] * dt[:, None]
+        else:
+            now = self.time[slots]
+        lat, lon = self._to_geodetic(slots, x[:, 0], x[:, 1])
+        return {
+            'icao': self.icaos[slots],
+            'lat': lat,
+            'lon': lon,
+            'alt': x[:, 2] / METRES_PER_FOOT,
+            'vel_east': x[:, 3] / MPS_PER_KNOT,
+            'vel_north': x[:, 4] / MPS_PER_KNOT,
+            'vert_rate': x[:, 5] / MPS_PER_FPM,
+            'coasting': now - self.last_measured[slots],
+        }
+
+    def state(self, icao):
+        """The current state of one track as a dict like that of states() or None if it isn't tracked."""
+        slot = self._slots.get(icao)
+        if slot is None:
+            return None
+        x = self.x[slot]
+        lat, lon = self._to_geodetic([slot], x[0:1], x[1:2])
+        return {
+            'icao': icao,
+            'lat': lat[0],
+            'lon': lon[0],
+            'alt': x[2] / METRES_PER_FOOT,
+            'vel_east': x[3] / MPS_PER_KNOT,
+            'vel_north': x[4] / MPS_PER_KNOT,
+            'vert_rate': x[5] / MPS_PER_FPM,
+            'coasting': self.time[slot] - self.last_measured[slot],
+        }
+
+    # Listener interface for aircraft.AircraftRegistry
+    def aircraft_updated(self, aircraft, changed):
+        message = aircraft.message
+        if message is None:
+            return
+        params = message.params
+        t = aircraft.replytime
+        if 'CPR Latitude' in params and aircraft.position_time == t:
+            lat, lon = aircraft.position
+            self.update_position(aircraft.icao, t, lat, lon, params.get('Altitude (ft)'))
+        elif message.type == AIRBORNE_VELOCITY:
+            # Only what this message gives: an airspeed message has no east/north velocity.
+            self.update_velocity(aircraft.icao, t, params.get('Velocity East (kt)'), params.get('Velocity North (kt)'),
+                                 params.get('Vertical Rate (ft/min)'))
+
+    def aircraft_removed(self, aircraft):
+        if aircraft.icao in self._slots:
+            self.remove(aircraft.icao)
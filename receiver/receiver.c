@@ -34,6 +34,8 @@
 #include <math.h>
 #include <float.h>
 #include <inttypes.h>
+#include <getopt.h>
+#include <time.h>
 
 #include <rtl-sdr.h>
 
@@ -52,12 +54,54 @@
  */
 #define PROCESS_BLOCK_SIZE (256 * 1024)
 
-// Maximum number of known ICAO numbers to store
-#define ICAO_LIST_SIZE 256
+// Known aircraft table configuration. Both can be changed on the command line (-c and -t).
+#define ICAO_TABLE_DEFAULT_SIZE 1024  // Default maximum number of known ICAO numbers to store
+#define ICAO_DEFAULT_TTL 60           // Default time (seconds) after which an aircraft that has not been heard is forgotten
 #define ICAO_N_BITS 24  // Number of bits in the ICAO address
 // The fast list is a big bitfield with 1 bit for each possible address.
 #define ICAO_FAST_LIST_SIZE ((1 << ICAO_N_BITS) / 32)  // Array of uint32_t so 32 aircraft per address
 
+/*
+ * Output queue configuration
+ * Decoded messages are passed from the sample processing thread to the output thread through a single producer, single consumer ring of
+ * OUTPUT_QUEUE_SIZE entries (a power of 2). The output thread formats them into a buffer of OUTPUT_BUFFER_SIZE bytes which is written out
+ * when it is full or the queue is empty. If the output can't keep up the queue fills and new messages are dropped (and counted) so that
+ * the sample processing never waits for the output. When the queue is empty the output thread waits on a condition variable, and the
+ * producer only takes the mutex to signal it while it is waiting.
+ */
+#define OUTPUT_QUEUE_SIZE 16384
+#define OUTPUT_BUFFER_SIZE (64 * 1024)
+#define OUTPUT_LINE_MAX 64             // Longest formatted output line (a long message is 56 characters)
+#define OUTPUT_IDLE_TIMEOUT 1          // Longest time (seconds) the output thread waits for a message, so that drops are still reported
+#define OUTPUT_REPORT_INTERVAL 10      // Minimum time (seconds) between reports of dropped messages
+
+/*
+ * Triggered capture configuration (-W)
+ * A window of raw samples is captured around each detected preamble: CAPTURE_MARGIN samples either side of the preamble, the longest
+ * message and the fractional delay filter span. A capture file starts with CAPTURE_MAGIC followed by a record for each window: a
+ * capture_header_t (native byte order) and then 2 * length bytes of raw IQ samples exactly as read from the hardware.
+ */
+#define CAPTURE_MAGIC "MSCAPT01"
+#define CAPTURE_MAGIC_LEN 8
+#define CAPTURE_MARGIN 16
+#define CAPTURE_WINDOW (CAPTURE_MARGIN + PREAMBLE_SAMPLES + MESSAGE_BITS_MAX * SAMPLES_PER_BIT + FILTER_LEN + CAPTURE_MARGIN)
+#define CAPTURE_FLAG_CRC_OK 0x1          // The message in the window was decoded (otherwise it was a failed CRC candidate)
+#define CAPTURE_FILTER_SHIFT 8           // The number of the filter that detected the preamble is stored in bits 8-15 of the flags
+#define CAPTURE_BUFFER_SIZE (1024 * 1024)
+
+/*
+ * Adaptive detection threshold configuration (-s)
+ * Running estimates of the noise floor are kept for each fractional delay filter: the mean and variance of the preamble correlation and
+ * the mean square magnitude of the samples. They are exponential moving averages over process blocks, each block having a weight of
+ * NOISE_ALPHA. Samples stronger than NOISE_MAG_CLIP times the magnitude floor are taken to be signal and left out of its estimate. With a
+ * sensitivity of s, a correlation peak is only a candidate if it exceeds the mean by s standard deviations (and detect_thresh), and a
+ * candidate is only demodulated if the mean power of its preamble pulses is at least 1 + s / 2 times the magnitude floor (at 1 + s a
+ * few weak replies which still decode were rejected). A sensitivity of zero turns the adaptive threshold off.
+ */
+#define DEFAULT_SENSITIVITY 2.0
+#define NOISE_ALPHA 0.125
+#define NOISE_MAG_CLIP 4.0
+
 // detect_thresh is the correlation peak threshold required for a decoding attempt. A threshold of zero means that the total energy
 // in the spaces is equal to the total energy in the marks -- quite a bad SNR.
 const float detect_thresh = 0.0;
@@ -122,10 +166,75 @@ pthread_cond_t go_process_cond;
 float soft_bits[MESSAGE_BITS_MAX] __attribute__ ((aligned (32)));
 int hard_bits[MESSAGE_BITS_MAX] __attribute__ ((aligned (32)));
 
-// The list of ICAO numbers of previously seen aircraft
-uint32_t icao_list[ICAO_LIST_SIZE];
+/*
+ * The table of previously seen aircraft
+ * Each entry records when the aircraft was last heard. Entries are kept on a doubly linked list in the order in which they were last
+ * heard (most recent at the head) so the least recently heard aircraft can be evicted when the table is full, and aircraft not heard for
+ * icao_ttl samples can be expired from the tail. A chained hash table maps ICAO numbers to entries so they can be refreshed. Membership
+ * tests use the fast list which is a big bitfield with 1 bit for each possible address.
+ */
+typedef struct {
+    uint32_t icao;
+    uint64_t last_seen;  // Timestamp in samples
+    int prev, next;      // LRU list links (the next link is also used for the free list)
+    int hash_next;       // Hash chain link
+} icao_entry_t;
+
+icao_entry_t *icao_table;
+int *icao_hash;
+uint32_t icao_hash_mask;
+int icao_table_size = ICAO_TABLE_DEFAULT_SIZE;
+uint64_t icao_ttl = (uint64_t) ICAO_DEFAULT_TTL * MODE_S_RATE;  // Zero disables expiry.
+int icao_lru_head = -1, icao_lru_tail = -1, icao_free = -1;
 uint32_t icao_fast_list[ICAO_FAST_LIST_SIZE];
-int icao_wrindex = 0;
+
+/*
+ * The output queue
+ * output_head is only written by the sample processing thread (the producer) and output_tail only by the output thread (the consumer). Each
+ * side reads the other's index with acquire semantics and publishes its own with release semantics so no lock is needed.
+ */
+typedef struct {
+    uint64_t timestamp;  // In samples
+    uint32_t icao;
+    uint8_t filter_no;
+    uint8_t n_bytes;     // Number of message bytes excluding the CRC
+    uint8_t data[(MESSAGE_BITS_MAX - 24) / 8];
+} output_msg_t;
+
+output_msg_t output_queue[OUTPUT_QUEUE_SIZE];
+uint32_t output_head = 0, output_tail = 0;
+uint64_t output_dropped = 0;  // Messages dropped because the queue was full (written by the producer)
+uint32_t output_max_depth = 0;
+int output_exiting = 0;
+int output_waiting = 0;  // Set while the output thread is waiting for a message
+pthread_mutex_t output_mutex = PTHREAD_MUTEX_INITIALIZER;
+pthread_cond_t output_cond = PTHREAD_COND_INITIALIZER;
+
+// Record header in a triggered capture file
+typedef struct {
+    uint64_t offset;  // Timestamp (in samples) of the first sample in the window
+    uint32_t length;  // Number of samples in the window
+    uint32_t flags;
+} capture_header_t;
+
+// Triggered capture output file (NULL if not capturing) and whether to capture windows whose CRC failed
+FILE *capture_file = NULL;
+int capture_failed = 0;
+uint64_t capture_windows = 0;
+uint64_t capture_end = 0;  // Timestamp of the sample after the last one captured
+unsigned char capture_buf[CAPTURE_WINDOW * 2];
+
+// Set when the sample file being read is a triggered capture rather than a full dump, with the next record read from it
+int read_capture = 0;
+int capture_pending = 0;
+capture_header_t capture_next;
+
+// Noise floor estimates and the resulting thresholds for the current block, for each filter (see the adaptive detection threshold above)
+float sensitivity = DEFAULT_SENSITIVITY;
+int noise_init = 0;
+double noise_corr_mean[N_FILTERS], noise_corr_var[N_FILTERS], noise_mag[N_FILTERS];
+float block_thresh[N_FILTERS], block_pulse_min[N_FILTERS];
+uint64_t candidates = 0, candidates_rejected = 0, candidates_decoded = 0;
 
 // RTL-SDR device pointer
 rtlsdr_dev_t *dev;
@@ -239,6 +348,36 @@ static void rtl_sdr_init(int dev_index) {
 }
 
 
+/*
+ * Allocate the known aircraft table and its hash table. All entries start on the free list.
+ */
+static void icao_table_init(void) {
+    int i;
+    uint32_t hash_size = 1;
+
+    while (hash_size < 2 * (uint32_t) icao_table_size)
+        hash_size <<= 1;
+    icao_hash_mask = hash_size - 1;
+
+    icao_table = (icao_entry_t *) malloc(sizeof(icao_entry_t) * icao_table_size);
+    icao_hash = (int *) malloc(sizeof(int) * hash_size);
+    if (icao_table == NULL || icao_hash == NULL) {
+        fprintf(stderr, "Could not allocate the known aircraft table\n");
+        exit(1);
+    }
+
+    for (i = 0; i < icao_table_size; ++i) {
+        icao_table[i].icao = 0;
+        icao_table[i].next = (i + 1 < icao_table_size) ? i + 1 : -1;
+    }
+    icao_free = 0;
+    for (i = 0; i < (int) hash_size; ++i)
+        icao_hash[i] = -1;
+    for (i = 0; i < ICAO_FAST_LIST_SIZE; ++i)
+        icao_fast_list[i] = 0;
+}
+
+
 /* Demodulation, Error Detection and Error Correction Functions ======================================================================================= */
 
 /*
@@ -258,42 +397,172 @@ static inline int icao_fast_lookup(uint32_t icao) {
         return 1;
 }
 
+static inline uint32_t icao_hash_index(uint32_t icao) {
+    return (icao * 2654435761u) >> 8 & icao_hash_mask;
+}
+
+// Unlink table entry n from the LRU list.
+static inline void icao_lru_unlink(int n) {
+    if (icao_table[n].prev >= 0)
+        icao_table[icao_table[n].prev].next = icao_table[n].next;
+    else
+        icao_lru_head = icao_table[n].next;
+    if (icao_table[n].next >= 0)
+        icao_table[icao_table[n].next].prev = icao_table[n].prev;
+    else
+        icao_lru_tail = icao_table[n].prev;
+}
+
+// Put table entry n at the head (most recently heard end) of the LRU list.
+static inline void icao_lru_push_front(int n) {
+    icao_table[n].prev = -1;
+    icao_table[n].next = icao_lru_head;
+    if (icao_lru_head >= 0)
+        icao_table[icao_lru_head].prev = n;
+    else
+        icao_lru_tail = n;
+    icao_lru_head = n;
+}
+
 /*
- * Add a new ICAO number to the lists of known aircraft.
- * Oldest entries are overwritten by newest ones. The function returns 0 if the new ICAO number was
- * successfully added or if it was already there. -1 is returned if the number is invalid.
+ * Remove table entry n from the known aircraft and return it to the free list.
  */
-static inline int icao_add(uint32_t icao) {
+static void icao_remove(int n) {
+    uint32_t icao = icao_table[n].icao;
+    int *link = &icao_hash[icao_hash_index(icao)];
+
+    while (*link != n)  // Find the link pointing to n in the hash chain.
+        link = &icao_table[*link].hash_next;
+    *link = icao_table[n].hash_next;
+
+    icao_lru_unlink(n);
+    icao_fast_list[icao>>5] &= ~(1 << (icao & 0x1f));
+    icao_table[n].icao = 0;
+    icao_table[n].next = icao_free;
+    icao_free = n;
+
+    if (debug)
+        fprintf(stderr, "Removed %.6x\n", icao);
+}
+
+/*
+ * Add an ICAO number to the table of known aircraft or refresh its entry if it is already there.
+ * now is the current timestamp in samples. If the table is full, the least recently heard aircraft is evicted. The function returns
+ * 0 if the ICAO number was successfully added or refreshed. -1 is returned if the number is invalid.
+ */
+static int icao_add(uint32_t icao, uint64_t now) {
+    int n;
+
     if (icao == 0 || icao >= ((1 << ICAO_N_BITS) - 1))
         return -1;
-    else if ((icao_fast_list[icao>>5] >> (icao & 0x1f)) & 1)  // It's already there.
+
+    if ((icao_fast_list[icao>>5] >> (icao & 0x1f)) & 1) {
+        // It's already there so just refresh it.
+        for (n = icao_hash[icao_hash_index(icao)]; icao_table[n].icao != icao; n = icao_table[n].hash_next)
+            ;
+        icao_table[n].last_seen = now;
+        if (n != icao_lru_head) {
+            icao_lru_unlink(n);
+            icao_lru_push_front(n);
+        }
         return 0;
-    else {
-        uint32_t old;
-        // Clear the previous entry from the fast list if it exists.
-        if ((old = icao_list[icao_wrindex]) != 0)
-            icao_fast_list[old>>5] &= ~(1 << (old & 0x1f));
+    }
 
-        // Write the new entry to the slow list.
-        icao_list[icao_wrindex++] = icao;
-        if (icao_wrindex >= ICAO_LIST_SIZE)  // Wrap the write index.
-            icao_wrindex = 0;
+    if (icao_free < 0)  // The table is full so evict the least recently heard aircraft.
+        icao_remove(icao_lru_tail);
+    n = icao_free;
+    icao_free = icao_table[n].next;
 
-        // Write the new entry to the fast list.
-        icao_fast_list[icao>>5] |= (1 << (icao & 0x1f));
+    icao_table[n].icao = icao;
+    icao_table[n].last_seen = now;
+    icao_table[n].hash_next = icao_hash[icao_hash_index(icao)];
+    icao_hash[icao_hash_index(icao)] = n;
+    icao_lru_push_front(n);
+    icao_fast_list[icao>>5] |= (1 << (icao & 0x1f));
 
-        if (debug)
-            fprintf(stderr, "Added %.6x\n", icao);
+    if (debug)
+        fprintf(stderr, "Added %.6x\n", icao);
 
-        return 0;
+    return 0;
+}
+
+/*
+ * Forget the aircraft which haven't been heard for more than icao_ttl samples. now is the current timestamp in samples.
+ */
+static void icao_expire(uint64_t now) {
+    if (!icao_ttl)
+        return;
+    while (icao_lru_tail >= 0 && now - icao_table[icao_lru_tail].last_seen > icao_ttl)
+        icao_remove(icao_lru_tail);
+}
+
+/*
+ * Preload the table of known aircraft from a file of hex ICAO numbers (one per line, optionally prefixed with 0x).
+ * Aircraft should be listed least recently heard first. Lines which can't be parsed are ignored.
+ */
+static void icao_preload(const char *path) {
+    FILE *f;
+    char line[64];
+    char *end;
+    unsigned long icao;
+    int n_loaded = 0;
+
+    if ((f = fopen(path, "r")) == NULL) {
+        fprintf(stderr, "Could not open %s: %s\n", path, strerror(errno));
+        exit(1);
+    }
+    while (fgets(line, sizeof(line), f) != NULL) {
+        icao = strtoul(line, &end, 16);
+        if (end != line && !icao_add((uint32_t) icao, 0))
+            ++n_loaded;
+    }
+    fclose(f);
+    fprintf(stderr, "Preloaded %d known aircraft from %s\n", n_loaded, path);
+}
+
+/*
+ * Queue a decoded message (in hard_bits) for the output thread. This never blocks: if the queue is full the message is dropped.
+ */
+static inline void output_enqueue(int filter_no, int sample_start, uint32_t icao) {
+    uint32_t head = output_head;  // Only this thread writes output_head.
+    uint32_t depth = head - __atomic_load_n(&output_tail, __ATOMIC_ACQUIRE);
+    output_msg_t *msg;
+    int i, j;
+
+    if (depth >= OUTPUT_QUEUE_SIZE) {
+        __atomic_store_n(&output_dropped, output_dropped + 1, __ATOMIC_RELAXED);
+        return;
+    }
+    if (depth >= output_max_depth)
+        __atomic_store_n(&output_max_depth, depth + 1, __ATOMIC_RELAXED);
+
+    msg = &output_queue[head & (OUTPUT_QUEUE_SIZE - 1)];
+    msg->timestamp = block_no * PROCESS_BLOCK_SIZE + sample_start;
+    msg->icao = icao;
+    msg->filter_no = filter_no;
+    msg->n_bytes = (((hard_bits[0]) ? MESSAGE_BITS_MAX : MESSAGE_BITS_SHORT) - 24) / 8;  // We don't need to output the CRC.
+    for (i = 0; i < msg->n_bytes; ++i) {
+        msg->data[i] = 0;
+        for (j = 0; j < 8; ++j)
+            msg->data[i] = (msg->data[i] << 1) | hard_bits[8*i+j];
+    }
+
+    // Sequentially consistent with the output thread's store to output_waiting and load of output_head, so either it sees the message or
+    // we see that it is waiting and wake it.
+    __atomic_store_n(&output_head, head + 1, __ATOMIC_SEQ_CST);
+    if (__atomic_load_n(&output_waiting, __ATOMIC_SEQ_CST)) {
+        pthread_mutex_lock(&output_mutex);
+        pthread_cond_signal(&output_cond);
+        pthread_mutex_unlock(&output_mutex);
     }
 }
 
 /*
- * Display the contents of a succesfully decoded message and add the ICAO No. to the list of known aircraft if necessary.
+ * Queue a succesfully decoded message for output and add the ICAO No. to the list of known aircraft if necessary.
  */
 static void message_post_process(int filter_no, int sample_start, uint32_t icao_from_crc, int icao_in_message) {
     uint32_t icao_from_message = 0;
+    uint64_t now = block_no * PROCESS_BLOCK_SIZE + sample_start;
     int i;
 
     // If this is a DF11, DF17 or DF18 then extract the ICAO number and add it to the list if it isn't already there.
@@ -301,22 +570,15 @@ static void message_post_process(int filter_no, int sample_start, uint32_t icao_
         for (i = 8; i < 32; ++i)  // The aircraft address is stored in bits [8:31] for these message types (big endian).
             icao_from_message = (icao_from_message << 1) | hard_bits[i];
 
-        if (icao_add(icao_from_message)) {
+        if (icao_add(icao_from_message, now)) {
             fprintf(stderr, "Received valid message containing invalid ICAO number: 0x%.6x\n", icao_from_message);
             return;
         }
+    } else {
+        icao_add(icao_from_crc, now);  // The aircraft is known. Refresh its entry since we've just heard it.
     }
 
-    // Print the timestamp in samples and the ICAO number.
-    printf("%.14llu.%.2d: ", block_no * PROCESS_BLOCK_SIZE + sample_start, 100 * filter_no / N_FILTERS);
-    printf("0x%.6x, ", (icao_in_message) ? icao_from_message : icao_from_crc);
-
-    // Print the message content in hex.
-    printf("0x");
-    for (i = 0; i < ((hard_bits[0]) ? MESSAGE_BITS_MAX : MESSAGE_BITS_SHORT) - 24; i += 4)  // We don't need to print the CRC (hence the - 24).
-        printf("%x", hard_bits[i] << 3 | hard_bits[i+1] << 2 | hard_bits[i+2] << 1 | hard_bits[i+3]);
-
-    printf(";\n");
+    output_enqueue(filter_no, sample_start, (icao_in_message) ? icao_from_message : icao_from_crc);
 }
 
 /*
@@ -586,6 +848,141 @@ static void read_samples_file(void) {
         exiting = 1;
 }
 
+/*
+ * Read the next record header from a capture file into capture_next. Returns 0 at the end of the file.
+ */
+static int read_capture_header(void) {
+    if (fread(&capture_next, sizeof(capture_next), 1, dumpfile) != 1)
+        return 0;
+    if (capture_next.length > PROCESS_BLOCK_SIZE || capture_next.offset % PROCESS_BLOCK_SIZE + capture_next.length > PROCESS_BLOCK_SIZE) {
+        fprintf(stderr, "Corrupt capture record at offset %" PRIu64 "\n", capture_next.offset);
+        return 0;
+    }
+    return 1;
+}
+
+/*
+ * Read the windows of a triggered capture file which fall in the next process block containing any. The windows are placed at their
+ * original positions within the block, the rest of which is filled with a constant, and block_no is set so that timestamps come out as
+ * they were when the samples were captured.
+ */
+static void read_samples_capture(void) {
+    uint64_t block;
+    int i, start;
+
+    if (!capture_pending) {
+        exiting = 1;
+        return;
+    }
+
+    for (i = 0; i < PROCESS_BLOCK_SIZE; ++i) {
+        sbuf_re[i] = 1.0;
+        sbuf_im[i] = 1.0;
+    }
+    block = capture_next.offset / PROCESS_BLOCK_SIZE;
+    do {
+        start = capture_next.offset % PROCESS_BLOCK_SIZE;
+        if (fread(filebuf + 2 * start, 2, capture_next.length, dumpfile) != capture_next.length) {
+            capture_pending = 0;
+            break;
+        }
+        for (i = start; i < start + (int) capture_next.length; ++i) {
+            sbuf_re[i] = (float) filebuf[2*i] - 128.0;
+            sbuf_im[i] = (float) filebuf[2*i+1] - 128.0;
+        }
+        capture_pending = read_capture_header();
+    } while (capture_pending && capture_next.offset / PROCESS_BLOCK_SIZE == block);
+    block_no = block;
+}
+
+/*
+ * Write the raw samples around a detected preamble at sample j of the current block to the capture file.
+ */
+static void capture_window(int filter_no, int j, int crc_ok) {
+    capture_header_t header;
+    uint64_t block_start = block_no * PROCESS_BLOCK_SIZE;
+    int start = (j > CAPTURE_MARGIN) ? j - CAPTURE_MARGIN : 0;
+    int end = (j + CAPTURE_WINDOW - CAPTURE_MARGIN < PROCESS_BLOCK_SIZE) ? j + CAPTURE_WINDOW - CAPTURE_MARGIN : PROCESS_BLOCK_SIZE;
+    int i;
+
+    // Don't capture any samples twice where windows overlap.
+    if (block_start + start < capture_end)
+        start = capture_end - block_start;
+    if (start >= end)
+        return;
+    capture_end = block_start + end;
+
+    // The floating point samples are exact conversions of the hardware's bytes so this recovers them unchanged.
+    for (i = start; i < end; ++i) {
+        capture_buf[2*(i-start)] = (unsigned char) (sbuf_re[i] + 128.0);
+        capture_buf[2*(i-start)+1] = (unsigned char) (sbuf_im[i] + 128.0);
+    }
+    header.offset = block_start + start;
+    header.length = end - start;
+    header.flags = (crc_ok ? CAPTURE_FLAG_CRC_OK : 0) | filter_no << CAPTURE_FILTER_SHIFT;
+    fwrite(&header, sizeof(header), 1, capture_file);
+    fwrite(capture_buf, 2, header.length, capture_file);
+    ++capture_windows;
+}
+
+/*
+ * Update the noise floor estimates with the preamble correlations and magnitudes of the current block and set the thresholds for searching
+ * it. Without an adaptive threshold (or when replaying a capture, whose blocks are mostly filler) the threshold is just detect_thresh.
+ */
+static void update_thresholds(void) {
+    int i, j, n, n_mag;
+    double sum, sum_sq, sum_mag, mean, var, mag, clip;
+    float x;
+
+    if (sensitivity <= 0.0 || read_capture) {
+        for (i = 0; i < N_FILTERS; ++i) {
+            block_thresh[i] = detect_thresh;
+            block_pulse_min[i] = 0.0;
+        }
+        return;
+    }
+
+    for (i = 0; i < N_FILTERS; ++i) {
+        sum = sum_sq = sum_mag = 0.0;
+        n = n_mag = 0;
+        clip = (noise_init) ? NOISE_MAG_CLIP * noise_mag[i] : INFINITY;
+        for (j = 0; j < PROCESS_BLOCK_SIZE; ++j) {
+            x = detect_buf[i][j];
+            if (x >= -1.0 && x <= 1.0) {  // Leaves out the NaNs from blocks of zeros.
+                sum += x;
+                sum_sq += x * x;
+                ++n;
+            }
+            if (interp_buf[i][j] < clip) {
+                sum_mag += interp_buf[i][j];
+                ++n_mag;
+            }
+        }
+        if (n == 0 || n_mag == 0)
+            continue;  // Keep the previous estimates.
+        mean = sum / n;
+        var = sum_sq / n - mean * mean;
+        mag = sum_mag / n_mag;
+        if (noise_init) {
+            noise_corr_mean[i] += NOISE_ALPHA * (mean - noise_corr_mean[i]);
+            noise_corr_var[i] += NOISE_ALPHA * (var - noise_corr_var[i]);
+            noise_mag[i] += NOISE_ALPHA * (mag - noise_mag[i]);
+        } else {
+            noise_corr_mean[i] = mean;
+            noise_corr_var[i] = var;
+            noise_mag[i] = mag;
+        }
+        block_thresh[i] = noise_corr_mean[i] + sensitivity * sqrt(noise_corr_var[i]);
+        if (block_thresh[i] < detect_thresh)
+            block_thresh[i] = detect_thresh;
+        block_pulse_min[i] = (1.0 + 0.5 * sensitivity) * noise_mag[i];
+        if (debug)
+            fprintf(stderr, "Filter %d: correlation %.3f +/- %.3f, magnitude floor %.1f, threshold %.3f\n", i, noise_corr_mean[i],
+                    sqrt(noise_corr_var[i]), noise_mag[i], block_thresh[i]);
+    }
+    noise_init = 1;
+}
+
 /*
  * Main sample processing function
  * This handles application of the fractional delay filters and preamble searching.
@@ -593,13 +990,17 @@ static void read_samples_file(void) {
 void *process_samples(void *arg) {
     float accum_re, accum_im;
     float max_corr;
+    float pulses;
     int max_i, max_j;
-    int i, j, k;
+    int in_run;
+    int i, j, k, n;
     
     pthread_mutex_lock(&sbuf_mutex);
     for (;;) {
         // Read from a file or wait for read_samples() to get some samples.
-        if (read_file)
+        if (read_capture)
+            read_samples_capture();
+        else if (read_file)
             read_samples_file();
         else
             pthread_cond_wait(&go_process_cond, &sbuf_mutex);  // Mutex is unlocked while waiting so read_samples() can lock it.
@@ -611,6 +1012,8 @@ void *process_samples(void *arg) {
         
         // If we get here then sbuf should be filled with PROCESS_BLOCK_SIZE fresh samples.
         
+        icao_expire(block_no * PROCESS_BLOCK_SIZE);
+        
         // Run though each fractional delay filter and apply it along the length of the block of samples.
         // Calculate the square magnitude of each interpolated sample and store it in interp_buf.
         for (i = 0; i < N_FILTERS; ++i) {
@@ -642,21 +1045,26 @@ void *process_samples(void *arg) {
             }
         }
         
-        // Examine the preamble correlation results and look for possible transmissions. We search detect_buf for values exceeding detect_thresh.
-        // Whenever a group of consecutive correlation values exceed the threshold, the algorithm will only attempt to decode the maximum one.
-        max_corr = detect_thresh - 1.0;
+        update_thresholds();
+
+        // Examine the preamble correlation results and look for possible transmissions. We search detect_buf for values exceeding each
+        // filter's threshold. Whenever a group of consecutive correlation values exceed the threshold, the algorithm will only attempt to
+        // decode the maximum one.
+        in_run = 0;
+        max_corr = 0.0;
         max_i = 0;
         max_j = 0;
         for (j = 0; j < PROCESS_BLOCK_SIZE; ++j) {  // These loops search detect_buf in chronological order
             for (i = 0; i < N_FILTERS; ++i) {
-                if (detect_buf[i][j] > detect_thresh) {
+                if (detect_buf[i][j] > block_thresh[i]) {
                     // Correlation value is above the threshold -- update the running maximum.
-                    if (detect_buf[i][j] > max_corr) {
+                    if (!in_run || detect_buf[i][j] > max_corr) {
                         max_corr = detect_buf[i][j];
                         max_i = i;
                         max_j = j;
+                        in_run = 1;
                     }
-                } else if (max_corr > detect_thresh) {
+                } else if (in_run) {
                     /*
                      * Correlation value has dropped below the threshold but it was above it. We will try to decode a message starting at the
                      * maximum stored correlation value.
@@ -665,9 +1073,24 @@ void *process_samples(void *arg) {
                      * lost. The probability of this happening for any given message is (MESSAGE_BITS_MAX * SAMPLES_PER_BIT) / PROCESS_BLOCK_SIZE. It
                      * is quite easy to keep this number and the associated packet loss rate very small by sizing PROCESS_BLOCK_SIZE appropriately.
                      */
-                    if (PROCESS_BLOCK_SIZE - max_j >= MESSAGE_BITS_MAX * SAMPLES_PER_BIT)
-                        j += demod_decode(max_i, max_j);  // This will make the loop jump forward by the number of succesfully demodulated samples.
-                    max_corr = detect_thresh - 1.0;  // Reset the running maximum
+                    if (PROCESS_BLOCK_SIZE - max_j >= MESSAGE_BITS_MAX * SAMPLES_PER_BIT) {
+                        ++candidates;
+                        // Preambles which are barely above the noise floor aren't worth the demodulation and CRC effort.
+                        pulses = 0.25 * (interp_buf[max_i][max_j] + interp_buf[max_i][max_j+2] + interp_buf[max_i][max_j+7] +
+                                         interp_buf[max_i][max_j+9]);
+                        if (pulses < block_pulse_min[max_i]) {
+                            ++candidates_rejected;
+                            n = 0;
+                        } else {
+                            n = demod_decode(max_i, max_j);
+                            if (n)
+                                ++candidates_decoded;
+                            if (capture_file && (n || capture_failed))
+                                capture_window(max_i, max_j, n);
+                        }
+                        j += n;  // This will make the loop jump forward by the number of succesfully demodulated samples.
+                    }
+                    in_run = 0;  // Reset the running maximum
                     break;  // Break out of the inner loop so that i is reset.
                 }
             }
@@ -678,12 +1101,188 @@ void *process_samples(void *arg) {
 }
 
 
+/* Output Functions =================================================================================================================================== */
+
+/*
+ * Format a queued message as a line of output: the timestamp in samples, the ICAO No. and the message content in hex. Returns the length.
+ */
+static int output_format(const output_msg_t *msg, char *line) {
+    static const char hex[] = "0123456789abcdef";
+    int len, i;
+
+    len = sprintf(line, "%.14" PRIu64 ".%.2d: 0x%.6x, 0x", msg->timestamp, 100 * msg->filter_no / N_FILTERS, msg->icao);
+    for (i = 0; i < msg->n_bytes; ++i) {
+        line[len++] = hex[msg->data[i] >> 4];
+        line[len++] = hex[msg->data[i] & 0xf];
+    }
+    line[len++] = ';';
+    line[len++] = '\n';
+    return len;
+}
+
+/*
+ * Write the whole of buf to stdout. Returns -1 if the output has gone away.
+ */
+static int output_write(const char *buf, size_t len) {
+    ssize_t n;
+
+    while (len > 0) {
+        if ((n = write(STDOUT_FILENO, buf, len)) < 0) {
+            if (errno == EINTR)
+                continue;
+            return -1;
+        }
+        buf += n;
+        len -= n;
+    }
+    return 0;
+}
+
+static void output_report(void) {
+    fprintf(stderr, "Output queue: depth %u, max depth %u, %" PRIu64 " messages dropped\n",
+            __atomic_load_n(&output_head, __ATOMIC_ACQUIRE) - output_tail, __atomic_load_n(&output_max_depth, __ATOMIC_RELAXED),
+            __atomic_load_n(&output_dropped, __ATOMIC_RELAXED));
+}
+
+/*
+ * Wait until there is a message after head in the output queue, we are exiting or OUTPUT_IDLE_TIMEOUT seconds have passed.
+ */
+static void output_wait(uint32_t head) {
+    struct timespec deadline;
+
+    clock_gettime(CLOCK_REALTIME, &deadline);
+    deadline.tv_sec += OUTPUT_IDLE_TIMEOUT;
+    pthread_mutex_lock(&output_mutex);
+    __atomic_store_n(&output_waiting, 1, __ATOMIC_SEQ_CST);
+    while (head == __atomic_load_n(&output_head, __ATOMIC_SEQ_CST) && !__atomic_load_n(&output_exiting, __ATOMIC_ACQUIRE))
+        if (pthread_cond_timedwait(&output_cond, &output_mutex, &deadline) == ETIMEDOUT)
+            break;
+    __atomic_store_n(&output_waiting, 0, __ATOMIC_RELAXED);
+    pthread_mutex_unlock(&output_mutex);
+}
+
+/*
+ * Tell the output thread to write what is left in the queue and finish.
+ */
+static void output_finish(void) {
+    pthread_mutex_lock(&output_mutex);
+    __atomic_store_n(&output_exiting, 1, __ATOMIC_RELEASE);
+    pthread_cond_signal(&output_cond);
+    pthread_mutex_unlock(&output_mutex);
+}
+
+/*
+ * Output thread
+ * Drains the output queue into a large buffer which is written to stdout whenever it fills or the queue runs dry. Any dropped messages are
+ * reported (at most every OUTPUT_REPORT_INTERVAL seconds).
+ */
+void *output_messages(void *arg) {
+    static char buf[OUTPUT_BUFFER_SIZE];
+    size_t len = 0;
+    uint32_t tail = output_tail;  // Only this thread writes output_tail.
+    uint32_t head;
+    uint64_t reported_dropped = 0, dropped;
+    time_t last_report = 0, now;
+    int failed = 0;
+
+    for (;;) {
+        head = __atomic_load_n(&output_head, __ATOMIC_ACQUIRE);
+        if (head == tail) {
+            // The queue is empty: write what we have and wait for more.
+            if (len > 0 && !failed && output_write(buf, len))
+                failed = 1;
+            len = 0;
+
+            dropped = __atomic_load_n(&output_dropped, __ATOMIC_RELAXED);
+            if (dropped != reported_dropped && (now = time(NULL)) - last_report >= OUTPUT_REPORT_INTERVAL) {
+                output_report();
+                reported_dropped = dropped;
+                last_report = now;
+            }
+
+            if (__atomic_load_n(&output_exiting, __ATOMIC_ACQUIRE) && head == __atomic_load_n(&output_head, __ATOMIC_ACQUIRE))
+                break;
+            output_wait(head);
+            continue;
+        }
+
+        while (tail != head) {
+            if (OUTPUT_BUFFER_SIZE - len < OUTPUT_LINE_MAX) {
+                if (!failed && output_write(buf, len))
+                    failed = 1;
+                len = 0;
+            }
+            len += output_format(&output_queue[tail & (OUTPUT_QUEUE_SIZE - 1)], buf + len);
+            ++tail;
+            // Hand the slot back to the producer.
+            __atomic_store_n(&output_tail, tail, __ATOMIC_RELEASE);
+        }
+    }
+
+    if (failed)
+        fprintf(stderr, "Error writing output: %s\n", strerror(errno));
+    return NULL;
+}
+
+
 /* ==================================================================================================================================================== */
 
+static void usage(const char *name) {
+    fprintf(stderr, "Usage: %s [-c table_size] [-t ttl] [-l known_aircraft] [-s sensitivity] [-W capture_file [-f]] [-w dump_file | sample_file]\n"
+                    "    -c  maximum number of known aircraft to track for CRC validation (default %d)\n"
+                    "    -t  seconds after which an aircraft that has not been heard is forgotten, 0 for never (default %d)\n"
+                    "    -l  preload known aircraft from a file of hex ICAO numbers\n"
+                    "    -s  standard deviations above the noise floor required for a preamble, 0 for a fixed threshold (default %.1f)\n"
+                    "    -W  while decoding, write the raw samples around each decoded message to capture_file\n"
+                    "    -f  also capture the samples around preambles whose messages failed the CRC\n"
+                    "    -w  write raw samples from the hardware to dump_file instead of decoding them\n"
+                    "    sample_file is a previously written dump or capture file to decode instead of reading the hardware\n",
+            name, ICAO_TABLE_DEFAULT_SIZE, ICAO_DEFAULT_TTL, DEFAULT_SENSITIVITY);
+    exit(1);
+}
+
 int main(int argc, char *argv[]) {
     int i, j;
+    int opt;
+    char *write_path = NULL;
+    char *preload_path = NULL;
+    char *capture_path = NULL;
+    char magic[CAPTURE_MAGIC_LEN];
     pthread_t reader_thread;
     pthread_t sample_process_thread;
+    pthread_t output_thread;
+    
+    while ((opt = getopt(argc, argv, "c:t:l:s:w:W:f")) != -1) {
+        switch (opt) {
+            case 'c':
+                if ((icao_table_size = atoi(optarg)) < 1)
+                    usage(argv[0]);
+                break;
+            case 't':
+                icao_ttl = (uint64_t) atoi(optarg) * MODE_S_RATE;
+                break;
+            case 'l':
+                preload_path = optarg;
+                break;
+            case 's':
+                if ((sensitivity = atof(optarg)) < 0.0)
+                    usage(argv[0]);
+                break;
+            case 'w':
+                write_path = optarg;
+                break;
+            case 'W':
+                capture_path = optarg;
+                break;
+            case 'f':
+                capture_failed = 1;
+                break;
+            default:
+                usage(argv[0]);
+        }
+    }
+    if (argc - optind > 1 || (write_path && (optind < argc || capture_path)) || (capture_failed && !capture_path))
+        usage(argv[0]);
     
     init_filters();
     
@@ -696,36 +1295,42 @@ int main(int argc, char *argv[]) {
         for (j = 0; j < PROCESS_BLOCK_SIZE+PREAMBLE_SAMPLES; ++j)
             interp_buf[i][j] = 1.0;
     
-    // Initialise the aircraft address lists with zeros (zero is defined as an invalid address).
-    for (i = 0; i < ICAO_LIST_SIZE; ++i)
-        icao_list[i] = 0;
-    for (i = 0; i < ICAO_FAST_LIST_SIZE; ++i)
-        icao_fast_list[i] = 0;
+    // Initialise the known aircraft table.
+    icao_table_init();
+    if (preload_path)
+        icao_preload(preload_path);
     
     pthread_mutex_init(&sbuf_mutex, NULL);
     pthread_cond_init(&go_process_cond, NULL);
     
-    if (argc == 2) {
+    if (optind < argc) {
         // Read samples from a file
         read_file = 1;
         write_file = 0;
-        dumpfile = fopen(argv[1], "rb");
+        dumpfile = fopen(argv[optind], "rb");
         if (dumpfile == NULL) {
-            fprintf(stderr, "Could not open %s: %s\n", argv[1], strerror(errno));
+            fprintf(stderr, "Could not open %s: %s\n", argv[optind], strerror(errno));
             exit(1);
         }
         if ((filebuf = (unsigned char *) malloc(sizeof(unsigned char) * PROCESS_BLOCK_SIZE * 2)) == NULL) {
             fprintf(stderr, "Could not allocate file buffer\n");
             exit(1);
         }
-    } else if (argc == 3 && !strcmp(argv[1], "-w")) {
+        // A triggered capture file is recognised by its magic number. Anything else is a raw dump.
+        if (fread(magic, 1, CAPTURE_MAGIC_LEN, dumpfile) == CAPTURE_MAGIC_LEN && !memcmp(magic, CAPTURE_MAGIC, CAPTURE_MAGIC_LEN)) {
+            read_capture = 1;
+            capture_pending = read_capture_header();
+        } else {
+            rewind(dumpfile);
+        }
+    } else if (write_path) {
         // Write samples to a file
         read_file = 0;
         write_file = 1;
         rtl_sdr_init(0);
-        dumpfile = fopen(argv[2], "wb");
+        dumpfile = fopen(write_path, "wb");
         if (dumpfile == NULL) {
-            fprintf(stderr, "Could not open %s: %s\n", argv[2], strerror(errno));
+            fprintf(stderr, "Could not open %s: %s\n", write_path, strerror(errno));
             exit(1);
         }
     } else {
@@ -735,19 +1340,44 @@ int main(int argc, char *argv[]) {
         rtl_sdr_init(0);
     }
     
+    if (capture_path) {
+        if ((capture_file = fopen(capture_path, "wb")) == NULL) {
+            fprintf(stderr, "Could not open %s: %s\n", capture_path, strerror(errno));
+            exit(1);
+        }
+        // A large buffer so that the sample processing thread rarely has to wait for the disk
+        setvbuf(capture_file, NULL, _IOFBF, CAPTURE_BUFFER_SIZE);
+        fwrite(CAPTURE_MAGIC, 1, CAPTURE_MAGIC_LEN, capture_file);
+    }
+    
+    pthread_create(&output_thread, NULL, output_messages, NULL);
     pthread_create(&sample_process_thread, NULL, process_samples, NULL);
     pthread_create(&reader_thread, NULL, start_reader_thread, NULL);
     pthread_join(sample_process_thread, NULL);
     pthread_join(reader_thread, NULL);
+    output_finish();
+    pthread_join(output_thread, NULL);
+    if (!write_file)
+        output_report();
+    if (!write_file)
+        fprintf(stderr, "Preamble candidates: %" PRIu64 ", %" PRIu64 " rejected by the noise floor, %" PRIu64 " decoded\n", candidates,
+                candidates_rejected, candidates_decoded);
     
     if (read_file || write_file)
         fclose(dumpfile);
+    if (capture_file) {
+        fclose(capture_file);
+        fprintf(stderr, "Captured %" PRIu64 " windows\n", capture_windows);
+    }
     
     if (read_file)
         free(filebuf);
     else
         rtlsdr_close(dev);
     
+    free(icao_table);
+    free(icao_hash);
+    
     pthread_mutex_destroy(&sbuf_mutex);
     pthread_cond_destroy(&go_process_cond);
     